@@ -1,2 +1,3 @@
 from app.db.core import Base
-from app.db.models.item import Item
\ No newline at end of file
+from app.db.models.item import Item
+from app.db.models.upload import UploadSession
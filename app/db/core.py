@@ -1,23 +1,93 @@
+import random
+import time
 from asyncio import current_task
 
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 from sqlalchemy.ext.asyncio import (
     create_async_engine,
     AsyncSession,
     async_scoped_session,
 )
 
-from sqlalchemy.orm import declarative_base, sessionmaker
+from sqlalchemy import Select
+from sqlalchemy.orm import Session, declarative_base, sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
+from app.metrics import metrics
 from app.settings import get_settings
 
 settings = get_settings()
 
 Base = declarative_base()
 
-engine = create_async_engine(url=settings.POSTGRES_CONN_STRING)
+
+class MeteredPool(AsyncAdaptedQueuePool):
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            metrics.incr("db.pool.timeouts")
+            raise
+        finally:
+            metrics.observe("db.pool.checkout_wait", time.perf_counter() - started)
+
+
+engine_options = dict(
+    poolclass=MeteredPool,
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+    pool_timeout=settings.DB_POOL_TIMEOUT,
+    pool_recycle=settings.DB_POOL_RECYCLE,
+    pool_pre_ping=settings.DB_POOL_PRE_PING,
+    connect_args={
+        "prepared_statement_cache_size": settings.DB_PREPARED_STATEMENT_CACHE_SIZE
+    },
+)
+
+engine = create_async_engine(url=settings.POSTGRES_CONN_STRING, **engine_options)
+replica_engines = [
+    create_async_engine(url=replica_url, **engine_options)
+    for replica_url in settings.POSTGRES_REPLICA_CONN_STRINGS
+]
+
+metrics.gauge("db.pool.size", engine.sync_engine.pool.size)
+metrics.gauge("db.pool.checked_out", engine.sync_engine.pool.checkedout)
+metrics.gauge("db.pool.checked_in", engine.sync_engine.pool.checkedin)
+metrics.gauge("db.pool.overflow", engine.sync_engine.pool.overflow)
+
+
+class RoutingSession(Session):
+    # plain SELECTs go to one replica picked per session; anything else, and
+    # every statement after the session has written, goes to the primary
+    use_primary = False
+    _replica = None
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if self._flushing or not isinstance(clause, Select):
+            self.use_primary = True
+        if self.use_primary or not replica_engines:
+            return engine.sync_engine
+        if self._replica is None:
+            self._replica = random.choice(replica_engines)
+        return self._replica.sync_engine
+
+
+def pin_to_primary(session: AsyncSession) -> None:
+    session.sync_session.use_primary = True
+
+
+def is_pinned_to_primary(session: AsyncSession) -> bool:
+    return session.sync_session.use_primary
 
 
 session_factory = async_scoped_session(
-    sessionmaker(bind=engine, autocommit=False, autoflush=False, class_=AsyncSession),
+    sessionmaker(
+        bind=engine,
+        autocommit=False,
+        autoflush=False,
+        class_=AsyncSession,
+        sync_session_class=RoutingSession,
+    ),
     scopefunc=current_task,
 )
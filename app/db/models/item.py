@@ -1,4 +1,14 @@
-from sqlalchemy import Column, UUID, String, ForeignKey, Index, func
+from sqlalchemy import (
+    BigInteger,
+    Column,
+    DateTime,
+    UUID,
+    String,
+    Index,
+    func,
+    literal_column,
+)
+from sqlalchemy.dialects.postgresql import ARRAY
 
 
 from app.db.core import Base
@@ -7,23 +17,92 @@ ZERO_UUID = "00000000-0000-0000-0000-000000000000"
 
 
 class Item(Base):
+    # Hash partitioned on parent_id, so a folder listing reads one partition.
+    # The primary key, the parent_id foreign key (ON DELETE / ON UPDATE
+    # CASCADE) and the unique indexes on item_id and (name, parent_id) cannot
+    # be declared on the partitioned table; they are per-partition indexes and
+    # triggers, see migration c7d1a5e3f8b0. ItemIdRegistry keeps item_id
+    # unique across partitions.
     __tablename__ = "item"
 
-    item_id = Column(UUID(as_uuid=True), primary_key=True)
+    item_id = Column(UUID(as_uuid=True), nullable=False)
     name = Column(String, nullable=False)
-    parent_id = Column(
-        UUID(as_uuid=True),
-        ForeignKey("item.item_id", ondelete="CASCADE", onupdate="CASCADE"),
-    )
+    parent_id = Column(UUID(as_uuid=True))
     type = Column(String(1), nullable=False)
     path = Column(String)
+    # ids from the root down to the parent, maintained with path by the
+    # update_item_path trigger; `ancestor_ids @> ARRAY[x]` selects the subtree
+    # below x through ix_item_ancestor_ids
+    ancestor_ids = Column(ARRAY(UUID(as_uuid=True)), nullable=False, server_default="{}")
+
+    # captured while the object is uploaded, NULL for folders
+    size = Column(BigInteger)
+    content_type = Column(String)
+    # hex MD5 of the content; "<MD5 of the part MD5s>-<parts>" for multipart
+    # uploads, the same value S3 reports as ETag
+    checksum = Column(String)
+    modified_at = Column(DateTime(timezone=True))
+    # S3 key of the content when it differs from item_id: an overwrite
+    # uploads a new object and swaps this column, see OBJECT_KEY
+    object_key = Column(UUID(as_uuid=True))
+
+    __table_args__ = {"postgresql_partition_by": "HASH (parent_id)"}
+    __mapper_args__ = {"primary_key": [item_id]}
+
+
+class ItemIdRegistry(Base):
+    # one row per item, written by the register_item_id triggers on every
+    # partition; its primary key is the global unique index on item_id that
+    # the partitioned table cannot have, see migration d5f7a9c1e3b4
+    __tablename__ = "item_id_registry"
+
+    item_id = Column(UUID(as_uuid=True), primary_key=True)
+
+
+# Listing order: folders before files, then the sort key, then item_id as a
+# tie breaker. Constants are inlined rather than bound so queries match the
+# index expressions below; NULL keys are coalesced so keyset row comparisons
+# stay well defined.
+ITEM_TYPE_RANK = Item.type != literal_column("'d'")
+LISTING_ORDER_KEYS = {
+    "name": Item.name,
+    "size": func.coalesce(Item.size, literal_column("-1")),
+    "modified": func.coalesce(Item.modified_at, literal_column("'epoch'::timestamptz")),
+    "type": func.coalesce(Item.content_type, literal_column("''")),
+}
+
+# the key the content is stored under in S3
+OBJECT_KEY = func.coalesce(Item.object_key, Item.item_id)
+IS_FILE = Item.type == literal_column("'-'")
 
-    __table_args__ = (
-        Index("uix_item_id_name", item_id, name, unique=True),
-        Index(
-            "uix_folder_name_parent_id_1",
-            name,
-            func.coalesce(parent_id, ZERO_UUID),
-            unique=True,
-        ),
-    )
+Index("ix_item_object_key", OBJECT_KEY, postgresql_where=IS_FILE)
+Index("ix_item_ancestor_ids", Item.ancestor_ids, postgresql_using="gin")
+Index("ix_item_path", Item.path)
+Index(
+    "ix_item_order_name",
+    Item.parent_id,
+    ITEM_TYPE_RANK,
+    LISTING_ORDER_KEYS["name"],
+    Item.item_id,
+)
+Index(
+    "ix_item_order_size",
+    Item.parent_id,
+    ITEM_TYPE_RANK,
+    LISTING_ORDER_KEYS["size"],
+    Item.item_id,
+)
+Index(
+    "ix_item_order_modified",
+    Item.parent_id,
+    ITEM_TYPE_RANK,
+    LISTING_ORDER_KEYS["modified"],
+    Item.item_id,
+)
+Index(
+    "ix_item_order_type",
+    Item.parent_id,
+    ITEM_TYPE_RANK,
+    LISTING_ORDER_KEYS["type"],
+    Item.item_id,
+)
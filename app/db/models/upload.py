@@ -0,0 +1,17 @@
+from sqlalchemy import Column, UUID, String, DateTime, Index, func
+
+
+from app.db.core import Base
+
+
+class UploadSession(Base):
+    __tablename__ = "upload_session"
+
+    upload_id = Column(UUID(as_uuid=True), primary_key=True)
+    file_id = Column(UUID(as_uuid=True), nullable=False)
+    file_path = Column(String, nullable=False)
+    s3_upload_id = Column(String, nullable=False)
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    expires_at = Column(DateTime(timezone=True), nullable=False)
+
+    __table_args__ = (Index("ix_upload_session_expires_at", expires_at),)
@@ -1,21 +1,206 @@
+from datetime import datetime
 from enum import Enum
+from functools import lru_cache
+from typing import AsyncIterator, Sequence
 from uuid import UUID
 
-from sqlalchemy import select, delete, func, update
-from sqlalchemy.dialects.postgresql import array
+from sqlalchemy import (
+    Boolean,
+    Integer,
+    Row,
+    Select,
+    any_,
+    bindparam,
+    literal,
+    or_,
+    select,
+    delete,
+    func,
+    tuple_,
+    update,
+)
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
 
-from app.db.models.item import Item
+from app.db.models.item import (
+    IS_FILE,
+    ITEM_TYPE_RANK,
+    LISTING_ORDER_KEYS,
+    OBJECT_KEY,
+    Item,
+)
 
 
 ItemId = UUID | str
 
+SUBTREE_BATCH_SIZE = 1000
+
+METADATA_COLUMNS = (Item.size, Item.content_type, Item.checksum, Item.modified_at)
+
 
 class ItemType(str, Enum):
     FILE = "-"
     FOLDER = "d"
 
 
+class ParentFilter(str, Enum):
+    ANY = "any"  # search across the whole tree
+    ROOT = "root"
+    FOLDER = "folder"
+
+
+class SortKey(str, Enum):
+    NAME = "name"
+    SIZE = "size"
+    MODIFIED = "modified"
+    TYPE = "type"  # content type
+
+
+class SortDirection(str, Enum):
+    ASC = "asc"
+    DESC = "desc"  # reverses the whole order, files then come first
+
+
+def _parent_filter(parent_id: ItemId | None, search_query: str | None) -> ParentFilter:
+    if parent_id:
+        return ParentFilter.FOLDER
+    return ParentFilter.ANY if search_query else ParentFilter.ROOT
+
+
+def _ordering(order: SortKey, direction: SortDirection) -> tuple:
+    # every ordering is backed by ix_item_order_<key>, read backwards for DESC
+    ordering = (ITEM_TYPE_RANK, LISTING_ORDER_KEYS[order.value], Item.item_id)
+    if direction == SortDirection.DESC:
+        return tuple(column.desc() for column in ordering)
+    return ordering
+
+
+# Hot statements are built once per shape with bind parameters instead of on
+# every call; SQLAlchemy then reuses the compiled form from its cache and
+# asyncpg the prepared statement.
+@lru_cache
+def _listing_statement(
+    kind: str,
+    parent: ParentFilter,
+    search: bool,
+    order: SortKey = SortKey.NAME,
+    direction: SortDirection = SortDirection.ASC,
+    keyset: bool = False,
+) -> Select:
+    if kind == "count":
+        query = select(func.count(Item.item_id))
+    else:
+        sort_key = LISTING_ORDER_KEYS[order.value]
+        if kind == "items":
+            columns = (Item,)
+        else:
+            columns = (
+                Item.item_id,
+                Item.name,
+                Item.type,
+                Item.path,
+                *METADATA_COLUMNS,
+                ITEM_TYPE_RANK.label("sort_rank"),
+                sort_key.label("sort_key"),
+            )
+        query = (
+            select(*columns)
+            .order_by(*_ordering(order, direction))
+            .limit(bindparam("limit"))
+        )
+        if keyset:
+            # continues after the last row of the previous page straight from
+            # the index instead of counting past `offset` rows
+            position = tuple_(ITEM_TYPE_RANK, sort_key, Item.item_id)
+            after = tuple_(
+                bindparam("after_rank", type_=Boolean),
+                bindparam("after_key", type_=sort_key.type),
+                bindparam("after_id", type_=Item.item_id.type),
+            )
+            query = query.where(
+                position > after if direction == SortDirection.ASC else position < after
+            )
+        else:
+            query = query.offset(bindparam("offset"))
+
+    if parent == ParentFilter.FOLDER:
+        query = query.where(Item.parent_id == bindparam("parent_id"))
+    elif parent == ParentFilter.ROOT:
+        query = query.where(Item.parent_id.is_(None))
+    if search:
+        query = query.where(Item.name.like(bindparam("pattern"))).where(
+            Item.type == ItemType.FILE.value
+        )
+    return query
+
+
+def _listing_params(parent_id, search_query, **params) -> dict:
+    if parent_id:
+        params["parent_id"] = parent_id
+    if search_query:
+        params["pattern"] = f"%{search_query}%"
+    return params
+
+
+def _item_path_statement() -> Select:
+    # the item and its ancestors, root first
+    target = aliased(Item)
+    return (
+        select(Item)
+        .join(
+            target,
+            Item.item_id == any_(func.array_append(target.ancestor_ids, target.item_id)),
+        )
+        .where(target.item_id == bindparam("item_id"))
+        .order_by(func.cardinality(Item.ancestor_ids))
+    )
+
+
+@lru_cache
+def _page_number_statement(
+    root: bool,
+    order: SortKey = SortKey.NAME,
+    direction: SortDirection = SortDirection.ASC,
+) -> Select:
+    ordering = _ordering(order, direction)
+    row_num_from_zero = func.row_number().over(order_by=ordering) - 1
+
+    page_expression = func.floor(
+        row_num_from_zero / bindparam("limit", type_=Integer)
+    ).label("page")
+
+    parent_clause = (
+        Item.parent_id.is_(None) if root else Item.parent_id == bindparam("parent_id")
+    )
+    cte = (
+        select(Item.item_id, page_expression)
+        .where(parent_clause)
+        .order_by(*ordering)
+        .cte()
+    )
+
+    return select(cte.c.page).where(cte.c.item_id == bindparam("item_id"))
+
+
+ITEM_PATH_QUERY = _item_path_statement()
+ITEM_ID_BY_PATH_QUERY = select(Item.item_id).where(Item.path == bindparam("path"))
+FILE_BY_PATH_QUERY = select(
+    Item.item_id, OBJECT_KEY.label("object_key"), *METADATA_COLUMNS
+).where(
+    Item.path == bindparam("path"), Item.type == ItemType.FILE.value
+)
+ITEM_EXISTS_QUERY = select(func.count(Item.item_id)).where(
+    Item.item_id == bindparam("item_id")
+)
+IN_SUBTREE_QUERY = select(func.count(Item.item_id)).where(
+    Item.item_id == bindparam("item_id"),
+    or_(
+        Item.item_id == bindparam("root_id"),
+        Item.ancestor_ids.any(bindparam("root_id")),
+    ),
+)
+
+
 class StorageRepository:
     def __init__(self, session: AsyncSession) -> None:
         self.session = session
@@ -29,36 +214,49 @@ class StorageRepository:
         *,
         count_only: bool = False,
     ) -> list[Item] | int:
+        parent = _parent_filter(parent_id, search_query)
         if count_only:
-            _query = select(func.count(Item.item_id))
-            if parent_id or not search_query:
-                _query = _query.where(Item.parent_id == parent_id)
-            if search_query:
-                _query = _query.where(Item.name.like(f"%{search_query}%")).where(
-                    Item.type == ItemType.FILE.value
-                )
-            return (await self.session.execute(_query)).scalar()
+            _query = _listing_statement("count", parent, bool(search_query))
+            params = _listing_params(parent_id, search_query)
+            return (await self.session.execute(_query, params)).scalar()
 
-        order_func = func.array_position(
-            array([ItemType.FOLDER.value, ItemType.FILE.value]),
-            Item.type,
-        )
-        query = (
-            select(Item)
-            .order_by(order_func)
-            .order_by(Item.name)
-            .limit(limit)
-            .offset(offset)
-        )
+        query = _listing_statement("items", parent, bool(search_query))
+        params = _listing_params(parent_id, search_query, limit=limit, offset=offset)
+        items = (await self.session.execute(query, params)).scalars().all()
+        return items
 
-        if parent_id or not search_query:
-            query = query.where(Item.parent_id == parent_id)
-        if search_query:
-            query = query.where(Item.name.like(f"%{search_query}%")).where(
-                Item.type == ItemType.FILE.value
+    async def list_item_rows(
+        self,
+        parent_id: ItemId | None = None,
+        search_query: str | None = None,
+        limit: int = 10,
+        offset: int = 0,
+        *,
+        order: SortKey = SortKey.NAME,
+        direction: SortDirection = SortDirection.ASC,
+        after: tuple | None = None,
+    ) -> Sequence[Row]:
+        # plain column tuples skip the identity map and attribute
+        # instrumentation that full `Item` entities go through; rows end with
+        # (sort_rank, sort_key), which with item_id is the `after` position
+        # of the next page
+        parent = _parent_filter(parent_id, search_query)
+        query = _listing_statement(
+            "rows", parent, bool(search_query), order, direction, after is not None
+        )
+        if after is None:
+            params = _listing_params(parent_id, search_query, limit=limit, offset=offset)
+        else:
+            after_rank, after_key, after_id = after
+            params = _listing_params(
+                parent_id,
+                search_query,
+                limit=limit,
+                after_rank=after_rank,
+                after_key=after_key,
+                after_id=after_id,
             )
-        items = (await self.session.execute(query)).scalars().all()
-        return items
+        return (await self.session.execute(query, params)).all()
 
     async def get_item_by_id(self, item_id: ItemId) -> Item | None:
         return await self.session.get(Item, item_id)
@@ -70,67 +268,211 @@ class StorageRepository:
         type_: ItemType,
         *,
         parent_id: ItemId | None = None,
+        size: int | None = None,
+        content_type: str | None = None,
+        checksum: str | None = None,
+        modified_at: datetime | None = None,
     ) -> None:
         new_item = Item(
             item_id=item_id,
             name=name,
             type=type_,
             parent_id=parent_id,
+            size=size,
+            content_type=content_type,
+            checksum=checksum,
+            modified_at=modified_at,
         )
         self.session.add(new_item)
 
+    async def replace_file_object(
+        self, item_id: ItemId, object_key: ItemId, **metadata
+    ) -> UUID | None:
+        # points the file at a newly uploaded object and returns the key of
+        # the previous one, None when the file is gone; the row stays locked
+        # until commit, so concurrent overwrites of one file queue up instead
+        # of losing an object
+        old_key = await self.session.scalar(
+            select(OBJECT_KEY).where(Item.item_id == item_id).with_for_update()
+        )
+        if old_key is None:
+            return None
+        result = await self.session.execute(
+            update(Item)
+            .where(Item.item_id == item_id)
+            .values(object_key=object_key, **metadata)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount != 1:
+            return None
+        return old_key
+
     async def remove_item(self, item_id: ItemId) -> None:
         query = delete(Item).where(Item.item_id == item_id)
         await self.session.execute(query)
 
-    async def change_item_parent(self, item_id: ItemId, new_parent_id: ItemId):
+    async def change_item_parent(
+        self,
+        item_id: ItemId,
+        new_parent_id: ItemId | None,
+        new_name: str | None = None,
+    ) -> None:
+        values = {"parent_id": new_parent_id}
+        if new_name is not None:
+            values["name"] = new_name
+        old_path, old_ancestor_ids = (
+            await self.session.execute(
+                select(Item.path, Item.ancestor_ids).where(Item.item_id == item_id)
+            )
+        ).one()
         query = (
-            update(Item).where(Item.item_id == item_id).values(parent_id=new_parent_id)
+            update(Item)
+            .where(Item.item_id == item_id)
+            .values(**values)
+            .returning(Item.path, Item.ancestor_ids)
         )
-        await self.session.execute(query)
+        new_path, new_ancestor_ids = (await self.session.execute(query)).one()
 
-    async def get_item_path(self, item_id: ItemId) -> list[Item]:
-        cte = select(Item).where(Item.item_id == item_id).cte(recursive=True)
-        cte = cte.union_all(select(Item).join(cte, Item.item_id == cte.c.parent_id))
-        query = select(Item).join(cte, cte.c.item_id == Item.item_id)
+        # the path trigger only recomputes the moved row, so its descendants
+        # get their path prefix and the head of ancestor_ids (everything up
+        # to and including the moved item) swapped in one statement
+        if (old_path, old_ancestor_ids) != (new_path, new_ancestor_ids):
+            head = literal([*new_ancestor_ids, item_id], Item.ancestor_ids.type)
+            tail = Item.ancestor_ids[
+                len(old_ancestor_ids) + 2 : func.cardinality(Item.ancestor_ids)
+            ]
+            await self.session.execute(
+                update(Item)
+                .where(Item.ancestor_ids.contains([item_id]))
+                .values(
+                    path=new_path + func.substr(Item.path, len(old_path) + 1),
+                    ancestor_ids=func.array_cat(head, tail),
+                )
+                .execution_options(synchronize_session=False)
+            )
 
-        return (await self.session.execute(query)).scalars().all()
+    async def get_item_path(self, item_id: ItemId) -> list[Item]:
+        result = await self.session.execute(ITEM_PATH_QUERY, {"item_id": item_id})
+        return result.scalars().all()
 
     async def get_item_id_by_path(self, path: str) -> ItemId:
-        query = select(Item.item_id).where(Item.path == path)
+        result = await self.session.execute(ITEM_ID_BY_PATH_QUERY, {"path": path})
+        return result.scalar_one_or_none()
+
+    async def get_file_by_path(self, path: str) -> Row | None:
+        # (item_id, object_key, size, content_type, checksum, modified_at)
+        result = await self.session.execute(FILE_BY_PATH_QUERY, {"path": path})
+        return result.one_or_none()
+
+    async def get_child_item(self, parent_id: ItemId | None, name: str) -> Item | None:
+        query = select(Item).where(Item.parent_id == parent_id).where(Item.name == name)
         return (await self.session.execute(query)).scalar_one_or_none()
 
+    async def is_in_subtree(self, item_id: ItemId, root_id: ItemId) -> bool:
+        # item_id is root_id or one of its descendants
+        result = await self.session.execute(
+            IN_SUBTREE_QUERY, {"item_id": item_id, "root_id": root_id}
+        )
+        return bool(result.scalar())
+
     async def is_item_exists(self, item_id: ItemId) -> bool:
-        query = select(func.count(Item.item_id)).where(Item.item_id == item_id)
-        return bool((await self.session.execute(query)).scalar())
+        result = await self.session.execute(ITEM_EXISTS_QUERY, {"item_id": item_id})
+        return bool(result.scalar())
+
+    async def get_items_by_paths(self, paths: list[str]) -> Sequence[Row]:
+        query = select(
+            Item.item_id, Item.parent_id, Item.name, Item.type, Item.path
+        ).where(Item.path.in_(paths))
+        return (await self.session.execute(query)).all()
+
+    def _subtree_query(self, item_id: ItemId | None, max_depth: int | None = None):
+        # `item_id=None` is the whole tree, its root items sit at depth 1
+        depth = func.cardinality(Item.ancestor_ids)
+        if item_id is None:
+            depth = depth + 1
+            query = select(Item.item_id)
+        else:
+            root_depth = (
+                select(func.cardinality(Item.ancestor_ids))
+                .where(Item.item_id == item_id)
+                .scalar_subquery()
+            )
+            depth = depth - root_depth
+            query = select(Item.item_id).where(
+                or_(Item.item_id == item_id, Item.ancestor_ids.contains([item_id]))
+            )
+        query = query.add_columns(
+            Item.parent_id,
+            Item.name,
+            Item.type,
+            Item.path,
+            OBJECT_KEY.label("object_key"),
+            *METADATA_COLUMNS,
+            depth.label("depth"),
+        )
+        if max_depth is not None:
+            query = query.where(depth <= max_depth)
+        return query.subquery()
+
+    def _subtree_rows_query(
+        self, item_id: ItemId | None, include_root: bool, max_depth: int | None
+    ) -> Select:
+        # parents always come before their children
+        subtree = self._subtree_query(item_id, max_depth)
+        query = select(
+            *(column for column in subtree.c if column.name != "depth")
+        ).order_by(subtree.c.depth)
+        if not include_root:
+            query = query.where(subtree.c.depth > 0)
+        return query
+
+    async def iter_subtree(
+        self,
+        item_id: ItemId | None,
+        *,
+        include_root: bool = True,
+        max_depth: int | None = None,
+        batch_size: int = SUBTREE_BATCH_SIZE,
+    ) -> AsyncIterator[Sequence[Row]]:
+        # rows are pulled through a server-side cursor `batch_size` at a time,
+        # so walking a huge folder never holds more than one batch in memory
+        query = self._subtree_rows_query(item_id, include_root, max_depth)
+        result = await self.session.stream(
+            query.execution_options(yield_per=batch_size)
+        )
+        async for batch in result.partitions():
+            yield batch
 
-    async def get_items_by_paths(self, paths: list[str]) -> list[Item]:
-        query = select(Item).where(Item.path.in_(paths))
-        return (await self.session.execute(query)).scalars().all()
+    async def iter_file_rows(
+        self, *, batch_size: int = SUBTREE_BATCH_SIZE
+    ) -> AsyncIterator[Sequence[Row]]:
+        # (object_key, path) of every file in object key order, read from
+        # ix_item_object_key; uuid ordering compares raw bytes, which matches
+        # the binary order of their lowercase text form used as S3 keys
+        query = (
+            select(OBJECT_KEY.label("object_key"), Item.path)
+            .where(IS_FILE)
+            .order_by(OBJECT_KEY)
+            .execution_options(yield_per=batch_size)
+        )
+        result = await self.session.stream(query)
+        async for batch in result.partitions():
+            yield batch
 
     async def get_page_number(
         self,
         parent_id: ItemId | None,
         item_id: ItemId,
         limit: int,
+        order: SortKey = SortKey.NAME,
+        direction: SortDirection = SortDirection.ASC,
     ) -> int | None:
-        order_func = func.array_position(
-            array([ItemType.FOLDER.value, ItemType.FILE.value]), Item.type
-        )
-        row_num_from_zero = func.row_number().over(order_by=(order_func, Item.name)) - 1
+        query = _page_number_statement(parent_id is None, order, direction)
+        params = {"item_id": item_id, "limit": limit}
+        if parent_id is not None:
+            params["parent_id"] = parent_id
 
-        page_expression = func.floor(row_num_from_zero / limit).label("page")
-
-        cte = (
-            select(Item.item_id, Item.name, page_expression)
-            .where(Item.parent_id == parent_id)
-            .order_by(order_func, Item.name)
-            .cte()
-        )
-
-        query = select(cte.c.page).where(cte.c.item_id == item_id)
-
-        page = (await self.session.execute(query)).scalar_one_or_none()
+        page = (await self.session.execute(query, params)).scalar_one_or_none()
 
         if page is not None:
             return int(page) + 1  # sql number format that starts from 1
@@ -140,6 +482,9 @@ class StorageRepository:
     async def _remove_all(self) -> None:
         await self.session.execute(delete(Item))
 
+    async def flush(self) -> None:
+        await self.session.flush()
+
     async def commit(self) -> None:
         await self.session.commit()
 
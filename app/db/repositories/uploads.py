@@ -0,0 +1,60 @@
+from datetime import datetime
+from typing import Sequence
+
+from sqlalchemy import select, delete
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.models.upload import UploadSession
+from app.db.repositories.storage import ItemId
+
+
+class UploadRepository:
+    def __init__(self, session: AsyncSession) -> None:
+        self.session = session
+
+    def create_upload(
+        self,
+        upload_id: ItemId,
+        file_id: ItemId,
+        file_path: str,
+        s3_upload_id: str,
+        expires_at: datetime,
+    ) -> None:
+        self.session.add(
+            UploadSession(
+                upload_id=upload_id,
+                file_id=file_id,
+                file_path=file_path,
+                s3_upload_id=s3_upload_id,
+                expires_at=expires_at,
+            )
+        )
+
+    async def get_upload(self, upload_id: ItemId, now: datetime) -> UploadSession | None:
+        query = (
+            select(UploadSession)
+            .where(UploadSession.upload_id == upload_id)
+            .where(UploadSession.expires_at > now)
+        )
+        return (await self.session.execute(query)).scalar_one_or_none()
+
+    async def list_expired_uploads(
+        self, now: datetime, limit: int = 100
+    ) -> Sequence[UploadSession]:
+        query = (
+            select(UploadSession)
+            .where(UploadSession.expires_at <= now)
+            .order_by(UploadSession.expires_at)
+            .limit(limit)
+        )
+        return (await self.session.execute(query)).scalars().all()
+
+    async def remove_upload(self, upload_id: ItemId) -> None:
+        query = delete(UploadSession).where(UploadSession.upload_id == upload_id)
+        await self.session.execute(query)
+
+    async def commit(self) -> None:
+        await self.session.commit()
+
+    async def rollback(self) -> None:
+        await self.session.rollback()
@@ -1,16 +1,46 @@
+import asyncio
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
 
 from pydantic import UUID4
 
-from fastapi import FastAPI, Depends, Query, Path, UploadFile
+from fastapi import (
+    FastAPI,
+    Depends,
+    Header,
+    HTTPException,
+    Query,
+    Path,
+    Request,
+    Response,
+)
+from fastapi.responses import ORJSONResponse, StreamingResponse
 
-from app.db.core import session_factory
-from app.db.repositories.storage import StorageRepository
+from app.db.core import pin_to_primary, replica_engines, session_factory
+from app.metrics import metrics
+from app.db.repositories.storage import SortDirection, SortKey, StorageRepository
 from app.db.repositories.bindings import BindingsRepositoryMock
+from app.db.repositories.uploads import UploadRepository
+from app.services.negotiation import COLUMNAR_JSON, MSGPACK, page_response
+from app.services.singleflight import SingleFlight
+from app.services.stale import StaleObjects
 from app.services.storage import FileStorageService
+from app.services.webdav import parse_destination
+from app.s3.admission import AdmissionController, Lane, S3Overloaded
+from app.s3.backend import StorageBackend
+from app.s3.cache import ObjectCache
 from app.s3.connector import S3Connector
+from app.s3.local import LocalStorageBackend
+from app.s3.sharding import ShardedS3Connector
 
-from app.schemas import DeleteItemResponseSchema, PageSchema, PageWithHighlidtedItemSchema
+from app.schemas import (
+    DeleteItemResponseSchema,
+    PageSchema,
+    PageWithHighlidtedItemSchema,
+    UploadPartSchema,
+    UploadSessionSchema,
+)
 
 from app.settings import get_settings
 
@@ -19,41 +49,227 @@ app = FastAPI()
 settings = get_settings()
 
 logging.basicConfig(level=settings.DEBUG and logging.DEBUG or logging.INFO)
+logger = logging.getLogger(__name__)
+
+object_cache = None
+if settings.OBJECT_CACHE_MEMORY_BUDGET:
+    object_cache = ObjectCache(
+        max_object_size=settings.OBJECT_CACHE_MAX_OBJECT_SIZE,
+        memory_budget=settings.OBJECT_CACHE_MEMORY_BUDGET,
+        disk_dir=settings.OBJECT_CACHE_DISK_DIR,
+        disk_budget=settings.OBJECT_CACHE_DISK_BUDGET,
+    )
+
+single_flight = None
+if settings.SINGLE_FLIGHT:
+    single_flight = SingleFlight(
+        replay_limit=settings.SINGLE_FLIGHT_REPLAY_BYTES,
+        stall_timeout=settings.SINGLE_FLIGHT_STALL_TIMEOUT,
+    )
+
+stale_objects = None
+if settings.STALE_OBJECT_GRACE:
+    stale_objects = StaleObjects(settings.STALE_OBJECT_GRACE)
+
+s3_admission = AdmissionController(
+    {
+        Lane.UPLOAD: (settings.S3_UPLOAD_CONCURRENCY, settings.S3_UPLOAD_QUEUE),
+        Lane.DOWNLOAD: (settings.S3_DOWNLOAD_CONCURRENCY, settings.S3_DOWNLOAD_QUEUE),
+        Lane.DELETE: (settings.S3_DELETE_CONCURRENCY, settings.S3_DELETE_QUEUE),
+        Lane.METADATA: (settings.S3_METADATA_CONCURRENCY, settings.S3_METADATA_QUEUE),
+    },
+    retry_after=settings.S3_RETRY_AFTER,
+)
+
+# shared by every request, so parallel deletes and reads have a fixed ceiling
+local_storage_executor = None
+if settings.STORAGE_BACKEND == "local":
+    local_storage_executor = ThreadPoolExecutor(
+        settings.LOCAL_STORAGE_THREADS, thread_name_prefix="local-storage"
+    )
+
+READ_METHODS = ("GET", "HEAD", "OPTIONS", "PROPFIND")
+PRIMARY_COOKIE = "pgs3_primary"
 
 
-async def fs_service():
-    async with session_factory() as session:
-        async with S3Connector(
-            bucket_name=settings.S3_BUCKET_NAME,
-            aws_access_key_id=settings.S3_ACCESS_KEY,
-            aws_secret_access_key=settings.S3_SECRET_KEY,
-            endpoint_url=settings.S3_ENDPOINT,
-            debug=settings.DEBUG,
-        ) as s3_connector:
-            repo = StorageRepository(session)
-            service = FileStorageService(
-                storage_repo=repo,
-                s3_connector=s3_connector,
-                src_prefix=settings.SRC_PREFIX,
-                binding_repo=BindingsRepositoryMock(),
+def route_session(session, request: Request) -> None:
+    # a client that just wrote keeps reading from the primary for a while,
+    # so it never sees a replica that has not caught up with its own change
+    if not replica_engines:
+        return
+    if request.method not in READ_METHODS or request.cookies.get(PRIMARY_COOKIE):
+        pin_to_primary(session)
+
+
+def make_s3_connector() -> StorageBackend:
+    if settings.STORAGE_BACKEND == "local":
+        return LocalStorageBackend(
+            settings.LOCAL_STORAGE_ROOT,
+            executor=local_storage_executor,
+            multipart_chunk_size=settings.S3_MULTIPART_CHUNK_SIZE,
+        )
+    options = dict(
+        debug=settings.DEBUG,
+        multipart_chunk_size=settings.S3_MULTIPART_CHUNK_SIZE,
+        multipart_concurrency=settings.S3_MULTIPART_CONCURRENCY,
+        admission=s3_admission,
+    )
+    if settings.S3_SHARDS:
+        shards = {
+            shard.name: S3Connector(
+                bucket_name=shard.bucket_name,
+                aws_access_key_id=shard.access_key,
+                aws_secret_access_key=shard.secret_key,
+                endpoint_url=shard.endpoint,
+                **options,
             )
-            yield service
+            for shard in settings.S3_SHARDS
+        }
+        return ShardedS3Connector(shards, settings.S3_PREVIOUS_SHARDS)
+    return S3Connector(
+        bucket_name=settings.S3_BUCKET_NAME,
+        aws_access_key_id=settings.S3_ACCESS_KEY,
+        aws_secret_access_key=settings.S3_SECRET_KEY,
+        endpoint_url=settings.S3_ENDPOINT,
+        **options,
+    )
+
+
+def make_service(session, s3_connector: StorageBackend) -> FileStorageService:
+    return FileStorageService(
+        storage_repo=StorageRepository(session),
+        s3_connector=s3_connector,
+        src_prefix=settings.SRC_PREFIX,
+        binding_repo=BindingsRepositoryMock(),
+        archive_upload_concurrency=settings.ARCHIVE_UPLOAD_CONCURRENCY,
+        archive_insert_batch_size=settings.ARCHIVE_INSERT_BATCH_SIZE,
+        upload_repo=UploadRepository(session),
+        upload_session_ttl=timedelta(seconds=settings.UPLOAD_SESSION_TTL),
+        upload_max_part_size=settings.UPLOAD_MAX_PART_SIZE,
+        object_cache=object_cache,
+        ranged_download_threshold=settings.S3_RANGED_DOWNLOAD_THRESHOLD,
+        ranged_download_part_size=settings.S3_RANGED_DOWNLOAD_PART_SIZE,
+        ranged_download_concurrency=settings.S3_RANGED_DOWNLOAD_CONCURRENCY,
+        single_flight=single_flight,
+        stale_objects=stale_objects,
+    )
+
+
+async def fs_service(request: Request):
+    async with make_s3_connector() as s3_connector:
+        service = None
+        try:
+            async with session_factory() as session:
+                route_session(session, request)
+                service = make_service(session, s3_connector)
+                yield service
+        finally:
+            # runs after the response has been sent; the session is closed
+            # first, the connector stays open until other requests are done
+            # with its streams
+            if service is not None:
+                await service.finish_shared_streams()
+        await service.remove_stale_objects()
+
+
+async def cleanup_expired_uploads():
+    while True:
+        await asyncio.sleep(settings.UPLOAD_CLEANUP_INTERVAL)
+        try:
+            async with session_factory() as session:
+                async with make_s3_connector() as s3_connector:
+                    service = make_service(session, s3_connector)
+                    aborted = await service.abort_expired_uploads()
+            if aborted:
+                logger.info("Aborted %s expired uploads", aborted)
+        except Exception:
+            logger.exception("Expired uploads cleanup failed")
+
+
+@app.middleware("http")
+async def primary_cookie_middleware(request: Request, call_next):
+    # set here rather than in fs_service: routes that build their own
+    # Response would drop a cookie set on the dependency's response
+    response = await call_next(request)
+    if replica_engines and request.method not in READ_METHODS:
+        response.set_cookie(
+            PRIMARY_COOKIE, "1", max_age=settings.REPLICA_STICKINESS_SECONDS
+        )
+    return response
+
+
+async def sweep_stale_objects():
+    while True:
+        await asyncio.sleep(settings.STALE_OBJECT_SWEEP_INTERVAL)
+        keys = stale_objects.due()
+        if not keys:
+            continue
+        try:
+            async with make_s3_connector() as s3_connector:
+                await s3_connector.remove_items(keys)
+        except Exception:  # reconcile.py removes what is left behind
+            logger.exception("Removing %s replaced objects failed", len(keys))
 
 
-@app.get("/find_file", responses={200: {"model": list[PageSchema]}})
-@app.get("/filesV4", responses={200: {"model": list[PageSchema]}})
+@app.exception_handler(S3Overloaded)
+async def s3_overloaded_handler(request: Request, exc: S3Overloaded):
+    return ORJSONResponse(
+        {"detail": str(exc)},
+        status_code=503,
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
+@app.on_event("startup")
+async def start_background_tasks():
+    app.state.upload_cleanup = asyncio.create_task(cleanup_expired_uploads())
+    app.state.stale_sweep = None
+    if stale_objects is not None:
+        app.state.stale_sweep = asyncio.create_task(sweep_stale_objects())
+
+
+@app.on_event("shutdown")
+async def stop_background_tasks():
+    app.state.upload_cleanup.cancel()
+    if app.state.stale_sweep is not None:
+        app.state.stale_sweep.cancel()
+
+
+# the compact variants are picked with Accept, see app/services/negotiation.py
+PAGE_RESPONSES = {
+    200: {"model": list[PageSchema], "content": {COLUMNAR_JSON: {}, MSGPACK: {}}}
+}
+
+
+@app.get("/find_file", responses=PAGE_RESPONSES)
+@app.get("/filesV4", responses=PAGE_RESPONSES)
 async def get_files_route(
     folder_id: UUID4 | None = Query(None, alias="id"),
     page: int = 1,
     per_page: int = settings.PER_PAGE,
     query: str | None = Query(None, alias="text"),
+    order_by: SortKey = SortKey.NAME,
+    direction: SortDirection = SortDirection.ASC,
+    cursor: str | None = Query(None, description="next_cursor of the previous page"),
+    accept: str | None = Header(None),
+    accept_encoding: str | None = Header(None),
     service: FileStorageService = Depends(fs_service),
 ):
-    return await service.list_folder_items(
+    page = await service.list_folder_page(
         folder_id,
         query,
         page=page,
         per_page=per_page,
+        order=order_by,
+        direction=direction,
+        cursor=cursor,
+    )
+    return page_response(
+        page,
+        service.src_prefix,
+        accept,
+        accept_encoding,
+        settings.LISTING_COMPRESS_MIN_SIZE,
     )
 
 
@@ -88,6 +304,15 @@ async def delete_item_route(
     return await service.remove_item(item_id, per_page)
 
 
+@app.post("/archive", responses={200: {"model": PageSchema}})
+async def import_archive_route(
+    request: Request,
+    folder_id: UUID4 = Query(None, alias="id"),
+    service: FileStorageService = Depends(fs_service),
+):
+    return await service.import_archive(request.stream(), folder_id)
+
+
 @app.get("/page-by-path", responses={200: {"model": PageWithHighlidtedItemSchema}})
 async def get_page_by_path_route(
     path: str,
@@ -97,15 +322,148 @@ async def get_page_by_path_route(
     return await service.get_page_by_path(path, per_page)
 
 
-@app.put("/file/{file_path}", tags=["webdav"])
+@app.put("/file/{file_path:path}", tags=["webdav"])
 async def put_webdav_file_route(
     file_path: str,
-    file: UploadFile,
+    request: Request,
+    content_type: str | None = Header(None),
+    service: FileStorageService = Depends(fs_service),
+):
+    # the raw request body, as WebDAV clients send it
+    return await service.upload_file(request.stream(), file_path, content_type)
+
+
+@app.post("/uploads", tags=["uploads"], responses={200: {"model": UploadSessionSchema}})
+async def create_upload_route(
+    path: str,
+    service: FileStorageService = Depends(fs_service),
+):
+    return await service.create_upload(path)
+
+
+@app.put(
+    "/uploads/{upload_id}/parts/{part_number}",
+    tags=["uploads"],
+    responses={200: {"model": UploadPartSchema}},
+)
+async def upload_part_route(
+    upload_id: UUID4,
+    part_number: int,
+    request: Request,
     service: FileStorageService = Depends(fs_service),
 ):
-    return await service.upload_file(await file.read(), file_path)
+    return await service.upload_part(upload_id, part_number, request.stream())
+
+
+@app.get("/uploads/{upload_id}", tags=["uploads"], responses={200: {"model": UploadSessionSchema}})
+async def get_upload_route(
+    upload_id: UUID4,
+    service: FileStorageService = Depends(fs_service),
+):
+    return await service.get_upload(upload_id)
+
+
+@app.post("/uploads/{upload_id}/complete", tags=["uploads"])
+async def complete_upload_route(
+    upload_id: UUID4,
+    service: FileStorageService = Depends(fs_service),
+):
+    return await service.complete_upload(upload_id)
+
+
+@app.delete("/uploads/{upload_id}", tags=["uploads"])
+async def abort_upload_route(
+    upload_id: UUID4,
+    service: FileStorageService = Depends(fs_service),
+):
+    return await service.abort_upload(upload_id)
+
+
+@app.get("/file/{file_path:path}", tags=["webdav"])
+async def get_webdav_file_route(
+    file_path: str,
+    if_none_match: str | None = Header(None),
+    if_modified_since: str | None = Header(None),
+    service: FileStorageService = Depends(fs_service),
+):
+    return await service.get_file_by_path(file_path, if_none_match, if_modified_since)
+
+
+@app.head("/file/{file_path:path}", tags=["webdav"])
+async def head_webdav_file_route(
+    file_path: str,
+    if_none_match: str | None = Header(None),
+    if_modified_since: str | None = Header(None),
+    service: FileStorageService = Depends(fs_service),
+):
+    return await service.head_file_by_path(file_path, if_none_match, if_modified_since)
+
+
+WEBDAV_METHODS = "OPTIONS, GET, HEAD, PUT, DELETE, PROPFIND, MKCOL, MOVE, COPY"
+
+
+def webdav_prefix(request: Request) -> str:
+    return request.scope.get("root_path", "") + "/file/"
+
+
+def webdav_destination(request: Request, destination: str) -> str:
+    path = parse_destination(destination, webdav_prefix(request))
+    if not path:
+        raise HTTPException(502, "Destination is outside of this server")
+    return path
+
+
+@app.options("/file/{file_path:path}", tags=["webdav"])
+async def options_webdav_route(file_path: str):
+    return Response(headers={"DAV": "1", "Allow": WEBDAV_METHODS, "MS-Author-Via": "DAV"})
+
+
+@app.api_route("/file/{file_path:path}", methods=["PROPFIND"], tags=["webdav"])
+async def propfind_webdav_route(
+    file_path: str,
+    request: Request,
+    depth: str = Header("infinity"),
+    service: FileStorageService = Depends(fs_service),
+):
+    body = await service.propfind(file_path, depth.lower(), webdav_prefix(request))
+    return StreamingResponse(
+        body, status_code=207, media_type='application/xml; charset="utf-8"'
+    )
+
+
+@app.api_route("/file/{file_path:path}", methods=["MKCOL"], tags=["webdav"])
+async def mkcol_webdav_route(
+    file_path: str, service: FileStorageService = Depends(fs_service)
+):
+    await service.create_folder_by_path(file_path)
+    return Response(status_code=201)
+
+
+@app.api_route("/file/{file_path:path}", methods=["MOVE", "COPY"], tags=["webdav"])
+async def move_webdav_route(
+    file_path: str,
+    request: Request,
+    destination: str = Header(...),
+    overwrite: str = Header("T"),
+    service: FileStorageService = Depends(fs_service),
+):
+    source = file_path.strip("/")
+    target = webdav_destination(request, destination)
+    if request.method == "MOVE":
+        replaced = await service.move_item_to_path(source, target, overwrite == "T")
+    else:
+        replaced = await service.copy_item_to_path(source, target, overwrite == "T")
+    return Response(status_code=204 if replaced else 201)
+
+
+@app.delete("/file/{file_path:path}", tags=["webdav"])
+async def delete_webdav_route(
+    file_path: str, service: FileStorageService = Depends(fs_service)
+):
+    await service.remove_item_by_path(file_path)
+    return Response(status_code=204)
 
 
-@app.get("/file/{file_path}", tags=["webdav"])
-async def get_webdav_file_route(file_path: str, service: FileStorageService = Depends(fs_service)):
-    return await service.get_file_by_path(file_path)
\ No newline at end of file
+@app.get("/metrics")
+async def metrics_route():
+    return ORJSONResponse(metrics.snapshot())
@@ -0,0 +1,50 @@
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Callable
+
+
+@dataclass
+class Timing:
+    count: int = 0
+    total: float = 0.0
+    max: float = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+
+class Metrics:
+    # process-local counters, timings and gauges, exposed as JSON on /metrics
+    def __init__(self) -> None:
+        self._counters: dict[str, int] = defaultdict(int)
+        self._timings: dict[str, Timing] = defaultdict(Timing)
+        self._gauges: dict[str, Callable[[], float]] = {}
+
+    def incr(self, name: str, value: int = 1) -> None:
+        self._counters[name] += value
+
+    def observe(self, name: str, seconds: float) -> None:
+        self._timings[name].observe(seconds)
+
+    def gauge(self, name: str, getter: Callable[[], float]) -> None:
+        self._gauges[name] = getter
+
+    def snapshot(self) -> dict:
+        return {
+            "counters": dict(self._counters),
+            "timings": {
+                name: {
+                    "count": timing.count,
+                    "total": timing.total,
+                    "avg": timing.total / timing.count if timing.count else 0.0,
+                    "max": timing.max,
+                }
+                for name, timing in self._timings.items()
+            },
+            "gauges": {name: getter() for name, getter in self._gauges.items()},
+        }
+
+
+metrics = Metrics()
@@ -0,0 +1,116 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from enum import Enum
+
+from app.metrics import metrics
+
+
+class Lane(str, Enum):
+    UPLOAD = "upload"
+    DOWNLOAD = "download"
+    DELETE = "delete"
+    METADATA = "metadata"  # listing, multipart bookkeeping, copies
+
+
+class S3Overloaded(Exception):
+    def __init__(self, lane: Lane, retry_after: int) -> None:
+        super().__init__(f"Too many queued S3 {lane.value} operations")
+        self.lane = lane
+        self.retry_after = retry_after
+
+
+class AdmissionLane:
+    def __init__(self, lane: Lane, limit: int, max_queue: int, retry_after: int) -> None:
+        self.lane = lane
+        self.limit = limit
+        self.max_queue = max_queue
+        self.retry_after = retry_after
+        self.active = 0
+        self.waiting = 0
+        self._semaphore = asyncio.Semaphore(limit)
+
+        metrics.gauge(f"s3.admission.{lane.value}.active", lambda: self.active)
+        metrics.gauge(f"s3.admission.{lane.value}.waiting", lambda: self.waiting)
+
+    async def acquire(self, queue: bool = False) -> None:
+        # reject up front instead of queueing without bound, so a burst of one
+        # kind of operation cannot hold memory and sockets the others need;
+        # `queue` waits regardless, for the rest of work already admitted
+        if not queue and self._semaphore.locked() and self.waiting >= self.max_queue:
+            metrics.incr(f"s3.admission.{self.lane.value}.rejected")
+            raise S3Overloaded(self.lane, self.retry_after)
+
+        started = time.perf_counter()
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.active += 1
+        metrics.observe(
+            f"s3.admission.{self.lane.value}.wait", time.perf_counter() - started
+        )
+
+    def release(self) -> None:
+        self.active -= 1
+        self._semaphore.release()
+
+    @asynccontextmanager
+    async def admit(self, queue: bool = False):
+        await self.acquire(queue)
+        try:
+            yield
+        finally:
+            self.release()
+
+
+class AdmissionController:
+    # one instance per process; every lane has its own slots and queue, so
+    # an upload storm never delays downloads, deletes or metadata calls
+    def __init__(self, limits: dict[Lane, tuple[int, int]], retry_after: int = 1) -> None:
+        self.lanes = {
+            lane: AdmissionLane(lane, limit, max_queue, retry_after)
+            for lane, (limit, max_queue) in limits.items()
+        }
+
+    def lane(self, lane: Lane) -> AdmissionLane:
+        return self.lanes[lane]
+
+
+class AdmittedBody:
+    # holds a download slot until the body has been read to the end or closed
+    def __init__(self, body, lane: AdmissionLane, chunk_size: int = 64 * 1024) -> None:
+        self._body = body
+        self._lane = lane
+        self._chunk_size = chunk_size
+        self._released = False
+
+    async def read(self, amt: int | None = None) -> bytes:
+        try:
+            data = await self._body.read(amt)
+        except BaseException:
+            self.close()
+            raise
+        if amt is None or not data:
+            self.close()
+        return data
+
+    def __aiter__(self):
+        return self.iter_chunks(self._chunk_size)
+
+    async def iter_chunks(self, chunk_size: int):
+        try:
+            async for chunk in self._body.iter_chunks(chunk_size):
+                yield chunk
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        if not self._released:
+            self._released = True
+            self._lane.release()
+
+    def __del__(self) -> None:
+        # a response that was never streamed must not leak its slot
+        self.close()
@@ -0,0 +1,72 @@
+from typing import AsyncIterable, AsyncIterator, Protocol
+
+
+class StorageBackend(Protocol):
+    # What FileStorageService needs from an object store. S3Connector (and
+    # ShardedS3Connector on top of it) is the default implementation,
+    # LocalStorageBackend keeps objects in a directory tree.
+    debug: bool
+    multipart_chunk_size: int
+
+    async def __aenter__(self) -> "StorageBackend":
+        ...
+
+    async def __aexit__(self, *args, **kwargs) -> None:
+        ...
+
+    async def upload_file(self, key: str, raw_content: bytes) -> None:
+        ...
+
+    async def upload_stream(self, key: str, chunks: AsyncIterable[bytes]) -> int:
+        ...
+
+    async def create_multipart_upload(self, key: str) -> str:
+        ...
+
+    async def upload_part(
+        self, key: str, upload_id: str, part_number: int, body: bytes
+    ) -> str:
+        ...
+
+    async def list_parts(self, key: str, upload_id: str) -> list[dict]:
+        # [{"PartNumber": int, "Size": int, "ETag": str}, ...]
+        ...
+
+    async def complete_multipart_upload(
+        self, key: str, upload_id: str, parts: list[dict]
+    ) -> None:
+        ...
+
+    async def abort_multipart_upload(self, key: str, upload_id: str) -> None:
+        ...
+
+    async def copy_object(self, source_key: str, key: str) -> None:
+        ...
+
+    async def download_file(self, key: str):
+        # the body of download_object
+        ...
+
+    async def download_object(self, key: str) -> dict | None:
+        # {"Body": body, "ContentLength": int}; the body is an async iterable
+        # of bytes with read() and iter_chunks(chunk_size)
+        ...
+
+    async def download_range(
+        self, key: str, start: int, end: int, queue: bool = False
+    ) -> bytes:
+        # bytes start..end, both inclusive; `queue` waits for admission even
+        # when the download queue is full
+        ...
+
+    def file_path(self, key: str) -> str | None:
+        # where the object lies on a local disk, so it can be served straight
+        # from the file; None when it does not
+        ...
+
+    async def iter_objects(self, page_size: int = 1000) -> AsyncIterator[list[dict]]:
+        # pages of {"Key", "LastModified", "Size"} in key order
+        ...
+
+    async def remove_items(self, keys: list[str], batch_count=50) -> None:
+        ...
@@ -0,0 +1,107 @@
+import mmap
+import os
+import shutil
+from collections import OrderedDict
+
+from app.metrics import metrics
+
+
+class ObjectCache:
+    # LRU of small objects keyed by object key. Objects pushed out of the
+    # memory tier spill into an optional disk tier that is read back through
+    # mmap, so disk hits are paged in by the kernel instead of copied up front.
+    def __init__(
+        self,
+        max_object_size: int,
+        memory_budget: int,
+        disk_dir: str | None = None,
+        disk_budget: int = 0,
+    ) -> None:
+        self.max_object_size = max_object_size
+        self.memory_budget = memory_budget
+        # every worker process keeps its own directory, they share the setting
+        self.disk_dir = None
+        if disk_dir and disk_budget:
+            self.disk_dir = os.path.join(disk_dir, str(os.getpid()))
+        self.disk_budget = disk_budget
+        self._memory: OrderedDict[str, bytes] = OrderedDict()
+        self._memory_bytes = 0
+        self._disk: OrderedDict[str, int] = OrderedDict()
+        self._disk_bytes = 0
+
+        if self.disk_dir:
+            # entries from a previous run may have missed invalidations
+            shutil.rmtree(self.disk_dir, ignore_errors=True)
+            os.makedirs(self.disk_dir, exist_ok=True)
+
+        metrics.gauge("s3.cache.memory_bytes", lambda: self._memory_bytes)
+        metrics.gauge("s3.cache.disk_bytes", lambda: self._disk_bytes)
+
+    def accepts(self, size: int | None) -> bool:
+        return size is not None and size <= self.max_object_size
+
+    def get(self, key: str) -> bytes | mmap.mmap | None:
+        content = self._memory.get(key)
+        if content is not None:
+            self._memory.move_to_end(key)
+            metrics.incr("s3.cache.hits.memory")
+            return content
+
+        if key in self._disk:
+            try:
+                with open(self._disk_path(key), "rb") as file:
+                    mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            except FileNotFoundError:
+                # removed behind our back, e.g. by a tmp cleaner
+                self._disk_bytes -= self._disk.pop(key)
+            else:
+                self._disk.move_to_end(key)
+                metrics.incr("s3.cache.hits.disk")
+                return mapped
+
+        metrics.incr("s3.cache.misses")
+        return None
+
+    def put(self, key: str, content: bytes) -> None:
+        if not self.accepts(len(content)) or len(content) > self.memory_budget:
+            return
+        self.invalidate(key)
+        self._memory[key] = content
+        self._memory_bytes += len(content)
+        while self._memory_bytes > self.memory_budget:
+            evicted_key, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+            metrics.incr("s3.cache.evictions.memory")
+            self._spill(evicted_key, evicted)
+
+    def invalidate(self, key: str) -> None:
+        content = self._memory.pop(key, None)
+        if content is not None:
+            self._memory_bytes -= len(content)
+        size = self._disk.pop(key, None)
+        if size is not None:
+            self._disk_bytes -= size
+            self._remove_file(key)
+
+    def _spill(self, key: str, content: bytes) -> None:
+        # empty files cannot be mapped and cost nothing to refetch
+        if not self.disk_dir or not content or len(content) > self.disk_budget:
+            return
+        with open(self._disk_path(key), "wb") as file:
+            file.write(content)
+        self._disk[key] = len(content)
+        self._disk_bytes += len(content)
+        while self._disk_bytes > self.disk_budget:
+            evicted_key, size = self._disk.popitem(last=False)
+            self._disk_bytes -= size
+            self._remove_file(evicted_key)
+            metrics.incr("s3.cache.evictions.disk")
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key)
+
+    def _remove_file(self, key: str) -> None:
+        try:
+            os.remove(self._disk_path(key))
+        except FileNotFoundError:
+            pass
@@ -1,7 +1,39 @@
 import asyncio
+from collections import deque
+from contextlib import nullcontext
 from io import BytesIO
+from typing import AsyncIterable, AsyncIterator, Awaitable, Callable
+
 import aioboto3
 
+from app.s3.admission import AdmissionController, AdmittedBody, Lane
+
+MULTIPART_CHUNK_SIZE = 8 * 1024 * 1024
+
+
+async def iter_ranges(
+    fetch: Callable[[int, int], Awaitable[bytes]],
+    size: int,
+    part_size: int,
+    concurrency: int,
+) -> AsyncIterator[bytes]:
+    # Fetches `size` bytes as inclusive (start, end) ranges, up to
+    # `concurrency` of them ahead of the consumer, and yields them in order.
+    # Finished ranges wait in the queue until their turn, so at most
+    # `concurrency` parts are held in memory.
+    pending: deque[asyncio.Task] = deque()
+    try:
+        for start in range(0, size, part_size):
+            end = min(start + part_size, size) - 1
+            pending.append(asyncio.create_task(fetch(start, end)))
+            if len(pending) >= concurrency:
+                yield await pending.popleft()
+        while pending:
+            yield await pending.popleft()
+    finally:
+        for task in pending:
+            task.cancel()
+
 
 class S3Connector:
     def __init__(
@@ -12,6 +44,9 @@ class S3Connector:
         endpoint_url: str,
         verify: bool = True,
         debug: bool = False,
+        multipart_chunk_size: int = MULTIPART_CHUNK_SIZE,
+        multipart_concurrency: int = 4,
+        admission: AdmissionController | None = None,
     ) -> None:
         self._session = aioboto3.Session(
             aws_access_key_id=aws_access_key_id,
@@ -25,6 +60,9 @@ class S3Connector:
         self._client = None
         self._bucket_name = bucket_name
         self.debug = debug
+        self.multipart_chunk_size = multipart_chunk_size
+        self.multipart_concurrency = multipart_concurrency
+        self.admission = admission
 
     async def __aenter__(self):
         self._client = await self._session.client(**self._client_params).__aenter__()
@@ -34,6 +72,11 @@ class S3Connector:
         if self._client:
             await self._client.__aexit__(*args, **kwargs)
 
+    def _admit(self, lane: Lane, queue: bool = False):
+        if self.admission is None:
+            return nullcontext()
+        return self.admission.lane(lane).admit(queue)
+
     async def create_bucket(self, bucket_name: str) -> None:
         if self.debug:
             print("CALLED", self.create_bucket.__name__, bucket_name)
@@ -51,15 +94,226 @@ class S3Connector:
             print("CALLED", self.upload_file.__name__, key, len(raw_content))
             return
         file_like = BytesIO(raw_content)
-        await self._client.upload_fileobj(file_like, self._bucket_name, key)
+        async with self._admit(Lane.UPLOAD):
+            await self._client.upload_fileobj(file_like, self._bucket_name, key)
+
+    async def upload_stream(self, key: str, chunks: AsyncIterable[bytes]) -> int:
+        # small objects go with a single put_object, larger ones as multipart
+        # with at most `multipart_concurrency` parts in flight
+        if self.debug:
+            size = 0
+            async for chunk in chunks:
+                size += len(chunk)
+            print("CALLED", self.upload_stream.__name__, key, size)
+            return size
+
+        async with self._admit(Lane.UPLOAD):
+            return await self._upload_stream(key, chunks)
+
+    async def _upload_stream(self, key: str, chunks: AsyncIterable[bytes]) -> int:
+        buffer = bytearray()
+        iterator = chunks.__aiter__()
+        exhausted = False
+        while len(buffer) < self.multipart_chunk_size:
+            try:
+                buffer.extend(await iterator.__anext__())
+            except StopAsyncIteration:
+                exhausted = True
+                break
+
+        if exhausted:
+            await self._client.put_object(
+                Bucket=self._bucket_name, Key=key, Body=bytes(buffer)
+            )
+            return len(buffer)
+
+        upload = await self._client.create_multipart_upload(
+            Bucket=self._bucket_name, Key=key
+        )
+        upload_id = upload["UploadId"]
+        semaphore = asyncio.Semaphore(self.multipart_concurrency)
+        tasks: list[asyncio.Task] = []
+        size = 0
+
+        async def upload_part(part_number: int, body: bytes) -> dict:
+            try:
+                response = await self._client.upload_part(
+                    Bucket=self._bucket_name,
+                    Key=key,
+                    UploadId=upload_id,
+                    PartNumber=part_number,
+                    Body=body,
+                )
+                return {"PartNumber": part_number, "ETag": response["ETag"]}
+            finally:
+                semaphore.release()
+
+        async def submit(body: bytes) -> None:
+            await semaphore.acquire()
+            tasks.append(asyncio.create_task(upload_part(len(tasks) + 1, body)))
+
+        try:
+            while not exhausted:
+                while len(buffer) >= self.multipart_chunk_size:
+                    body = bytes(buffer[: self.multipart_chunk_size])
+                    del buffer[: self.multipart_chunk_size]
+                    size += len(body)
+                    await submit(body)
+                try:
+                    buffer.extend(await iterator.__anext__())
+                except StopAsyncIteration:
+                    exhausted = True
+            if buffer or not tasks:
+                size += len(buffer)
+                await submit(bytes(buffer))
+            parts = await asyncio.gather(*tasks)
+            await self._client.complete_multipart_upload(
+                Bucket=self._bucket_name,
+                Key=key,
+                UploadId=upload_id,
+                MultipartUpload={"Parts": parts},
+            )
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await self._client.abort_multipart_upload(
+                Bucket=self._bucket_name, Key=key, UploadId=upload_id
+            )
+            raise
+        return size
+
+    async def create_multipart_upload(self, key: str) -> str:
+        if self.debug:
+            print("CALLED", self.create_multipart_upload.__name__, key)
+            return key
+        async with self._admit(Lane.METADATA):
+            response = await self._client.create_multipart_upload(
+                Bucket=self._bucket_name, Key=key
+            )
+        return response["UploadId"]
+
+    async def upload_part(
+        self, key: str, upload_id: str, part_number: int, body: bytes
+    ) -> str:
+        if self.debug:
+            print("CALLED", self.upload_part.__name__, key, part_number, len(body))
+            return ""
+        async with self._admit(Lane.UPLOAD):
+            response = await self._client.upload_part(
+                Bucket=self._bucket_name,
+                Key=key,
+                UploadId=upload_id,
+                PartNumber=part_number,
+                Body=body,
+            )
+        return response["ETag"]
+
+    async def list_parts(self, key: str, upload_id: str) -> list[dict]:
+        if self.debug:
+            print("CALLED", self.list_parts.__name__, key)
+            return []
+        paginator = self._client.get_paginator("list_parts")
+        parts = []
+        async with self._admit(Lane.METADATA):
+            async for page in paginator.paginate(
+                Bucket=self._bucket_name, Key=key, UploadId=upload_id
+            ):
+                parts.extend(page.get("Parts", []))
+        return parts
+
+    async def complete_multipart_upload(
+        self, key: str, upload_id: str, parts: list[dict]
+    ) -> None:
+        if self.debug:
+            print("CALLED", self.complete_multipart_upload.__name__, key, len(parts))
+            return
+        async with self._admit(Lane.METADATA):
+            await self._client.complete_multipart_upload(
+                Bucket=self._bucket_name,
+                Key=key,
+                UploadId=upload_id,
+                MultipartUpload={
+                    "Parts": [
+                        {"PartNumber": part["PartNumber"], "ETag": part["ETag"]}
+                        for part in parts
+                    ]
+                },
+            )
+
+    async def abort_multipart_upload(self, key: str, upload_id: str) -> None:
+        if self.debug:
+            print("CALLED", self.abort_multipart_upload.__name__, key)
+            return
+        async with self._admit(Lane.METADATA):
+            await self._client.abort_multipart_upload(
+                Bucket=self._bucket_name, Key=key, UploadId=upload_id
+            )
+
+    async def copy_object(self, source_key: str, key: str) -> None:
+        if self.debug:
+            print("CALLED", self.copy_object.__name__, source_key, key)
+            return
+        async with self._admit(Lane.METADATA):
+            await self._client.copy_object(
+                Bucket=self._bucket_name,
+                Key=key,
+                CopySource={"Bucket": self._bucket_name, "Key": source_key},
+            )
 
     async def download_file(self, key: str):
         if self.debug:
             print("CALLED", self.download_file.__name__, key)
             return
-        response = await self._client.get_object(Bucket=self._bucket_name, Key=key)
+        response = await self.download_object(key)
         return response["Body"]
 
+    async def download_object(self, key: str) -> dict | None:
+        if self.debug:
+            print("CALLED", self.download_object.__name__, key)
+            return
+        if self.admission is None:
+            return await self._client.get_object(Bucket=self._bucket_name, Key=key)
+
+        # the download slot stays taken until the body is consumed
+        lane = self.admission.lane(Lane.DOWNLOAD)
+        await lane.acquire()
+        try:
+            response = await self._client.get_object(Bucket=self._bucket_name, Key=key)
+        except BaseException:
+            lane.release()
+            raise
+        response["Body"] = AdmittedBody(response["Body"], lane)
+        return response
+
+    async def download_range(
+        self, key: str, start: int, end: int, queue: bool = False
+    ) -> bytes:
+        if self.debug:
+            print("CALLED", self.download_range.__name__, key, start, end)
+            return b""
+        async with self._admit(Lane.DOWNLOAD, queue):
+            response = await self._client.get_object(
+                Bucket=self._bucket_name, Key=key, Range=f"bytes={start}-{end}"
+            )
+            async with response["Body"] as body:
+                return await body.read()
+
+    def file_path(self, key: str) -> None:
+        return None
+
+    async def iter_objects(self, page_size: int = 1000) -> AsyncIterator[list[dict]]:
+        # list_objects_v2 returns keys in UTF-8 binary order, page by page
+        if self.debug:
+            print("CALLED", self.iter_objects.__name__, page_size)
+            return
+        paginator = self._client.get_paginator("list_objects_v2")
+        pages = paginator.paginate(
+            Bucket=self._bucket_name, PaginationConfig={"PageSize": page_size}
+        )
+        async for page in pages:
+            yield page.get("Contents", [])
+
     async def remove_items(self, keys: list[str], batch_count=50) -> None:
         if self.debug:
             print("CALLED", self.remove_items.__name__, keys, batch_count)
@@ -71,6 +325,7 @@ class S3Connector:
 
         for keys_chunk in divide_chunks(keys, batch_count):
             delete_arg = {"Objects": [{"Key": key} for key in keys_chunk]}
-            await self._client.delete_objects(
-                Bucket=self._bucket_name, Delete=delete_arg
-            )
+            async with self._admit(Lane.DELETE):
+                await self._client.delete_objects(
+                    Bucket=self._bucket_name, Delete=delete_arg
+                )
@@ -0,0 +1,282 @@
+import asyncio
+import hashlib
+import os
+import shutil
+import stat
+import uuid
+from concurrent.futures import Executor
+from datetime import datetime, timezone
+from typing import AsyncIterable, AsyncIterator
+
+from starlette.responses import FileResponse
+from starlette.types import Receive, Scope, Send
+
+CHUNK_SIZE = 1024 * 1024
+UPLOADS_DIR = ".uploads"
+TEMP_SUFFIX = ".tmp"
+ZEROCOPY_EXTENSION = "http.response.zerocopy"
+
+
+def _write_file(path: str, content: bytes) -> None:
+    # written next to the target and renamed, readers never see a partial file
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.{uuid.uuid4().hex}{TEMP_SUFFIX}"
+    try:
+        with open(temp_path, "wb") as file:
+            file.write(content)
+        os.replace(temp_path, path)
+    except BaseException:
+        _unlink(temp_path)
+        raise
+
+
+def _unlink(path: str) -> None:
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def _read_range(path: str, start: int, end: int) -> bytes:
+    with open(path, "rb") as file:
+        return os.pread(file.fileno(), end - start + 1, start)
+
+
+def _link_or_copy(source: str, target: str) -> None:
+    # objects are never modified in place, so a hard link is a safe copy
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    temp_path = f"{target}.{uuid.uuid4().hex}{TEMP_SUFFIX}"
+    try:
+        os.link(source, temp_path)
+    except OSError:
+        shutil.copyfile(source, temp_path)
+    os.replace(temp_path, target)
+
+
+def _concatenate(part_paths: list[str], path: str) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.{uuid.uuid4().hex}{TEMP_SUFFIX}"
+    try:
+        with open(temp_path, "wb") as target:
+            for part_path in part_paths:
+                with open(part_path, "rb") as part:
+                    shutil.copyfileobj(part, target, CHUNK_SIZE)
+        os.replace(temp_path, path)
+    except BaseException:
+        _unlink(temp_path)
+        raise
+
+
+def _list_parts(upload_dir: str) -> list[dict]:
+    parts = []
+    for name in os.listdir(upload_dir):
+        if not name.isdigit():
+            continue
+        path = os.path.join(upload_dir, name)
+        with open(path, "rb") as file:
+            etag = hashlib.file_digest(file, "md5").hexdigest()
+        parts.append(
+            {"PartNumber": int(name), "Size": os.path.getsize(path), "ETag": f'"{etag}"'}
+        )
+    return sorted(parts, key=lambda part: part["PartNumber"])
+
+
+def _scan_sorted(directory: str) -> list[os.DirEntry]:
+    try:
+        with os.scandir(directory) as entries:
+            return sorted(entries, key=lambda entry: entry.name)
+    except FileNotFoundError:
+        return []
+
+
+class LocalBody:
+    # the file counterpart of an S3 streaming body
+    def __init__(self, path: str, executor: Executor | None = None) -> None:
+        self.path = path
+        self._executor = executor
+
+    async def read(self) -> bytes:
+        loop = asyncio.get_running_loop()
+        with open(self.path, "rb") as file:
+            return await loop.run_in_executor(self._executor, file.read)
+
+    async def iter_chunks(self, chunk_size: int = CHUNK_SIZE) -> AsyncIterator[bytes]:
+        loop = asyncio.get_running_loop()
+        with open(self.path, "rb") as file:
+            while chunk := await loop.run_in_executor(self._executor, file.read, chunk_size):
+                yield chunk
+
+    def __aiter__(self):
+        return self.iter_chunks()
+
+
+class ZeroCopyFileResponse(FileResponse):
+    # Hands the open file to the server when it implements the ASGI zero-copy
+    # send extension, which then uses sendfile(2); otherwise it is a plain
+    # FileResponse reading the file in chunks.
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if ZEROCOPY_EXTENSION not in scope.get("extensions", {}):
+            await super().__call__(scope, receive, send)
+            return
+
+        with open(self.path, "rb") as file:
+            stat_result = os.fstat(file.fileno())
+            if not stat.S_ISREG(stat_result.st_mode):
+                raise RuntimeError(f"File at path {self.path} is not a file.")
+            self.set_stat_headers(stat_result)
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": self.status_code,
+                    "headers": self.raw_headers,
+                }
+            )
+            if self.send_header_only:
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+            else:
+                await send(
+                    {
+                        "type": ZEROCOPY_EXTENSION,
+                        "file": file,
+                        "count": stat_result.st_size,
+                        "more_body": False,
+                    }
+                )
+        if self.background is not None:
+            await self.background()
+
+
+class LocalStorageBackend:
+    # Objects are files under `root`, spread over two levels of directories
+    # named after the first characters of the key (ab/cd/abcd...), so no
+    # directory grows past a few thousand entries and walking the tree in
+    # name order lists keys in order. Blocking calls run on `executor`, the
+    # event loop's default one when not given.
+    def __init__(
+        self,
+        root: str,
+        executor: Executor | None = None,
+        multipart_chunk_size: int = 8 * 1024 * 1024,
+    ) -> None:
+        self.root = os.path.abspath(root)
+        self.debug = False
+        self.multipart_chunk_size = multipart_chunk_size
+        self._executor = executor
+
+    async def __aenter__(self):
+        await self._run(os.makedirs, self.root, exist_ok=True)
+        return self
+
+    async def __aexit__(self, *args, **kwargs):
+        pass
+
+    async def _run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, lambda: func(*args, **kwargs))
+
+    def file_path(self, key: str) -> str:
+        if not key or "/" in key or key.startswith("."):
+            raise ValueError(f"Invalid object key {key!r}")
+        return os.path.join(self.root, key[:2], key[2:4], key)
+
+    def _upload_dir(self, upload_id: str) -> str:
+        return os.path.join(self.root, UPLOADS_DIR, upload_id)
+
+    async def create_bucket(self, bucket_name: str) -> None:
+        await self._run(os.makedirs, self.root, exist_ok=True)
+
+    async def upload_file(self, key: str, raw_content: bytes) -> None:
+        await self._run(_write_file, self.file_path(key), raw_content)
+
+    async def upload_stream(self, key: str, chunks: AsyncIterable[bytes]) -> int:
+        path = self.file_path(key)
+        temp_path = f"{path}.{uuid.uuid4().hex}{TEMP_SUFFIX}"
+        await self._run(os.makedirs, os.path.dirname(path), exist_ok=True)
+        size = 0
+        file = await self._run(open, temp_path, "wb")
+        try:
+            async for chunk in chunks:
+                await self._run(file.write, chunk)
+                size += len(chunk)
+            await self._run(file.close)
+            await self._run(os.replace, temp_path, path)
+        except BaseException:
+            file.close()
+            _unlink(temp_path)
+            raise
+        return size
+
+    async def create_multipart_upload(self, key: str) -> str:
+        upload_id = uuid.uuid4().hex
+        await self._run(os.makedirs, self._upload_dir(upload_id))
+        return upload_id
+
+    async def upload_part(
+        self, key: str, upload_id: str, part_number: int, body: bytes
+    ) -> str:
+        part_path = os.path.join(self._upload_dir(upload_id), str(part_number))
+        await self._run(_write_file, part_path, body)
+        return f'"{hashlib.md5(body).hexdigest()}"'
+
+    async def list_parts(self, key: str, upload_id: str) -> list[dict]:
+        return await self._run(_list_parts, self._upload_dir(upload_id))
+
+    async def complete_multipart_upload(
+        self, key: str, upload_id: str, parts: list[dict]
+    ) -> None:
+        upload_dir = self._upload_dir(upload_id)
+        part_paths = [
+            os.path.join(upload_dir, str(part["PartNumber"]))
+            for part in sorted(parts, key=lambda part: part["PartNumber"])
+        ]
+        await self._run(_concatenate, part_paths, self.file_path(key))
+        await self._run(shutil.rmtree, upload_dir, ignore_errors=True)
+
+    async def abort_multipart_upload(self, key: str, upload_id: str) -> None:
+        await self._run(shutil.rmtree, self._upload_dir(upload_id), ignore_errors=True)
+
+    async def copy_object(self, source_key: str, key: str) -> None:
+        await self._run(_link_or_copy, self.file_path(source_key), self.file_path(key))
+
+    async def download_file(self, key: str):
+        response = await self.download_object(key)
+        return response["Body"]
+
+    async def download_object(self, key: str) -> dict | None:
+        path = self.file_path(key)
+        size = await self._run(os.path.getsize, path)
+        return {"Body": LocalBody(path, self._executor), "ContentLength": size}
+
+    async def download_range(
+        self, key: str, start: int, end: int, queue: bool = False
+    ) -> bytes:
+        return await self._run(_read_range, self.file_path(key), start, end)
+
+    async def iter_objects(self, page_size: int = 1000) -> AsyncIterator[list[dict]]:
+        page = []
+        for first in await self._run(_scan_sorted, self.root):
+            if first.name == UPLOADS_DIR or not first.is_dir():
+                continue
+            for second in await self._run(_scan_sorted, first.path):
+                for entry in await self._run(_scan_sorted, second.path):
+                    if entry.name.endswith(TEMP_SUFFIX):
+                        continue
+                    entry_stat = await self._run(entry.stat)
+                    page.append(
+                        {
+                            "Key": entry.name,
+                            "LastModified": datetime.fromtimestamp(
+                                entry_stat.st_mtime, timezone.utc
+                            ),
+                            "Size": entry_stat.st_size,
+                        }
+                    )
+                    if len(page) >= page_size:
+                        yield page
+                        page = []
+        if page:
+            yield page
+
+    async def remove_items(self, keys: list[str], batch_count=50) -> None:
+        # unlinks run side by side on the executor's threads
+        await asyncio.gather(*[self._run(_unlink, self.file_path(key)) for key in keys])
@@ -0,0 +1,196 @@
+import asyncio
+import bisect
+import hashlib
+import heapq
+from collections import defaultdict
+from contextlib import AsyncExitStack
+from typing import AsyncIterable, AsyncIterator
+
+from botocore.exceptions import ClientError
+
+from app.s3.connector import S3Connector
+
+VIRTUAL_NODES = 128
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    # consistent hashing: adding a shard only moves ~1/N of the keys, and
+    # only onto the new shard
+    def __init__(self, shard_names: list[str], virtual_nodes: int = VIRTUAL_NODES) -> None:
+        if not shard_names:
+            raise ValueError("At least one shard is required")
+        points = sorted(
+            (_hash(f"{name}#{i}"), name)
+            for name in shard_names
+            for i in range(virtual_nodes)
+        )
+        self._hashes = [point for point, _ in points]
+        self._names = [name for _, name in points]
+        self.shard_names = list(shard_names)
+
+    def shard_for(self, key: str) -> str:
+        index = bisect.bisect(self._hashes, _hash(key)) % len(self._hashes)
+        return self._names[index]
+
+
+def is_missing_key(error: ClientError) -> bool:
+    return error.response.get("Error", {}).get("Code") in ("NoSuchKey", "404")
+
+
+class ShardedS3Connector:
+    # Routes every object key to one of several bucket/endpoint pairs. Each
+    # shard keeps its own client, opened on first use. While a rebalance is
+    # running, `previous_ring` places keys as they were before shards were
+    # added, and reads that miss on the new shard fall back to it.
+    def __init__(
+        self,
+        shards: dict[str, S3Connector],
+        previous_shard_names: list[str] | None = None,
+    ) -> None:
+        self.ring = HashRing(list(shards))
+        self.previous_ring = HashRing(previous_shard_names) if previous_shard_names else None
+        self._shards = shards
+        self._entered: set[str] = set()
+        self._locks: dict[str, asyncio.Lock] = defaultdict(asyncio.Lock)
+        self._stack = AsyncExitStack()
+        first = next(iter(shards.values()))
+        self.multipart_chunk_size = first.multipart_chunk_size
+        self.debug = first.debug
+
+    async def __aenter__(self):
+        await self._stack.__aenter__()
+        return self
+
+    async def __aexit__(self, *args, **kwargs):
+        await self._stack.__aexit__(*args, **kwargs)
+
+    async def shard(self, name: str) -> S3Connector:
+        if name not in self._entered:
+            async with self._locks[name]:
+                if name not in self._entered:
+                    await self._stack.enter_async_context(self._shards[name])
+                    self._entered.add(name)
+        return self._shards[name]
+
+    async def shard_for(self, key: str) -> S3Connector:
+        return await self.shard(self.ring.shard_for(key))
+
+    def _previous_shard_name(self, key: str) -> str | None:
+        if self.previous_ring is None:
+            return None
+        name = self.previous_ring.shard_for(key)
+        return None if name == self.ring.shard_for(key) else name
+
+    async def upload_file(self, key: str, raw_content: bytes) -> None:
+        await (await self.shard_for(key)).upload_file(key, raw_content)
+
+    async def upload_stream(self, key: str, chunks: AsyncIterable[bytes]) -> int:
+        return await (await self.shard_for(key)).upload_stream(key, chunks)
+
+    async def create_multipart_upload(self, key: str) -> str:
+        return await (await self.shard_for(key)).create_multipart_upload(key)
+
+    async def upload_part(
+        self, key: str, upload_id: str, part_number: int, body: bytes
+    ) -> str:
+        connector = await self.shard_for(key)
+        return await connector.upload_part(key, upload_id, part_number, body)
+
+    async def list_parts(self, key: str, upload_id: str) -> list[dict]:
+        return await (await self.shard_for(key)).list_parts(key, upload_id)
+
+    async def complete_multipart_upload(
+        self, key: str, upload_id: str, parts: list[dict]
+    ) -> None:
+        connector = await self.shard_for(key)
+        await connector.complete_multipart_upload(key, upload_id, parts)
+
+    async def abort_multipart_upload(self, key: str, upload_id: str) -> None:
+        await (await self.shard_for(key)).abort_multipart_upload(key, upload_id)
+
+    async def download_object(self, key: str) -> dict | None:
+        try:
+            return await (await self.shard_for(key)).download_object(key)
+        except ClientError as ex:
+            previous = self._previous_shard_name(key)
+            if previous is None or not is_missing_key(ex):
+                raise
+        return await (await self.shard(previous)).download_object(key)
+
+    async def download_range(
+        self, key: str, start: int, end: int, queue: bool = False
+    ) -> bytes:
+        try:
+            return await (await self.shard_for(key)).download_range(
+                key, start, end, queue
+            )
+        except ClientError as ex:
+            previous = self._previous_shard_name(key)
+            if previous is None or not is_missing_key(ex):
+                raise
+        return await (await self.shard(previous)).download_range(key, start, end, queue)
+
+    async def download_file(self, key: str):
+        response = await self.download_object(key)
+        return response["Body"]
+
+    def file_path(self, key: str) -> None:
+        return None
+
+    async def copy_object(self, source_key: str, key: str) -> None:
+        source_shard = self.ring.shard_for(source_key)
+        if source_shard == self.ring.shard_for(key) and not self._previous_shard_name(
+            source_key
+        ):
+            await (await self.shard(source_shard)).copy_object(source_key, key)
+            return
+        source = await self.download_object(source_key)
+        await self.upload_stream(key, source["Body"].iter_chunks(COPY_CHUNK_SIZE))
+
+    async def remove_items(self, keys: list[str], batch_count=50) -> None:
+        by_shard = defaultdict(list)
+        for key in keys:
+            by_shard[self.ring.shard_for(key)].append(key)
+            previous = self._previous_shard_name(key)
+            if previous:
+                by_shard[previous].append(key)
+        await asyncio.gather(
+            *[
+                (await self.shard(name)).remove_items(shard_keys, batch_count)
+                for name, shard_keys in by_shard.items()
+            ]
+        )
+
+    async def iter_objects(self, page_size: int = 1000) -> AsyncIterator[list[dict]]:
+        # every shard lists in key order; a k-way merge keeps the combined
+        # stream sorted, which is what reconciliation relies on
+        async def iter_shard(name: str) -> AsyncIterator[dict]:
+            async for page in (await self.shard(name)).iter_objects(page_size):
+                for obj in page:
+                    yield obj
+
+        iterators = [iter_shard(name) for name in self.ring.shard_names]
+        heap = []
+        for index, iterator in enumerate(iterators):
+            obj = await anext(iterator, None)
+            if obj is not None:
+                heap.append((obj["Key"], index, obj))
+        heapq.heapify(heap)
+
+        page = []
+        while heap:
+            _, index, obj = heapq.heappop(heap)
+            page.append(obj)
+            if len(page) >= page_size:
+                yield page
+                page = []
+            following = await anext(iterators[index], None)
+            if following is not None:
+                heapq.heappush(heap, (following["Key"], index, following))
+        if page:
+            yield page
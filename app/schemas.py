@@ -1,3 +1,4 @@
+from datetime import datetime
 from enum import Enum
 
 from pydantic import UUID4, BaseModel, Field, validator
@@ -20,10 +21,15 @@ class FileStorageItemSchema(BaseModel):
     src: str  # strange path to item
     path: str  # normal path to item
     bind_count: int
+    # file metadata, None for folders and files stored before it was captured
+    size: int | None = None
+    content_type: str | None = None
+    checksum: str | None = None
+    modified_at: datetime | None = None
 
     @validator("type_", pre=True)
     def v(cls, v):
-        return type_mapping[v]
+        return type_mapping.get(v, v)
 
 
 class CreateFolderSchema(BaseModel):
@@ -47,6 +53,7 @@ class PageSchema(BaseModel):
     path: list[PathResponseItemSchema]
     all_page: int
     total: int
+    next_cursor: str | None = None  # keyset position after the last item
 
 
 class DeleteItemStatusCode(int, Enum):
@@ -59,4 +66,17 @@ class DeleteItemResponseSchema(BaseModel):
     datas: list[PathResponseItemSchema] | PageSchema
 
 class PageWithHighlidtedItemSchema(PageSchema):
-    highlighted_item_id: UUID4
\ No newline at end of file
+    highlighted_item_id: UUID4
+
+
+class UploadPartSchema(BaseModel):
+    part_number: int
+    size: int
+
+
+class UploadSessionSchema(BaseModel):
+    id_: UUID4 = Field(..., alias="id")
+    path: str
+    expires_at: datetime
+    parts: list[UploadPartSchema] = []
+    received: int = 0
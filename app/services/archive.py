@@ -0,0 +1,267 @@
+import bz2
+import lzma
+import struct
+import zlib
+from dataclasses import dataclass
+from typing import AsyncIterable, AsyncIterator
+
+READ_SIZE = 64 * 1024
+TAR_BLOCK = 512
+
+GZIP_MAGIC = b"\x1f\x8b"
+BZIP2_MAGIC = b"BZh"
+XZ_MAGIC = b"\xfd7zXZ\x00"
+ZIP_LOCAL_HEADER = b"PK\x03\x04"
+ZIP_CENTRAL_HEADER = b"PK\x01\x02"
+ZIP_END_OF_CENTRAL_DIR = b"PK\x05\x06"
+ZIP_DATA_DESCRIPTOR = b"PK\x07\x08"
+
+
+class ArchiveError(Exception):
+    ...
+
+
+@dataclass
+class ArchiveMember:
+    path: str
+    is_dir: bool
+    size: int | None  # None when the archive does not record it up front
+    chunks: AsyncIterator[bytes]
+
+
+class _ByteStream:
+    def __init__(self, chunks: AsyncIterable[bytes]) -> None:
+        self._iterator = chunks.__aiter__()
+        self._buffer = bytearray()
+        self._eof = False
+
+    async def _fill(self, size: int) -> None:
+        while len(self._buffer) < size and not self._eof:
+            try:
+                self._buffer.extend(await self._iterator.__anext__())
+            except StopAsyncIteration:
+                self._eof = True
+
+    async def peek(self, size: int) -> bytes:
+        await self._fill(size)
+        return bytes(self._buffer[:size])
+
+    async def read(self, size: int = READ_SIZE) -> bytes:
+        if not self._buffer:
+            await self._fill(1)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    async def read_exactly(self, size: int) -> bytes:
+        await self._fill(size)
+        if len(self._buffer) < size:
+            raise ArchiveError("Unexpected end of archive")
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    async def iter_exactly(self, size: int) -> AsyncIterator[bytes]:
+        while size:
+            chunk = await self.read(min(size, READ_SIZE))
+            if not chunk:
+                raise ArchiveError("Unexpected end of archive")
+            size -= len(chunk)
+            yield chunk
+
+    def unread(self, data: bytes) -> None:
+        self._buffer[:0] = data
+
+
+async def _decompress(chunks: AsyncIterable[bytes], decompressor) -> AsyncIterator[bytes]:
+    # `max_length` keeps a single highly compressed chunk from expanding
+    # into memory all at once
+    is_zlib = hasattr(decompressor, "unconsumed_tail")
+    async for chunk in chunks:
+        data = decompressor.decompress(chunk, READ_SIZE)
+        while True:
+            if data:
+                yield data
+            if is_zlib:
+                if decompressor.eof or not decompressor.unconsumed_tail:
+                    break
+                data = decompressor.decompress(decompressor.unconsumed_tail, READ_SIZE)
+            else:
+                if decompressor.needs_input or decompressor.eof:
+                    break
+                data = decompressor.decompress(b"", READ_SIZE)
+    if is_zlib and (tail := decompressor.flush()):
+        yield tail
+
+
+def _parse_tar_number(field: bytes) -> int:
+    if field[:1] and field[0] & 0x80:  # GNU base-256 encoding
+        return int.from_bytes(field[1:], "big")
+    field = field.strip(b"\0 ")
+    return int(field, 8) if field else 0
+
+
+def _parse_pax_path(data: bytes) -> str | None:
+    path = None
+    while data:
+        length, _, rest = data.partition(b" ")
+        record = rest[: int(length) - len(length) - 2]
+        key, _, value = record.partition(b"=")
+        if key == b"path":
+            path = value.decode()
+        data = data[int(length) :]
+    return path
+
+
+async def _iter_tar(stream: _ByteStream) -> AsyncIterator[ArchiveMember]:
+    long_name = None
+    while True:
+        header = await stream.read_exactly(TAR_BLOCK)
+        if header == bytes(TAR_BLOCK):
+            return
+        size = _parse_tar_number(header[124:136])
+        padding = -size % TAR_BLOCK
+        type_flag = header[156:157]
+
+        if type_flag in (b"L", b"x"):
+            data = b"".join([chunk async for chunk in stream.iter_exactly(size)])
+            await stream.read_exactly(padding)
+            long_name = (
+                data.rstrip(b"\0").decode() if type_flag == b"L" else _parse_pax_path(data)
+            )
+            continue
+
+        name = header[0:100].rstrip(b"\0").decode()
+        if header[257:262] == b"ustar" and header[345:500].strip(b"\0"):
+            name = header[345:500].rstrip(b"\0").decode() + "/" + name
+        if long_name:
+            name, long_name = long_name, None
+
+        if type_flag in (b"0", b"\0", b"7"):
+            data = stream.iter_exactly(size)
+            yield ArchiveMember(name, False, size, data)
+            async for _ in data:  # drain whatever the consumer left unread
+                pass
+        elif type_flag == b"5":
+            yield ArchiveMember(name, True, 0, _empty())
+        else:
+            async for _ in stream.iter_exactly(size):  # links, devices, globals
+                pass
+        await stream.read_exactly(padding)
+
+
+async def _empty() -> AsyncIterator[bytes]:
+    return
+    yield
+
+
+async def _iter_deflated(stream: _ByteStream, size: int | None) -> AsyncIterator[bytes]:
+    # deflate streams mark their own end, so members followed by a data
+    # descriptor can be streamed without knowing the compressed size
+    decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+    remaining = size
+    while not decompressor.eof:
+        chunk = await stream.read(READ_SIZE if remaining is None else min(remaining, READ_SIZE))
+        if not chunk:
+            raise ArchiveError("Unexpected end of archive")
+        if remaining is not None:
+            remaining -= len(chunk)
+        data = decompressor.decompress(chunk, READ_SIZE)
+        while True:
+            if data:
+                yield data
+            if decompressor.eof or not decompressor.unconsumed_tail:
+                break
+            data = decompressor.decompress(decompressor.unconsumed_tail, READ_SIZE)
+    leftover = decompressor.unused_data + decompressor.unconsumed_tail
+    if leftover:
+        stream.unread(leftover)
+
+
+def _zip64_sizes(extra: bytes, csize: int, usize: int) -> tuple[int, int]:
+    while len(extra) >= 4:
+        tag, length = struct.unpack("<HH", extra[:4])
+        if tag == 0x0001:
+            values = iter(struct.unpack(f"<{length // 8}Q", extra[4 : 4 + length - length % 8]))
+            if usize == 0xFFFFFFFF:
+                usize = next(values)
+            if csize == 0xFFFFFFFF:
+                csize = next(values)
+            break
+        extra = extra[4 + length :]
+    return csize, usize
+
+
+async def _iter_zip(stream: _ByteStream) -> AsyncIterator[ArchiveMember]:
+    while True:
+        signature = await stream.peek(4)
+        if signature in (ZIP_CENTRAL_HEADER, ZIP_END_OF_CENTRAL_DIR, b""):
+            return  # the central directory only repeats what we've already seen
+        if signature != ZIP_LOCAL_HEADER:
+            raise ArchiveError("Malformed zip archive")
+
+        header = await stream.read_exactly(30)
+        flags, method = struct.unpack("<HH", header[6:10])
+        csize, usize, name_len, extra_len = struct.unpack("<IIHH", header[18:30])
+        name = (await stream.read_exactly(name_len)).decode(
+            "utf-8" if flags & 0x800 else "cp437"
+        )
+        extra = await stream.read_exactly(extra_len)
+        zip64 = csize == 0xFFFFFFFF or usize == 0xFFFFFFFF
+        csize, usize = _zip64_sizes(extra, csize, usize)
+        has_descriptor = bool(flags & 0x08)
+
+        if flags & 0x01:
+            raise ArchiveError(f"Encrypted zip member {name} is not supported")
+        if method not in (0, 8):
+            raise ArchiveError(f"Unsupported compression for zip member {name}")
+        if has_descriptor and method == 0:
+            # a stored member with a trailing descriptor has no detectable end
+            raise ArchiveError(f"Cannot stream stored zip member {name}")
+
+        if method == 0:
+            data = stream.iter_exactly(csize)
+        else:
+            data = _iter_deflated(stream, None if has_descriptor else csize)
+
+        is_dir = name.endswith("/")
+        yield ArchiveMember(name, is_dir, None if has_descriptor else usize, data)
+        async for _ in data:
+            pass
+
+        if has_descriptor:
+            if await stream.peek(4) == ZIP_DATA_DESCRIPTOR:
+                await stream.read_exactly(4)
+            await stream.read_exactly(20 if zip64 else 12)
+
+
+async def iter_archive_members(chunks: AsyncIterable[bytes]) -> AsyncIterator[ArchiveMember]:
+    """Yield members of a zip or (optionally compressed) tar archive stream.
+
+    Each member's `chunks` must be consumed before advancing to the next member;
+    whatever is left unread is skipped.
+    """
+    stream = _ByteStream(chunks)
+    magic = await stream.peek(6)
+    if magic.startswith(ZIP_LOCAL_HEADER) or magic.startswith(ZIP_END_OF_CENTRAL_DIR):
+        members = _iter_zip(stream)
+    else:
+        if magic.startswith(GZIP_MAGIC):
+            decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+        elif magic.startswith(BZIP2_MAGIC):
+            decompressor = bz2.BZ2Decompressor()
+        elif magic.startswith(XZ_MAGIC):
+            decompressor = lzma.LZMADecompressor()
+        else:
+            decompressor = None
+        if decompressor is not None:
+            stream = _ByteStream(_decompress(_stream_chunks(stream), decompressor))
+        members = _iter_tar(stream)
+
+    async for member in members:
+        yield member
+
+
+async def _stream_chunks(stream: _ByteStream) -> AsyncIterator[bytes]:
+    while chunk := await stream.read():
+        yield chunk
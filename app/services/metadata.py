@@ -0,0 +1,85 @@
+import hashlib
+import mimetypes
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import AsyncIterable, AsyncIterator
+
+from sqlalchemy import Row
+
+DEFAULT_CONTENT_TYPE = "application/octet-stream"
+
+
+class ObjectDigest:
+    # size and MD5 of an object, updated chunk by chunk as it is uploaded
+    def __init__(self, content: bytes = b"") -> None:
+        self._md5 = hashlib.md5()
+        self.size = 0
+        if content:
+            self.update(content)
+
+    def update(self, chunk: bytes) -> None:
+        self._md5.update(chunk)
+        self.size += len(chunk)
+
+    async def wrap(self, chunks: AsyncIterable[bytes]) -> AsyncIterator[bytes]:
+        async for chunk in chunks:
+            self.update(chunk)
+            yield chunk
+
+    @property
+    def checksum(self) -> str:
+        return self._md5.hexdigest()
+
+
+def guess_content_type(name: str, declared: str | None = None) -> str:
+    if declared and declared != DEFAULT_CONTENT_TYPE:
+        return declared
+    return mimetypes.guess_type(name)[0] or DEFAULT_CONTENT_TYPE
+
+
+def multipart_checksum(parts: list[dict]) -> str:
+    # what S3 reports as the ETag of a completed multipart upload
+    md5 = hashlib.md5()
+    for part in parts:
+        md5.update(bytes.fromhex(part["ETag"].strip('"')))
+    return f"{md5.hexdigest()}-{len(parts)}"
+
+
+def file_headers(row: Row) -> dict[str, str]:
+    headers = {}
+    if row.size is not None:
+        headers["Content-Length"] = str(row.size)
+    if row.content_type:
+        headers["Content-Type"] = row.content_type
+    if row.checksum:
+        headers["ETag"] = f'"{row.checksum}"'
+    if row.modified_at is not None:
+        headers["Last-Modified"] = format_datetime(row.modified_at, usegmt=True)
+    return headers
+
+
+def _parse_http_date(value: str) -> datetime | None:
+    try:
+        parsed = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    # "-0000" gives a naive datetime; HTTP dates are always GMT
+    if parsed.tzinfo is None:
+        return parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+def is_not_modified(
+    row: Row, if_none_match: str | None, if_modified_since: str | None
+) -> bool:
+    # If-None-Match takes precedence over If-Modified-Since (RFC 9110 13.2.2)
+    if if_none_match is not None:
+        if not row.checksum:
+            return False
+        tags = {tag.strip().removeprefix("W/").strip('"') for tag in if_none_match.split(",")}
+        return "*" in tags or row.checksum in tags
+    if if_modified_since is not None and row.modified_at is not None:
+        since = _parse_http_date(if_modified_since)
+        # HTTP dates have whole seconds
+        return since is not None and row.modified_at.replace(microsecond=0) <= since
+    return False
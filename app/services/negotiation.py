@@ -0,0 +1,131 @@
+import gzip
+from uuid import UUID
+
+import orjson
+from fastapi.responses import Response
+
+try:
+    import msgpack
+except ImportError:  # optional, MessagePack is not offered without it
+    msgpack = None
+
+try:
+    import brotli
+except ImportError:  # optional, gzip only without it
+    brotli = None
+
+JSON = "application/json"
+# items as parallel arrays, one per field, and SRC_PREFIX sent once:
+# src of item i is src_prefix + items["path"][i]
+COLUMNAR_JSON = "application/vnd.pgs3.columnar+json"
+MSGPACK = "application/msgpack"  # the columnar layout
+MSGPACK_ALIASES = {MSGPACK, "application/x-msgpack"}
+
+ITEM_FIELDS = (
+    "title",
+    "id",
+    "type",
+    "path",
+    "bind_count",
+    "size",
+    "content_type",
+    "checksum",
+    "modified_at",
+)
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+def _ranked(header: str | None) -> list[str]:
+    # values of an Accept style header, most preferred first; q=0 is dropped
+    ranked = []
+    for position, part in enumerate((header or "").split(",")):
+        value, *params = [piece.strip() for piece in part.split(";")]
+        quality = 1.0
+        for param in params:
+            name, _, raw = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(raw)
+                except ValueError:
+                    quality = 0.0
+        if value and quality > 0:
+            ranked.append((-quality, position, value.lower()))
+    return [value for *_, value in sorted(ranked)]
+
+
+def negotiate_media_type(accept: str | None) -> str:
+    # plain JSON unless the client prefers a variant we can produce
+    for media_type in _ranked(accept):
+        if media_type == COLUMNAR_JSON:
+            return COLUMNAR_JSON
+        if media_type in MSGPACK_ALIASES and msgpack is not None:
+            return MSGPACK
+        if media_type in (JSON, "application/*", "*/*"):
+            return JSON
+    return JSON
+
+
+def negotiate_encoding(accept_encoding: str | None) -> str | None:
+    for encoding in _ranked(accept_encoding):
+        if encoding == "br" and brotli is not None:
+            return "br"
+        if encoding == "gzip":
+            return "gzip"
+        if encoding == "*":
+            return "br" if brotli is not None else "gzip"
+        if encoding == "identity":
+            return None
+    return None
+
+
+def columnar_page(page: dict, src_prefix: str) -> dict:
+    # a new dict, the page itself may be shared with other requests
+    items = page["items"]
+    return {
+        **page,
+        "src_prefix": src_prefix,
+        "items": {field: [item[field] for item in items] for field in ITEM_FIELDS},
+    }
+
+
+def _msgpack_default(value):
+    if isinstance(value, UUID):
+        return str(value)
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+
+def encode_page(page: dict, media_type: str, src_prefix: str) -> bytes:
+    if media_type == COLUMNAR_JSON:
+        return orjson.dumps(columnar_page(page, src_prefix))
+    if media_type == MSGPACK:
+        # timestamps go out as the MessagePack timestamp extension
+        return msgpack.packb(
+            columnar_page(page, src_prefix), default=_msgpack_default, datetime=True
+        )
+    return orjson.dumps(page)
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+
+def page_response(
+    page: dict,
+    src_prefix: str,
+    accept: str | None = None,
+    accept_encoding: str | None = None,
+    compress_min_size: int = 0,
+) -> Response:
+    # the body is compressed only past `compress_min_size`, below that the
+    # bytes saved do not pay for the CPU; 0 never compresses
+    media_type = negotiate_media_type(accept)
+    body = encode_page(page, media_type, src_prefix)
+    headers = {"Vary": "Accept, Accept-Encoding"}
+    encoding = negotiate_encoding(accept_encoding)
+    if encoding and compress_min_size and len(body) >= compress_min_size:
+        body = compress(body, encoding)
+        headers["Content-Encoding"] = encoding
+    return Response(body, media_type=media_type, headers=headers)
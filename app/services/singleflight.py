@@ -0,0 +1,222 @@
+import asyncio
+from typing import AsyncIterable, AsyncIterator, Awaitable, Callable, Hashable, TypeVar
+
+from app.metrics import metrics
+
+T = TypeVar("T")
+
+_END = object()
+
+
+class SubscriberDropped(Exception):
+    ...
+
+
+class _Fanout:
+    # One source stream read once and copied to every subscriber. Chunks are
+    # kept while they fit `replay_limit`, so a subscriber joining late starts
+    # from the beginning; past that the fanout takes no one new. The source is
+    # read as fast as the fastest subscriber; one that falls `queue_size`
+    # chunks behind is dropped rather than slowing the others down, and if
+    # none takes anything for `stall_timeout` seconds all are dropped.
+    def __init__(
+        self,
+        open_stream: Callable[[], Awaitable[AsyncIterable[bytes]]],
+        replay_limit: int,
+        queue_size: int,
+        stall_timeout: float,
+        on_closed: Callable[["_Fanout"], None],
+    ) -> None:
+        self.replay_limit = replay_limit
+        self.queue_size = queue_size
+        self.stall_timeout = stall_timeout
+        self.joinable = True
+        self._on_closed = on_closed
+        self._buffer: list[bytes] = []
+        self._buffered = 0
+        self._queues: list[asyncio.Queue] = []
+        self._taken = asyncio.Event()
+        self._opened = asyncio.get_running_loop().create_future()
+        self.pump = asyncio.create_task(self._pump(open_stream))
+
+    def _close_to_new(self) -> None:
+        if self.joinable:
+            self.joinable = False
+            self._buffer = []
+            self._on_closed(self)
+
+    async def _pump(self, open_stream) -> None:
+        try:
+            source = await open_stream()
+        except BaseException as ex:
+            self._close_to_new()
+            self._opened.set_exception(ex)
+            self._opened.exception()
+            return
+        self._opened.set_result(None)
+
+        chunks = aiter(source)
+        result = _END
+        try:
+            async for chunk in chunks:
+                if self.joinable:
+                    self._buffer.append(chunk)
+                    self._buffered += len(chunk)
+                    if self._buffered > self.replay_limit:
+                        self._close_to_new()
+                for queue in list(self._queues):
+                    if self._behind(queue):
+                        self._drop(queue, SubscriberDropped("Subscriber fell behind"))
+                    else:
+                        queue.put_nowait(chunk)
+                await self._wait_for_room()
+                if not self._queues:
+                    break
+        except Exception as ex:
+            result = ex
+            raise
+        except BaseException:
+            result = SubscriberDropped("Source stopped")
+            raise
+        finally:
+            self._close_to_new()
+            for queue in list(self._queues):
+                if result is _END:
+                    # the rest is still read, unlike after an error
+                    self._queues.remove(queue)
+                    queue.put_nowait(_END)
+                else:
+                    self._drop(queue, result)
+            if hasattr(chunks, "aclose"):
+                await chunks.aclose()
+
+    def _behind(self, queue: asyncio.Queue) -> bool:
+        return queue.qsize() >= self.queue_size
+
+    async def _wait_for_room(self) -> None:
+        # the next chunk is read once some subscriber can take it
+        while self._queues and all(self._behind(queue) for queue in self._queues):
+            self._taken.clear()
+            try:
+                await asyncio.wait_for(self._taken.wait(), self.stall_timeout)
+            except asyncio.TimeoutError:
+                for queue in list(self._queues):
+                    self._drop(queue, SubscriberDropped("Subscriber stalled"))
+
+    def _drop(self, queue: asyncio.Queue, last) -> None:
+        if queue not in self._queues:
+            return
+        self._queues.remove(queue)
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait(last)
+
+    async def subscribe(self) -> AsyncIterator[bytes]:
+        # everything read so far and the queue are taken in one step, so no
+        # chunk is missed or repeated
+        queue = asyncio.Queue()
+        replay = list(self._buffer)
+        self._queues.append(queue)
+        try:
+            await asyncio.shield(self._opened)
+        except BaseException:
+            self._leave(queue)
+            raise
+        return self._iter(queue, replay)
+
+    def _leave(self, queue: asyncio.Queue) -> None:
+        if queue in self._queues:
+            self._queues.remove(queue)
+            while not queue.empty():
+                queue.get_nowait()
+            self._taken.set()
+            if not self._queues:
+                self._close_to_new()
+
+    async def _iter(self, queue: asyncio.Queue, replay: list[bytes]) -> AsyncIterator[bytes]:
+        try:
+            for chunk in replay:
+                yield chunk
+            while (chunk := await queue.get()) is not _END:
+                if isinstance(chunk, BaseException):
+                    raise chunk
+                self._taken.set()
+                yield chunk
+        finally:
+            self._leave(queue)
+
+
+class SingleFlight:
+    # Concurrent calls with the same kind and key share one in-flight call
+    # instead of each doing the work; the first caller runs it and the others
+    # wait for its result or exception. If that caller is cancelled, one of
+    # the waiters runs the call instead. Counts leaders and collapsed calls
+    # per kind under singleflight.<kind>.
+    def __init__(
+        self,
+        replay_limit: int = 1024 * 1024,
+        queue_size: int = 8,
+        stall_timeout: float = 30,
+    ) -> None:
+        self.replay_limit = replay_limit
+        self.queue_size = queue_size
+        self.stall_timeout = stall_timeout
+        self._calls: dict[tuple[str, Hashable], asyncio.Future] = {}
+        self._streams: dict[tuple[str, Hashable], _Fanout] = {}
+        metrics.gauge("singleflight.calls_in_flight", lambda: len(self._calls))
+        metrics.gauge("singleflight.streams_in_flight", lambda: len(self._streams))
+
+    async def do(self, kind: str, key: Hashable, func: Callable[[], Awaitable[T]]) -> T:
+        flight_key = (kind, key)
+        while (future := self._calls.get(flight_key)) is not None:
+            metrics.incr(f"singleflight.{kind}.coalesced")
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.cancelled() or asyncio.current_task().cancelling():
+                    raise
+
+        metrics.incr(f"singleflight.{kind}.leaders")
+        future = asyncio.get_running_loop().create_future()
+        self._calls[flight_key] = future
+        try:
+            result = await func()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as ex:
+            future.set_exception(ex)
+            future.exception()  # nobody may be waiting
+            raise
+        finally:
+            del self._calls[flight_key]
+        future.set_result(result)
+        return result
+
+    async def stream(
+        self,
+        kind: str,
+        key: Hashable,
+        open_stream: Callable[[], Awaitable[AsyncIterable[bytes]]],
+    ) -> tuple[AsyncIterator[bytes], asyncio.Task | None]:
+        # Returns the chunks and, to the caller that opened the stream, the
+        # task reading it: the source may belong to that caller (an S3 client
+        # closed with its request), so it has to wait for the task before
+        # letting go of it.
+        flight_key = (kind, key)
+        fanout = self._streams.get(flight_key)
+        if fanout is not None:
+            metrics.incr(f"singleflight.{kind}.coalesced")
+            return await fanout.subscribe(), None
+
+        metrics.incr(f"singleflight.{kind}.leaders")
+
+        def on_closed(closed: _Fanout) -> None:
+            if self._streams.get(flight_key) is closed:
+                del self._streams[flight_key]
+
+        fanout = _Fanout(
+            open_stream, self.replay_limit, self.queue_size, self.stall_timeout, on_closed
+        )
+        self._streams[flight_key] = fanout
+        return await fanout.subscribe(), fanout.pump
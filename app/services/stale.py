@@ -0,0 +1,30 @@
+import time
+from collections import deque
+
+from app.metrics import metrics
+
+
+class StaleObjects:
+    # Keys of objects replaced by an overwrite. One process-wide instance; a
+    # background task removes them `grace` seconds after the swap committed,
+    # so reads that resolved the old key just before it can still finish.
+    # Keys still queued when the process stops are left to reconcile.py.
+    def __init__(self, grace: float) -> None:
+        self.grace = grace
+        self._queue: deque[tuple[float, list[str]]] = deque()
+        self._pending = 0
+
+        metrics.gauge("storage.stale_objects.pending", lambda: self._pending)
+
+    def defer(self, keys: list[str]) -> None:
+        self._queue.append((time.monotonic() + self.grace, keys))
+        self._pending += len(keys)
+
+    def due(self) -> list[str]:
+        # entries are queued in due order, the grace period is the same for all
+        now = time.monotonic()
+        keys = []
+        while self._queue and self._queue[0][0] <= now:
+            keys.extend(self._queue.popleft()[1])
+        self._pending -= len(keys)
+        return keys
@@ -1,13 +1,44 @@
-from uuid import uuid4
+import asyncio
+import base64
+import logging
+from datetime import datetime, timedelta, timezone
+from uuid import UUID, uuid4
 from collections import namedtuple
+from functools import partial
+from typing import AsyncIterable
 
+import orjson
+from botocore.exceptions import ClientError
 from fastapi import HTTPException
-from fastapi.responses import StreamingResponse
+from fastapi.responses import Response, StreamingResponse
 from sqlalchemy.exc import IntegrityError
 
+from app.db.core import is_pinned_to_primary
 from app.db.repositories.bindings import BindingsRepositoryProtocol
-from app.db.repositories.storage import ItemType, ItemId, StorageRepository
-from app.s3.connector import S3Connector
+from app.db.repositories.storage import (
+    ItemType,
+    ItemId,
+    SortDirection,
+    SortKey,
+    StorageRepository,
+)
+from app.db.repositories.uploads import UploadRepository
+from app.s3.backend import StorageBackend
+from app.s3.cache import ObjectCache
+from app.s3.connector import iter_ranges
+from app.s3.local import ZeroCopyFileResponse
+from app.services.archive import ArchiveError, iter_archive_members
+from app.services.singleflight import SingleFlight
+from app.services.stale import StaleObjects
+from app.services.metadata import (
+    DEFAULT_CONTENT_TYPE,
+    ObjectDigest,
+    file_headers,
+    guess_content_type,
+    is_not_modified,
+    multipart_checksum,
+)
+from app.services.webdav import DEPTHS, iter_multistatus
 
 from app.schemas import (
     DeleteItemResponseSchema,
@@ -16,8 +47,17 @@ from app.schemas import (
     PageSchema,
     PageWithHighlidtedItemSchema,
     PathResponseItemSchema,
+    UploadPartSchema,
+    UploadSessionSchema,
+    type_mapping,
 )
 
+logger = logging.getLogger(__name__)
+
+MAX_PART_NUMBER = 10000  # S3 multipart limit
+MIN_PART_SIZE = 5 * 1024 * 1024  # S3 minimum for every part but the last
+STREAM_CHUNK_SIZE = 64 * 1024
+
 LimitOffset = namedtuple("LimitOffset", ("limit", "offset"))
 
 
@@ -33,11 +73,22 @@ class FileStorageService:
     def __init__(
         self,
         storage_repo: StorageRepository,
-        s3_connector: S3Connector | None = None,
+        s3_connector: StorageBackend | None = None,
         binding_repo: BindingsRepositoryProtocol | None = None,
         unique_id_factory=uuid4,
         delimiter: str = "/",
         src_prefix: str = "",
+        archive_upload_concurrency: int = 4,
+        archive_insert_batch_size: int = 500,
+        upload_repo: UploadRepository | None = None,
+        upload_session_ttl: timedelta = timedelta(days=1),
+        upload_max_part_size: int = 64 * 1024 * 1024,
+        object_cache: ObjectCache | None = None,
+        ranged_download_threshold: int = 0,
+        ranged_download_part_size: int = 8 * 1024 * 1024,
+        ranged_download_concurrency: int = 4,
+        single_flight: SingleFlight | None = None,
+        stale_objects: StaleObjects | None = None,
     ) -> None:
         self.s3_connector = s3_connector
         self.storage_repo = storage_repo
@@ -45,6 +96,22 @@ class FileStorageService:
         self.binding_repo = binding_repo
         self.delimiter = delimiter
         self.src_prefix = src_prefix
+        self.archive_upload_concurrency = archive_upload_concurrency
+        self.archive_insert_batch_size = archive_insert_batch_size
+        self.upload_repo = upload_repo
+        self.upload_session_ttl = upload_session_ttl
+        self.upload_max_part_size = upload_max_part_size
+        self.object_cache = object_cache
+        self.ranged_download_threshold = ranged_download_threshold
+        self.ranged_download_part_size = ranged_download_part_size
+        self.ranged_download_concurrency = ranged_download_concurrency
+        # objects replaced by an overwrite, handed to `stale_objects` once the
+        # response is out, or removed right away without it
+        self.stale_keys: list[str] = []
+        self.stale_objects = stale_objects
+        self.single_flight = single_flight
+        # streams this request opened and other requests may still read
+        self.shared_streams: list[asyncio.Task] = []
 
     def _page_to_limit_offset(self, page: int, per_page: int) -> tuple[int, int]:
         return LimitOffset(limit=per_page, offset=(page - 1) * per_page)
@@ -52,18 +119,22 @@ class FileStorageService:
     async def _construct_page_path(
         self, folder_id: ItemId | None = None
     ) -> list[PathResponseItemSchema]:
-        path = [PathResponseItemSchema(id=None, path=self.delimiter)]
+        return [
+            PathResponseItemSchema(**path_item)
+            for path_item in await self._construct_raw_page_path(folder_id)
+        ]
+
+    async def _construct_raw_page_path(self, folder_id: ItemId | None = None) -> list[dict]:
+        path = [{"id": None, "path": self.delimiter}]
         if folder_id:
             path_items = await self.storage_repo.get_item_path(folder_id)
             path.extend(
-                [
-                    PathResponseItemSchema(id=path_item.item_id, path=path_item.name)
-                    for path_item in path_items
-                ]
+                {"id": path_item.item_id, "path": path_item.name}
+                for path_item in path_items
             )
         return path
 
-    async def upload_file(self, raw_content: bytes, file_path: str) -> None:
+    async def _resolve_file_path(self, file_path: str) -> tuple[ItemId | None, str]:
         _file_path = file_path
         if not self.delimiter in _file_path:
             _file_path = self.delimiter + _file_path
@@ -75,29 +146,369 @@ class FileStorageService:
             folder_id = await self.storage_repo.get_item_id_by_path(folder_path)
             if not folder_id:
                 raise HTTPException(409, "Folder not found")
+        return folder_id, file_name
 
+    async def _remove_existing_file(
+        self, file_path: str
+    ) -> DeleteItemResponseSchema | None:
         existing_item_id = await self.storage_repo.get_item_id_by_path(file_path)
         if existing_item_id:
             answer = await self.remove_item(existing_item_id)
             if answer.statusCode == DeleteItemStatusCode.ERROR:
                 return answer
+        return None
+
+    async def _store_file(
+        self,
+        file_path: str,
+        file_id: ItemId,
+        folder_id: ItemId | None,
+        file_name: str,
+        **metadata,
+    ) -> tuple[DeleteItemResponseSchema | None, str | None]:
+        # Called once the object is in S3 under `file_id`. A new file gets a
+        # row; an existing file has its row pointed at the new object in one
+        # UPDATE, so readers see either the old or the new content, never a
+        # missing file. Returns the key of the replaced object, which goes to
+        # `stale_keys` once the change is committed.
+        existing = await self.storage_repo.get_file_by_path(file_path)
+        if existing is not None:
+            old_key = await self.storage_repo.replace_file_object(
+                existing.item_id, file_id, **metadata
+            )
+            if old_key is not None:
+                return None, str(old_key)
+            # deleted since the lookup, stored as a new file
+        # a folder in the way is replaced as before
+        answer = await self._remove_existing_file(file_path)
+        if answer:
+            return answer, None
+        self.storage_repo.create_item(
+            file_id,
+            file_name,
+            ItemType.FILE,
+            parent_id=folder_id,
+            **metadata,
+        )
+        return None, None
+
+    async def remove_stale_objects(self) -> None:
+        if not self.stale_keys:
+            return
+        keys, self.stale_keys = self.stale_keys, []
+        if self.object_cache:
+            for key in keys:
+                self.object_cache.invalidate(key)
+        if self.stale_objects is not None:
+            self.stale_objects.defer(keys)
+            return
+        try:
+            await self.s3_connector.remove_items(keys)
+        except Exception as ex:  # reconcile.py removes what is left behind
+            logger.warning("Removing replaced objects %s failed: %s", keys, ex)
+
+    async def finish_shared_streams(self) -> None:
+        # failures already reached every reader of the stream
+        if self.shared_streams:
+            await asyncio.gather(*self.shared_streams, return_exceptions=True)
+
+    async def _end_read(self) -> None:
+        # Ends the transaction the lookups started, which hands its pooled
+        # connection back. Called before waiting for S3 admission or moving
+        # data, so transfers never hold a connection that listings need.
+        await self.storage_repo.rollback()
+
+    async def _shared(self, kind: str, key, func):
+        if self.single_flight is None:
+            return await func()
+        return await self.single_flight.do(kind, key, func)
+
+    async def upload_file(
+        self,
+        chunks: AsyncIterable[bytes],
+        file_path: str,
+        content_type: str | None = None,
+    ) -> None:
+        folder_id, file_name = await self._resolve_file_path(file_path)
+        await self._end_read()
         file_id = self.unique_id_factory()
+        digest = ObjectDigest()
 
+        # the body is only read once the upload is admitted, a full upload
+        # lane turns it away before any of it is buffered
+        await self.s3_connector.upload_stream(str(file_id), digest.wrap(chunks))
         try:
-            self.storage_repo.create_item(
+            answer, replaced_key = await self._store_file(
+                file_path,
                 file_id,
+                folder_id,
                 file_name,
-                ItemType.FILE,
-                parent_id=folder_id,
+                size=digest.size,
+                content_type=guess_content_type(file_name, content_type),
+                checksum=digest.checksum,
+                modified_at=datetime.now(timezone.utc),
             )
-            await self.s3_connector.upload_file(
-                key=str(file_id),
-                raw_content=raw_content,
+            if answer:
+                await self.s3_connector.remove_items([str(file_id)])
+                return answer
+            await self.storage_repo.commit()
+        except Exception as ex:
+            await self.storage_repo.rollback()
+            await self.s3_connector.remove_items([str(file_id)])
+            raise ex
+        if replaced_key:
+            self.stale_keys.append(replaced_key)
+
+    async def import_archive(
+        self, chunks: AsyncIterable[bytes], folder_id: ItemId | None = None
+    ) -> PageSchema:
+        folder_ids: dict[tuple[str, ...], ItemId | None] = {(): folder_id}
+        created_folders: set[ItemId] = set()
+        uploaded_keys: list[str] = []
+        uploads: set[asyncio.Task] = set()
+        semaphore = asyncio.Semaphore(self.archive_upload_concurrency)
+        pending_inserts = 0
+
+        async def ensure_folder(parts: tuple[str, ...]) -> ItemId | None:
+            nonlocal pending_inserts
+            if parts in folder_ids:
+                return folder_ids[parts]
+            parent_id = await ensure_folder(parts[:-1])
+            existing = None
+            if parent_id not in created_folders:
+                existing = await self.storage_repo.get_child_item(parent_id, parts[-1])
+            if existing is not None and existing.type != ItemType.FOLDER:
+                raise HTTPException(409, f"{self.delimiter.join(parts)} is not a folder")
+            if existing is not None:
+                folder_ids[parts] = existing.item_id
+            else:
+                new_folder_id = self.unique_id_factory()
+                self.storage_repo.create_item(
+                    new_folder_id, parts[-1], ItemType.FOLDER, parent_id=parent_id
+                )
+                pending_inserts += 1
+                created_folders.add(new_folder_id)
+                folder_ids[parts] = new_folder_id
+            return folder_ids[parts]
+
+        async def upload(key: str, content: bytes) -> None:
+            try:
+                await self.s3_connector.upload_file(key=key, raw_content=content)
+            finally:
+                semaphore.release()
+
+        try:
+            async for member in iter_archive_members(chunks):
+                parts = tuple(
+                    part for part in member.path.split("/") if part and part != "."
+                )
+                if ".." in parts:
+                    raise HTTPException(422, f"Unsafe archive member path {member.path}")
+                if not parts:
+                    continue
+                if member.is_dir:
+                    await ensure_folder(parts)
+                    continue
+
+                file_id = self.unique_id_factory()
+                parent_id = await ensure_folder(parts[:-1])
+                key = str(file_id)
+                uploaded_keys.append(key)
+                if (
+                    member.size is not None
+                    and member.size < self.s3_connector.multipart_chunk_size
+                ):
+                    # small members are buffered so several upload at once while
+                    # the archive stream moves on to the next member
+                    content = b"".join([chunk async for chunk in member.chunks])
+                    digest = ObjectDigest(content)
+                    await semaphore.acquire()
+                    task = asyncio.create_task(upload(key, content))
+                    uploads.add(task)
+                    task.add_done_callback(uploads.discard)
+                else:
+                    digest = ObjectDigest()
+                    await self.s3_connector.upload_stream(key, digest.wrap(member.chunks))
+
+                self.storage_repo.create_item(
+                    file_id,
+                    parts[-1],
+                    ItemType.FILE,
+                    parent_id=parent_id,
+                    size=digest.size,
+                    content_type=guess_content_type(parts[-1]),
+                    checksum=digest.checksum,
+                    modified_at=datetime.now(timezone.utc),
+                )
+                pending_inserts += 1
+                if pending_inserts >= self.archive_insert_batch_size:
+                    await self.storage_repo.flush()
+                    pending_inserts = 0
+
+            await asyncio.gather(*uploads)
+            await self.storage_repo.commit()
+        except Exception as ex:
+            for task in uploads:
+                task.cancel()
+            await asyncio.gather(*uploads, return_exceptions=True)
+            await self.storage_repo.rollback()
+            if uploaded_keys:
+                await self.s3_connector.remove_items(uploaded_keys)
+            if isinstance(ex, ArchiveError):
+                raise HTTPException(422, str(ex))
+            if isinstance(ex, IntegrityError):
+                raise HTTPException(409, "Archive conflicts with existing items")
+            raise ex
+
+        return await self.list_folder_items(folder_id)
+
+    async def _get_upload(self, upload_id: ItemId):
+        upload = await self.upload_repo.get_upload(upload_id, datetime.now(timezone.utc))
+        if upload is None:
+            raise HTTPException(404, "Upload not found")
+        return upload
+
+    async def _list_upload_parts(self, upload) -> list[dict]:
+        try:
+            return await self.s3_connector.list_parts(
+                str(upload.file_id), upload.s3_upload_id
+            )
+        except ClientError as ex:
+            if ex.response.get("Error", {}).get("Code") == "NoSuchUpload":
+                raise HTTPException(404, "Upload not found")
+            raise
+
+    async def create_upload(self, file_path: str) -> UploadSessionSchema:
+        await self._resolve_file_path(file_path)  # fail early on a missing folder
+        await self._end_read()
+
+        upload_id = self.unique_id_factory()
+        file_id = self.unique_id_factory()
+        s3_upload_id = await self.s3_connector.create_multipart_upload(str(file_id))
+        expires_at = datetime.now(timezone.utc) + self.upload_session_ttl
+        self.upload_repo.create_upload(
+            upload_id, file_id, file_path, s3_upload_id, expires_at
+        )
+        await self.upload_repo.commit()
+        return UploadSessionSchema(id=upload_id, path=file_path, expires_at=expires_at)
+
+    async def upload_part(
+        self, upload_id: ItemId, part_number: int, chunks: AsyncIterable[bytes]
+    ) -> UploadPartSchema:
+        if not 1 <= part_number <= MAX_PART_NUMBER:
+            raise HTTPException(422, f"Part number must be in 1..{MAX_PART_NUMBER}")
+        upload = await self._get_upload(upload_id)
+        await self._end_read()
+
+        body = bytearray()
+        async for chunk in chunks:
+            body.extend(chunk)
+            if len(body) > self.upload_max_part_size:
+                raise HTTPException(413, "Part is too large")
+
+        await self.s3_connector.upload_part(
+            str(upload.file_id), upload.s3_upload_id, part_number, bytes(body)
+        )
+        return UploadPartSchema(part_number=part_number, size=len(body))
+
+    async def get_upload(self, upload_id: ItemId) -> UploadSessionSchema:
+        upload = await self._get_upload(upload_id)
+        await self._end_read()
+        parts = await self._list_upload_parts(upload)
+        return UploadSessionSchema(
+            id=upload.upload_id,
+            path=upload.file_path,
+            expires_at=upload.expires_at,
+            parts=[
+                UploadPartSchema(part_number=part["PartNumber"], size=part["Size"])
+                for part in parts
+            ],
+            received=sum(part["Size"] for part in parts),
+        )
+
+    async def complete_upload(self, upload_id: ItemId) -> None:
+        upload = await self._get_upload(upload_id)
+        folder_id, file_name = await self._resolve_file_path(upload.file_path)
+        await self._end_read()
+        key = str(upload.file_id)
+        parts = await self._list_upload_parts(upload)
+        if not parts:
+            raise HTTPException(409, "No parts uploaded")
+
+        small = [
+            part["PartNumber"] for part in parts[:-1] if part["Size"] < MIN_PART_SIZE
+        ]
+        if small:
+            raise HTTPException(
+                400, f"Parts {small} are smaller than {MIN_PART_SIZE} bytes"
             )
+
+        try:
+            await self.s3_connector.complete_multipart_upload(
+                key, upload.s3_upload_id, parts
+            )
+        except ClientError as ex:
+            if ex.response.get("Error", {}).get("Code") == "EntityTooSmall":
+                raise HTTPException(400, "Parts are too small")
+            raise
+        try:
+            answer, replaced_key = await self._store_file(
+                upload.file_path,
+                upload.file_id,
+                folder_id,
+                file_name,
+                size=sum(part["Size"] for part in parts),
+                content_type=guess_content_type(file_name),
+                checksum=multipart_checksum(parts),
+                modified_at=datetime.now(timezone.utc),
+            )
+            if answer:
+                # the multipart upload is completed, the session is done too
+                await self.s3_connector.remove_items([key])
+                await self.upload_repo.remove_upload(upload_id)
+                await self.upload_repo.commit()
+                return answer
+            await self.upload_repo.remove_upload(upload_id)
             await self.storage_repo.commit()
         except Exception as ex:
             await self.storage_repo.rollback()
+            await self.s3_connector.remove_items([key])
+            # the multipart upload no longer exists in S3, a session left
+            # behind would fail every later call on it
+            try:
+                await self.upload_repo.remove_upload(upload_id)
+                await self.upload_repo.commit()
+            except Exception as cleanup_ex:
+                logger.warning("Removing upload %s failed: %s", upload_id, cleanup_ex)
+                await self.upload_repo.rollback()
             raise ex
+        if replaced_key:
+            self.stale_keys.append(replaced_key)
+
+    async def abort_upload(self, upload_id: ItemId) -> None:
+        upload = await self._get_upload(upload_id)
+        await self.s3_connector.abort_multipart_upload(
+            str(upload.file_id), upload.s3_upload_id
+        )
+        await self.upload_repo.remove_upload(upload_id)
+        await self.upload_repo.commit()
+
+    async def abort_expired_uploads(self) -> int:
+        aborted = 0
+        while expired := await self.upload_repo.list_expired_uploads(
+            datetime.now(timezone.utc)
+        ):
+            for upload in expired:
+                try:
+                    await self.s3_connector.abort_multipart_upload(
+                        str(upload.file_id), upload.s3_upload_id
+                    )
+                except ClientError as ex:  # already completed or aborted
+                    logger.warning("Abort of upload %s failed: %s", upload.upload_id, ex)
+                await self.upload_repo.remove_upload(upload.upload_id)
+                aborted += 1
+            await self.upload_repo.commit()
+        return aborted
 
     async def list_folder_items(
         self,
@@ -106,31 +517,81 @@ class FileStorageService:
         page: int = 1,
         per_page: int = 50,
     ) -> PageSchema:
-        limit, offset = self._page_to_limit_offset(page, per_page)
+        return PageSchema.model_validate(
+            await self.list_folder_page(folder_id, query, page, per_page)
+        )
 
-        raw_items = await self.storage_repo.list_items(folder_id, query, limit, offset)
+    async def list_folder_page(
+        self,
+        folder_id: ItemId | None = None,
+        query: str | None = None,
+        page: int = 1,
+        per_page: int = 50,
+        order: SortKey = SortKey.NAME,
+        direction: SortDirection = SortDirection.ASC,
+        cursor: str | None = None,
+    ) -> dict:
+        args = (folder_id, query, page, per_page, order, direction, cursor)
+        fetch = partial(self._list_folder_page, *args)
+        # a session that wrote, or serves a client that just did, must see
+        # its own changes rather than a listing started before them
+        if self.single_flight is None or is_pinned_to_primary(self.storage_repo.session):
+            return await fetch()
+        return await self.single_flight.do("page", args, fetch)
+
+    async def _list_folder_page(
+        self,
+        folder_id: ItemId | None,
+        query: str | None,
+        page: int,
+        per_page: int,
+        order: SortKey,
+        direction: SortDirection,
+        cursor: str | None,
+    ) -> dict:
+        # same shape as PageSchema, built from row tuples without per-item
+        # model validation; routes serialize it straight to JSON
+        limit, offset = self._page_to_limit_offset(page, per_page)
+        after = _decode_cursor(cursor, order) if cursor else None
+
+        rows = await self.storage_repo.list_item_rows(
+            folder_id,
+            query,
+            limit,
+            offset,
+            order=order,
+            direction=direction,
+            after=after,
+        )
         total = await self.storage_repo.list_items(folder_id, query, count_only=True)
         bindings, _ = await self.binding_repo.get_file_binds()
+        bindings = bindings or {}
+        src_prefix = self.src_prefix
 
         items = [
-            FileStorageItemSchema(
-                title=item.name,
-                id=item.item_id,
-                type=item.type,
-                src=self.src_prefix + item.path,
-                path=item.path or item.name,
-                bind_count=(bindings or {}).get(item.path, 0),
-            )
-            for item in raw_items
+            {
+                "title": name,
+                "id": item_id,
+                "type": type_mapping[type_].value,
+                "src": src_prefix + path,
+                "path": path or name,
+                "bind_count": bindings.get(path, 0),
+                "size": size,
+                "content_type": content_type,
+                "checksum": checksum,
+                "modified_at": modified_at,
+            }
+            for item_id, name, type_, path, size, content_type, checksum, modified_at, *_ in rows
         ]
 
-        return PageSchema(
-            current_page=page,
-            items=items,
-            path=await self._construct_page_path(folder_id),
-            all_page=int(total / per_page) + 1,
-            total=total,
-        )
+        return {
+            "current_page": page,
+            "items": items,
+            "path": await self._construct_raw_page_path(folder_id),
+            "all_page": int(total / per_page) + 1,
+            "total": total,
+            "next_cursor": _encode_cursor(rows[-1]) if len(rows) == limit else None,
+        }
 
     async def create_folder(
         self, name: str, parent_id: ItemId | None = None
@@ -159,12 +620,182 @@ class FileStorageService:
         new_parent_id: ItemId | None = None,
         per_page: int = 50,
     ) -> PageSchema:
+        await self._check_move_target(item_id, new_parent_id)
         await self.storage_repo.change_item_parent(item_id, new_parent_id)
         await self.storage_repo.commit()
         page = await self.storage_repo.get_page_number(new_parent_id, item_id, per_page)
 
         return await self.list_folder_items(new_parent_id, page=page, per_page=per_page)
 
+    async def _check_move_target(
+        self, item_id: ItemId, new_parent_id: ItemId | None
+    ) -> None:
+        if new_parent_id is None:
+            return
+        if await self.storage_repo.is_in_subtree(new_parent_id, item_id):
+            raise HTTPException(409, "Cannot move a folder into itself")
+
+    async def _get_item_by_path(self, path: str):
+        items = await self.storage_repo.get_items_by_paths([path])
+        if not items:
+            raise HTTPException(404, "Item not found")
+        return items[0]
+
+    async def _remove_destination(
+        self, item_id: ItemId, destination_path: str, overwrite: bool
+    ) -> list[str] | None:
+        # Deletes what is at `destination_path` in the caller's transaction and
+        # returns the keys of its objects, for `stale_keys` once that commits;
+        # None when there is nothing there
+        existing_item_id = await self.storage_repo.get_item_id_by_path(destination_path)
+        if not existing_item_id:
+            return None
+        if not overwrite:
+            raise HTTPException(412, "Destination exists")
+        # deleting an ancestor of the source would take the source along
+        if await self.storage_repo.is_in_subtree(item_id, existing_item_id):
+            raise HTTPException(409, "Destination contains the source")
+        existing = await self.storage_repo.get_item_by_id(existing_item_id)
+        if await self._subtree_bindings(existing):
+            raise HTTPException(423, "Destination has bound files")
+
+        keys = []
+        async for batch in self.storage_repo.iter_subtree(existing_item_id):
+            keys.extend(str(row.object_key) for row in batch if row.type == ItemType.FILE)
+        await self.storage_repo.remove_item(existing_item_id)
+        return keys
+
+    async def propfind(
+        self, path: str, depth: str, href_prefix: str
+    ) -> AsyncIterable[bytes]:
+        if depth not in DEPTHS:
+            raise HTTPException(400, "Invalid Depth header")
+        max_depth = DEPTHS[depth]
+        path = path.strip(self.delimiter)
+
+        if not path:
+            batches = (
+                self.storage_repo.iter_subtree(None, max_depth=max_depth)
+                if max_depth != 0
+                else _no_batches()
+            )
+            return iter_multistatus(batches, href_prefix, include_root_collection=True)
+
+        item = await self._get_item_by_path(path)
+        batches = self.storage_repo.iter_subtree(item.item_id, max_depth=max_depth)
+        return iter_multistatus(batches, href_prefix)
+
+    async def create_folder_by_path(self, path: str) -> None:
+        parent_id, name = await self._resolve_file_path(path.strip(self.delimiter))
+        try:
+            self.storage_repo.create_item(
+                self.unique_id_factory(), name, ItemType.FOLDER, parent_id=parent_id
+            )
+            await self.storage_repo.commit()
+        except IntegrityError:
+            await self.storage_repo.rollback()
+            raise HTTPException(405, "Item already exists")
+
+    async def move_item_to_path(
+        self, source_path: str, destination_path: str, overwrite: bool = True
+    ) -> bool:
+        item = await self._get_item_by_path(source_path)
+        if source_path == destination_path:
+            raise HTTPException(403, "Source and destination are the same")
+        parent_id, name = await self._resolve_file_path(destination_path)
+        await self._check_move_target(item.item_id, parent_id)
+        replaced_keys = await self._remove_destination(
+            item.item_id, destination_path, overwrite
+        )
+
+        await self.storage_repo.change_item_parent(item.item_id, parent_id, name)
+        await self.storage_repo.commit()
+        if replaced_keys is None:
+            return False
+        self.stale_keys.extend(replaced_keys)
+        return True
+
+    async def copy_item_to_path(
+        self, source_path: str, destination_path: str, overwrite: bool = True
+    ) -> bool:
+        item = await self._get_item_by_path(source_path)
+        if source_path == destination_path:
+            raise HTTPException(403, "Source and destination are the same")
+        parent_id, name = await self._resolve_file_path(destination_path)
+        await self._check_move_target(item.item_id, parent_id)
+
+        new_folder_ids = {}
+        copied_keys = []
+        semaphore = asyncio.Semaphore(self.archive_upload_concurrency)
+
+        async def copy_object(source_key: str, key: str) -> None:
+            async with semaphore:
+                await self.s3_connector.copy_object(source_key, key)
+            copied_keys.append(key)
+
+        try:
+            replaced_keys = await self._remove_destination(
+                item.item_id, destination_path, overwrite
+            )
+            async for batch in self.storage_repo.iter_subtree(item.item_id):
+                copies = []
+                for row in batch:
+                    new_id = self.unique_id_factory()
+                    if row.item_id == item.item_id:
+                        new_parent_id, new_name = parent_id, name
+                    else:
+                        new_parent_id, new_name = new_folder_ids[row.parent_id], row.name
+                    self.storage_repo.create_item(
+                        new_id,
+                        new_name,
+                        row.type,
+                        parent_id=new_parent_id,
+                        size=row.size,
+                        content_type=row.content_type,
+                        checksum=row.checksum,
+                        modified_at=(
+                            datetime.now(timezone.utc)
+                            if row.type == ItemType.FILE
+                            else None
+                        ),
+                    )
+                    if row.type == ItemType.FOLDER:
+                        new_folder_ids[row.item_id] = new_id
+                    else:
+                        copies.append(copy_object(str(row.object_key), str(new_id)))
+                await self.storage_repo.flush()
+                await asyncio.gather(*copies)
+            await self.storage_repo.commit()
+        except Exception as ex:
+            await self.storage_repo.rollback()
+            if copied_keys:
+                await self.s3_connector.remove_items(copied_keys)
+            if isinstance(ex, IntegrityError):
+                raise HTTPException(409, "Destination conflicts with existing items")
+            raise ex
+        if replaced_keys is None:
+            return False
+        self.stale_keys.extend(replaced_keys)
+        return True
+
+    async def remove_item_by_path(self, path: str) -> None:
+        item = await self._get_item_by_path(path.strip(self.delimiter))
+        answer = await self.remove_item(item.item_id)
+        if answer.statusCode == DeleteItemStatusCode.ERROR:
+            raise HTTPException(423, "Item has bound files")
+
+    async def _subtree_bindings(self, item) -> dict:
+        if item.type == ItemType.FILE:
+            bindings, _ = await self.binding_repo.get_file_binds([item.path])
+            return bindings or {}
+        bindings = {}
+        async for batch in self.storage_repo.iter_subtree(item.item_id):
+            batch_bindings, _ = await self.binding_repo.get_file_binds(
+                [row.path for row in batch if row.type == ItemType.FILE]
+            )
+            bindings.update(batch_bindings or {})
+        return bindings
+
     async def remove_item(
         self, item_id: ItemId, per_page: int = 50
     ) -> DeleteItemResponseSchema:
@@ -173,19 +804,7 @@ class FileStorageService:
             item.parent_id, item_id, per_page
         )
 
-        bindings = {}
-        to_delete = [item]
-
-        if item.type == ItemType.FILE:
-            bindings, _ = await self.binding_repo.get_file_binds([item.path])
-        elif item.type == ItemType.FOLDER:
-            total_files = await self.storage_repo.list_items(item_id, count_only=True)
-            to_delete.extend(
-                await self.storage_repo.list_items(item_id, limit=total_files)
-            )
-            bindings, _ = await self.binding_repo.get_file_binds(
-                [file.item_id for file in to_delete]
-            )
+        bindings = await self._subtree_bindings(item)
 
         if bindings:
             binded_items = await self.storage_repo.get_items_by_paths(
@@ -199,7 +818,15 @@ class FileStorageService:
                 ],
             )
         else:
-            await self.s3_connector.remove_items(to_delete)
+            async for batch in self.storage_repo.iter_subtree(item_id):
+                file_keys = [
+                    str(row.object_key) for row in batch if row.type == ItemType.FILE
+                ]
+                if file_keys:
+                    await self.s3_connector.remove_items(file_keys)
+                    if self.object_cache:
+                        for key in file_keys:
+                            self.object_cache.invalidate(key)
             await self.storage_repo.remove_item(item_id)
             await self.storage_repo.commit()
 
@@ -234,7 +861,139 @@ class FileStorageService:
             highlighted_item_id=item.item_id,
         )
 
-    async def get_file_by_path(self, file_path: str) -> StreamingResponse:
-        file_id = await self.storage_repo.get_item_id_by_path(file_path)
-        content = await self.s3_connector.download_file(file_id)
-        return StreamingResponse(content)
+    async def _get_file_row(self, file_path: str):
+        row = await self.storage_repo.get_file_by_path(file_path)
+        if row is None:
+            raise HTTPException(404, "File not found")
+        return row
+
+    async def head_file_by_path(
+        self,
+        file_path: str,
+        if_none_match: str | None = None,
+        if_modified_since: str | None = None,
+    ) -> Response:
+        # answered from the item row alone, S3 is never asked
+        row = await self._get_file_row(file_path)
+        headers = file_headers(row)
+        if is_not_modified(row, if_none_match, if_modified_since):
+            headers.pop("Content-Length", None)
+            return Response(status_code=304, headers=headers)
+        return Response(headers=headers)
+
+    def _is_ranged_download(self, row) -> bool:
+        return (
+            self.ranged_download_threshold > 0
+            and row.size is not None
+            and row.size >= self.ranged_download_threshold
+        )
+
+    async def get_file_by_path(
+        self,
+        file_path: str,
+        if_none_match: str | None = None,
+        if_modified_since: str | None = None,
+    ) -> Response:
+        row = await self._get_file_row(file_path)
+        await self._end_read()
+        key = str(row.object_key)
+        headers = file_headers(row)
+        if is_not_modified(row, if_none_match, if_modified_since):
+            headers.pop("Content-Length", None)
+            return Response(status_code=304, headers=headers)
+
+        local_path = self.s3_connector.file_path(key)
+        if local_path is not None:
+            # a file on local disk is sent by the server itself
+            media_type = headers.get("Content-Type", DEFAULT_CONTENT_TYPE)
+            return ZeroCopyFileResponse(local_path, headers=headers, media_type=media_type)
+
+        if self._is_ranged_download(row):
+            # large objects never fit the cache; several ranges in flight
+            # get past the bandwidth of a single S3 connection
+            chunks = iter_ranges(
+                partial(self._download_range, key),
+                row.size,
+                self.ranged_download_part_size,
+                self.ranged_download_concurrency,
+            )
+            # the first range is admitted or turned away before the status
+            # line goes out, the others queue instead of cutting the body short
+            first = await anext(chunks)
+            return StreamingResponse(_prepend(first, chunks), headers=headers)
+
+        if self.object_cache is None:
+            return StreamingResponse(await self._open_stream(key), headers=headers)
+
+        cached = self.object_cache.get(key)
+        if isinstance(cached, bytes):
+            return Response(cached, headers=headers)
+        if cached is not None:
+            headers["Content-Length"] = str(len(cached))
+            return StreamingResponse(_iter_mapped(cached), headers=headers)
+
+        if self.object_cache.accepts(row.size):
+            content = await self._shared("object", key, partial(self._download_to_cache, key))
+            return Response(content, headers=headers)
+        return StreamingResponse(await self._open_stream(key), headers=headers)
+
+    async def _download_range(self, key: str, start: int, end: int) -> bytes:
+        fetch = partial(
+            self.s3_connector.download_range, key, start, end, queue=start > 0
+        )
+        return await self._shared("range", (key, start, end), fetch)
+
+    async def _download_to_cache(self, key: str) -> bytes:
+        content = await (await self.s3_connector.download_file(key)).read()
+        self.object_cache.put(key, content)
+        return content
+
+    async def _open_stream(self, key: str) -> AsyncIterable[bytes]:
+        # concurrent downloads of one object share a single S3 stream
+        if self.single_flight is None:
+            return await self.s3_connector.download_file(key)
+        chunks, pump = await self.single_flight.stream(
+            "stream", key, partial(self.s3_connector.download_file, key)
+        )
+        if pump is not None:
+            self.shared_streams.append(pump)
+        return chunks
+
+
+def _encode_cursor(row) -> str:
+    position = orjson.dumps([row.sort_rank, row.sort_key, row.item_id])
+    return base64.urlsafe_b64encode(position).decode()
+
+
+def _decode_cursor(cursor: str, order: SortKey) -> tuple:
+    try:
+        rank, key, item_id = orjson.loads(base64.urlsafe_b64decode(cursor))
+        if order == SortKey.MODIFIED:
+            key = datetime.fromisoformat(key)
+        elif order == SortKey.SIZE:
+            key = int(key)
+        return bool(rank), key, UUID(item_id)
+    except (ValueError, TypeError):
+        raise HTTPException(400, "Invalid cursor")
+
+
+async def _no_batches():
+    return
+    yield
+
+
+async def _prepend(first: bytes, rest) -> AsyncIterable[bytes]:
+    try:
+        yield first
+        async for chunk in rest:
+            yield chunk
+    finally:
+        await rest.aclose()  # cancels the ranges fetched ahead
+
+
+async def _iter_mapped(mapped):
+    try:
+        for offset in range(0, len(mapped), STREAM_CHUNK_SIZE):
+            yield mapped[offset : offset + STREAM_CHUNK_SIZE]
+    finally:
+        mapped.close()
@@ -0,0 +1,83 @@
+from email.utils import format_datetime
+from typing import AsyncIterable, AsyncIterator, Sequence
+from urllib.parse import quote, unquote, urlparse
+from xml.sax.saxutils import escape
+
+from sqlalchemy import Row
+
+from app.db.repositories.storage import ItemType
+
+MULTISTATUS_BUFFER_SIZE = 64 * 1024
+
+DEPTHS = {"0": 0, "1": 1, "infinity": None}
+
+_HEADER = '<?xml version="1.0" encoding="utf-8"?>\n<D:multistatus xmlns:D="DAV:">\n'
+_FOOTER = "</D:multistatus>\n"
+
+
+def parse_destination(destination: str, href_prefix: str) -> str | None:
+    path = unquote(urlparse(destination).path)
+    if not path.startswith(href_prefix):
+        return None
+    return path[len(href_prefix) :].strip("/")
+
+
+def render_response(href: str, name: str, is_collection: bool, props: str = "") -> str:
+    resource_type = "<D:collection/>" if is_collection else ""
+    return (
+        "<D:response>"
+        f"<D:href>{escape(href)}</D:href>"
+        "<D:propstat><D:prop>"
+        f"<D:displayname>{escape(name)}</D:displayname>"
+        f"<D:resourcetype>{resource_type}</D:resourcetype>"
+        f"{props}"
+        "</D:prop><D:status>HTTP/1.1 200 OK</D:status></D:propstat>"
+        "</D:response>\n"
+    )
+
+
+def render_file_props(row: Row) -> str:
+    props = []
+    if row.size is not None:
+        props.append(f"<D:getcontentlength>{row.size}</D:getcontentlength>")
+    if row.content_type:
+        props.append(f"<D:getcontenttype>{escape(row.content_type)}</D:getcontenttype>")
+    if row.checksum:
+        props.append(f"<D:getetag>\"{row.checksum}\"</D:getetag>")
+    if row.modified_at is not None:
+        modified = format_datetime(row.modified_at, usegmt=True)
+        props.append(f"<D:getlastmodified>{modified}</D:getlastmodified>")
+    return "".join(props)
+
+
+def render_item(row: Row, href_prefix: str) -> str:
+    is_collection = row.type == ItemType.FOLDER
+    href = href_prefix + quote(row.path or row.name) + ("/" if is_collection else "")
+    props = "" if is_collection else render_file_props(row)
+    return render_response(href, row.name, is_collection, props)
+
+
+async def iter_multistatus(
+    batches: AsyncIterable[Sequence[Row]],
+    href_prefix: str,
+    *,
+    include_root_collection: bool = False,
+) -> AsyncIterator[bytes]:
+    # responses are rendered as the cursor yields rows and flushed in
+    # buffer-sized chunks, so the document is never built in memory
+    buffer = [_HEADER]
+    size = len(_HEADER)
+    if include_root_collection:
+        buffer.append(render_response(href_prefix, "/", True))
+
+    async for batch in batches:
+        for row in batch:
+            response = render_item(row, href_prefix)
+            buffer.append(response)
+            size += len(response)
+        if size >= MULTISTATUS_BUFFER_SIZE:
+            yield "".join(buffer).encode()
+            buffer, size = [], 0
+
+    buffer.append(_FOOTER)
+    yield "".join(buffer).encode()
@@ -1,7 +1,18 @@
+from typing import Literal
+
+from pydantic import BaseModel
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from functools import lru_cache
 
 
+class S3Shard(BaseModel):
+    name: str
+    endpoint: str
+    bucket_name: str
+    access_key: str
+    secret_key: str
+
+
 class Settings(BaseSettings):
     model_config = SettingsConfigDict(env_file=".env")
 
@@ -16,9 +27,75 @@ class Settings(BaseSettings):
     POSTGRES_HOST: str
     POSTGRES_PORT: str
 
+    POSTGRES_REPLICA_CONN_STRINGS: list[str] = []
+    REPLICA_STICKINESS_SECONDS: int = 10
+
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: float = 30
+    DB_POOL_RECYCLE: int = -1
+    DB_POOL_PRE_PING: bool = False
+    DB_PREPARED_STATEMENT_CACHE_SIZE: int = 100
+
     SRC_PREFIX: str = "/fm2/a/"
 
     PER_PAGE: int = 50
+    # listing pages at least this large are gzip/brotli compressed when the
+    # client accepts it, 0 disables compression
+    LISTING_COMPRESS_MIN_SIZE: int = 16 * 1024
+
+    # "local" keeps objects in LOCAL_STORAGE_ROOT instead of S3
+    STORAGE_BACKEND: Literal["s3", "local"] = "s3"
+    LOCAL_STORAGE_ROOT: str = "/var/lib/pgs3/objects"
+    LOCAL_STORAGE_THREADS: int = 16
+
+    # JSON list of S3Shard; when empty the single bucket above is used
+    S3_SHARDS: list[S3Shard] = []
+    # shard names before the last change, set while rebalance_shards.py runs
+    S3_PREVIOUS_SHARDS: list[str] = []
+
+    S3_MULTIPART_CHUNK_SIZE: int = 8 * 1024 * 1024
+    S3_MULTIPART_CONCURRENCY: int = 4
+    # concurrent operations and queue length per S3 operation type
+    S3_UPLOAD_CONCURRENCY: int = 16
+    S3_UPLOAD_QUEUE: int = 32
+    S3_DOWNLOAD_CONCURRENCY: int = 64
+    S3_DOWNLOAD_QUEUE: int = 256
+    S3_DELETE_CONCURRENCY: int = 4
+    S3_DELETE_QUEUE: int = 16
+    S3_METADATA_CONCURRENCY: int = 32
+    S3_METADATA_QUEUE: int = 128
+    S3_RETRY_AFTER: int = 1
+    # downloads of files at least this large are fetched as concurrent
+    # ranged GETs, 0 streams every object with a single GET
+    S3_RANGED_DOWNLOAD_THRESHOLD: int = 64 * 1024 * 1024
+    S3_RANGED_DOWNLOAD_PART_SIZE: int = 8 * 1024 * 1024
+    S3_RANGED_DOWNLOAD_CONCURRENCY: int = 4
+
+    # concurrent identical listings and downloads share one query or stream;
+    # a late reader can join a stream until it has read past the replay size
+    # and one that falls behind the fastest reader is dropped
+    SINGLE_FLIGHT: bool = True
+    SINGLE_FLIGHT_REPLAY_BYTES: int = 1024 * 1024
+    SINGLE_FLIGHT_STALL_TIMEOUT: float = 30
+
+    ARCHIVE_UPLOAD_CONCURRENCY: int = 4
+    ARCHIVE_INSERT_BATCH_SIZE: int = 500
+
+    OBJECT_CACHE_MAX_OBJECT_SIZE: int = 256 * 1024
+    OBJECT_CACHE_MEMORY_BUDGET: int = 0  # bytes, 0 disables the cache
+    OBJECT_CACHE_DISK_DIR: str | None = None
+    OBJECT_CACHE_DISK_BUDGET: int = 0
+
+    # objects replaced by an overwrite are removed this many seconds later,
+    # so downloads that started on the old content can finish; 0 removes
+    # them right after the response
+    STALE_OBJECT_GRACE: int = 5 * 60
+    STALE_OBJECT_SWEEP_INTERVAL: int = 30
+
+    UPLOAD_SESSION_TTL: int = 24 * 60 * 60
+    UPLOAD_CLEANUP_INTERVAL: int = 10 * 60
+    UPLOAD_MAX_PART_SIZE: int = 64 * 1024 * 1024
     DEBUG: bool = False
 
     @property
@@ -0,0 +1,153 @@
+"""Per-item cost of building and serializing a listing page.
+
+Compares the ORM entity -> FileStorageItemSchema -> jsonable_encoder pipeline
+with the row-tuple -> dict -> orjson fast path used by /filesV4.
+
+    python -m benchmarks.listing --items 1000 --rounds 50
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+from collections import namedtuple
+from datetime import datetime, timezone
+from uuid import uuid4
+
+# the benchmark never connects anywhere, settings only have to validate
+for _name in (
+    "S3_ACCESS_KEY",
+    "S3_ENDPOINT",
+    "S3_SECRET_KEY",
+    "S3_BUCKET_NAME",
+    "POSTGRES_USER",
+    "POSTGRES_PASSWORD",
+    "POSTGRES_DB",
+    "POSTGRES_HOST",
+):
+    os.environ.setdefault(_name, "benchmark")
+os.environ.setdefault("POSTGRES_PORT", "5432")
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+
+from app.db.models.item import Item
+from app.db.repositories.bindings import BindingsRepositoryProtocol
+from app.db.repositories.storage import ItemType
+from app.schemas import FileStorageItemSchema, PageSchema
+from app.services.storage import FileStorageService
+
+
+class NoBindings(BindingsRepositoryProtocol):
+    async def get_file_binds(self, files_paths=None):
+        return {}, None
+
+
+ListingRow = namedtuple(
+    "ListingRow",
+    (
+        "item_id",
+        "name",
+        "type",
+        "path",
+        "size",
+        "content_type",
+        "checksum",
+        "modified_at",
+        "sort_rank",
+        "sort_key",
+    ),
+)
+
+
+class InMemoryRepo:
+    def __init__(self, count: int) -> None:
+        self.rows = [
+            ListingRow(
+                uuid4(),
+                f"item{i:06}",
+                ItemType.FOLDER.value if i % 10 == 0 else ItemType.FILE.value,
+                f"some/folder/item{i:06}",
+                1024,
+                "text/plain",
+                "d41d8cd98f00b204e9800998ecf8427e",
+                datetime.now(timezone.utc),
+                i % 10 != 0,
+                f"item{i:06}",
+            )
+            for i in range(count)
+        ]
+
+    async def list_items(self, parent_id=None, search_query=None, limit=10, offset=0, *, count_only=False):
+        if count_only:
+            return len(self.rows)
+        return [
+            Item(item_id=item_id, name=name, type=type_, path=path)
+            for item_id, name, type_, path, *_ in self.rows[offset : offset + limit]
+        ]
+
+    async def list_item_rows(self, parent_id=None, search_query=None, limit=10, offset=0, **order):
+        return self.rows[offset : offset + limit]
+
+    async def get_item_path(self, item_id):
+        return []
+
+
+async def legacy_page(service: FileStorageService, per_page: int) -> bytes:
+    raw_items = await service.storage_repo.list_items(None, None, per_page, 0)
+    total = await service.storage_repo.list_items(None, None, count_only=True)
+    bindings, _ = await service.binding_repo.get_file_binds()
+    items = [
+        FileStorageItemSchema(
+            title=item.name,
+            id=item.item_id,
+            type=item.type,
+            src=service.src_prefix + item.path,
+            path=item.path or item.name,
+            bind_count=(bindings or {}).get(item.path, 0),
+        )
+        for item in raw_items
+    ]
+    page = PageSchema(
+        current_page=1,
+        items=items,
+        path=await service._construct_page_path(None),
+        all_page=int(total / per_page) + 1,
+        total=total,
+    )
+    # what FastAPI's default JSONResponse does with a returned model
+    return json.dumps(jsonable_encoder(page)).encode()
+
+
+async def fast_page(service: FileStorageService, per_page: int) -> bytes:
+    return orjson.dumps(await service.list_folder_page(None, None, 1, per_page))
+
+
+async def measure(func, service, per_page: int, rounds: int) -> float:
+    await func(service, per_page)  # warm up
+    started = time.perf_counter()
+    for _ in range(rounds):
+        await func(service, per_page)
+    return (time.perf_counter() - started) / rounds / per_page
+
+
+async def main(items: int, rounds: int) -> None:
+    service = FileStorageService(
+        storage_repo=InMemoryRepo(items),
+        binding_repo=NoBindings(),
+        src_prefix="/fm2/a/",
+    )
+    legacy = await measure(legacy_page, service, items, rounds)
+    fast = await measure(fast_page, service, items, rounds)
+    print(f"items per page: {items}, rounds: {rounds}")
+    print(f"legacy (ORM + schema + jsonable_encoder): {legacy * 1e6:8.2f} us/item")
+    print(f"fast   (row tuples + dict + orjson):      {fast * 1e6:8.2f} us/item")
+    print(f"speedup: {legacy / fast:.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="ListingBenchmark")
+    parser.add_argument("--items", type=int, default=1000)
+    parser.add_argument("--rounds", type=int, default=50)
+    args = parser.parse_args()
+    asyncio.run(main(args.items, args.rounds))
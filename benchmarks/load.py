@@ -0,0 +1,367 @@
+"""Load test of app.main:app under a ramped mix of requests.
+
+Requests are driven straight into the ASGI app in this process, against the
+Postgres configured in the environment (with migrations applied, see
+`make repo-test`) and an in-process moto S3 server, or any S3 endpoint given
+with --s3-endpoint. Every stage runs the mix at a fixed concurrency and
+reports per route: throughput, latency percentiles, error rate and the
+number of DB statements and S3 calls per request.
+
+    python -m benchmarks.load --stages 1,8,32 --duration 10
+    python -m benchmarks.load --replay requests.jsonl
+
+A replay file has one request per line:
+{"method": "GET", "path": "/filesV4", "query": "page=2", "headers": {}, "body": ""}
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+from collections import defaultdict
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Callable
+from urllib.parse import quote, unquote, urlencode
+from uuid import uuid4
+
+import orjson
+
+SEED_FOLDERS = 20
+SEED_FILES_PER_FOLDER = 50
+FILE_SIZE = 16 * 1024
+BOUNDARY = "loadtest-boundary"
+
+
+@dataclass
+class Call:
+    route: str
+    latency: float
+    status: int
+    db: int = 0
+    s3: int = 0
+
+
+@dataclass
+class RequestStats:
+    db: int = 0
+    s3: int = 0
+
+
+@dataclass
+class Workload:
+    prefix: str
+    folder_ids: list[str] = field(default_factory=list)
+    folder_paths: list[str] = field(default_factory=list)
+    file_paths: list[str] = field(default_factory=list)
+    uploaded_paths: list[str] = field(default_factory=list)
+
+
+_current: ContextVar[RequestStats | None] = ContextVar("load_request", default=None)
+
+
+def _count_db(*args, **kwargs) -> None:
+    stats = _current.get()
+    if stats is not None:
+        stats.db += 1
+
+
+def _instrument() -> None:
+    # statement and API call counts are attributed to the request whose
+    # task issued them through a context variable
+    from aiobotocore.client import AioBaseClient
+    from sqlalchemy import event
+
+    from app.db.core import engine, replica_engines
+
+    for db_engine in [engine, *replica_engines]:
+        event.listen(db_engine.sync_engine, "before_cursor_execute", _count_db)
+
+    make_api_call = AioBaseClient._make_api_call
+
+    async def counted_api_call(self, operation_name, api_params):
+        stats = _current.get()
+        if stats is not None:
+            stats.s3 += 1
+        return await make_api_call(self, operation_name, api_params)
+
+    AioBaseClient._make_api_call = counted_api_call
+
+
+async def request(
+    app,
+    method: str,
+    path: str,
+    query: str = "",
+    headers: dict[str, str] | None = None,
+    body: bytes = b"",
+) -> tuple[str, int, bytes]:
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": unquote(path),
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": query.encode(),
+        "headers": [
+            (name.lower().encode(), value.encode())
+            for name, value in {"host": "loadtest", **(headers or {})}.items()
+        ],
+        "client": ("127.0.0.1", 0),
+        "server": ("loadtest", 80),
+    }
+    finished = asyncio.Event()
+    pending = [{"type": "http.request", "body": body, "more_body": False}]
+    status = 0
+    chunks = []
+
+    async def receive():
+        if pending:
+            return pending.pop()
+        # streaming responses listen for a disconnect while they send
+        await finished.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body"):
+                finished.set()
+
+    try:
+        await app(scope, receive, send)
+    finally:
+        finished.set()
+    route = scope.get("route")
+    return f"{method} {route.path if route else path}", status, b"".join(chunks)
+
+
+def _multipart(name: str, content: bytes) -> tuple[dict[str, str], bytes]:
+    body = (
+        f"--{BOUNDARY}\r\n"
+        f'Content-Disposition: form-data; name="file"; filename="{name}"\r\n'
+        "Content-Type: application/octet-stream\r\n\r\n"
+    ).encode() + content + f"\r\n--{BOUNDARY}--\r\n".encode()
+    return {"content-type": f"multipart/form-data; boundary={BOUNDARY}"}, body
+
+
+async def _checked(app, *args, **kwargs) -> bytes:
+    route, status, body = await request(app, *args, **kwargs)
+    if status >= 400:
+        raise RuntimeError(f"{route} returned {status}: {body[:200]!r}")
+    return body
+
+
+async def seed(app, folders: int, files_per_folder: int) -> Workload:
+    workload = Workload(prefix=f"loadtest-{uuid4().hex[:8]}")
+    await _checked(app, "MKCOL", f"/file/{workload.prefix}")
+    content = os.urandom(FILE_SIZE)
+    for i in range(folders):
+        folder = f"{workload.prefix}/folder{i:03}"
+        await _checked(app, "MKCOL", "/file/" + quote(folder))
+        workload.folder_paths.append(folder)
+        for j in range(files_per_folder):
+            path = f"{folder}/file{j:04}"
+            headers, body = _multipart(f"file{j:04}", content)
+            await _checked(app, "PUT", "/file/" + quote(path), headers=headers, body=body)
+            workload.file_paths.append(path)
+
+    page = orjson.loads(
+        await _checked(app, "GET", "/page-by-path", urlencode({"path": workload.prefix}))
+    )
+    page = orjson.loads(
+        await _checked(
+            app,
+            "GET",
+            "/filesV4",
+            urlencode({"id": page["highlighted_item_id"], "per_page": folders}),
+        )
+    )
+    workload.folder_ids = [item["id"] for item in page["items"]]
+    return workload
+
+
+def synthetic_mix(workload: Workload) -> list[tuple[float, Callable]]:
+    def listing():
+        return "GET", "/filesV4", urlencode(
+            {"id": random.choice(workload.folder_ids), "page": random.randint(1, 2)}
+        ), None, b""
+
+    def search():
+        return "GET", "/find_file", urlencode(
+            {"text": f"file{random.randint(0, 99):02}"}
+        ), None, b""
+
+    def download():
+        return "GET", "/file/" + quote(random.choice(workload.file_paths)), "", None, b""
+
+    def upload():
+        name = f"upload-{uuid4().hex}"
+        path = f"{random.choice(workload.folder_paths)}/{name}"
+        workload.uploaded_paths.append(path)
+        headers, body = _multipart(name, os.urandom(FILE_SIZE))
+        return "PUT", "/file/" + quote(path), "", headers, body
+
+    def move():
+        # only uploaded files move, so downloads keep finding seeded ones
+        if not workload.uploaded_paths:
+            return listing()
+        source = workload.uploaded_paths.pop(random.randrange(len(workload.uploaded_paths)))
+        target = f"{random.choice(workload.folder_paths)}/{source.rsplit('/', 1)[1]}"
+        workload.uploaded_paths.append(target)
+        headers = {"destination": "http://loadtest/file/" + quote(target)}
+        return "MOVE", "/file/" + quote(source), "", headers, b""
+
+    return [
+        (0.45, listing),
+        (0.15, search),
+        (0.2, download),
+        (0.12, upload),
+        (0.08, move),
+    ]
+
+
+async def run_stage(
+    app, mix, concurrency: int, duration: float
+) -> tuple[list[Call], float]:
+    weights = [weight for weight, _ in mix]
+    makers = [maker for _, maker in mix]
+    calls: list[Call] = []
+    deadline = time.perf_counter() + duration
+
+    async def worker() -> None:
+        while time.perf_counter() < deadline:
+            method, path, query, headers, body = random.choices(makers, weights)[0]()
+            stats = RequestStats()
+            token = _current.set(stats)
+            started = time.perf_counter()
+            try:
+                route, status, _ = await request(app, method, path, query, headers, body)
+            except Exception:
+                route, status = f"{method} {path}", 599
+            finally:
+                _current.reset(token)
+            calls.append(
+                Call(route, time.perf_counter() - started, status, stats.db, stats.s3)
+            )
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return calls, time.perf_counter() - started
+
+
+def _percentile(values: list[float], q: float) -> float:
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def report(concurrency: int, calls: list[Call], elapsed: float) -> None:
+    print(
+        f"\nconcurrency {concurrency}: {len(calls)} requests, "
+        f"{len(calls) / elapsed:.1f} req/s"
+    )
+    print(
+        f"{'route':<36} {'count':>6} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} "
+        f"{'p99 ms':>8} {'err %':>6} {'db/req':>7} {'s3/req':>7}"
+    )
+    by_route = defaultdict(list)
+    for call in calls:
+        by_route[call.route].append(call)
+    for route, route_calls in sorted(by_route.items()):
+        latencies = sorted(call.latency * 1000 for call in route_calls)
+        errors = sum(call.status >= 500 for call in route_calls)
+        count = len(route_calls)
+        print(
+            f"{route[:36]:<36} {count:>6} {count / elapsed:>8.1f} "
+            f"{_percentile(latencies, 0.5):>8.1f} {_percentile(latencies, 0.95):>8.1f} "
+            f"{_percentile(latencies, 0.99):>8.1f} {errors / count * 100:>6.1f} "
+            f"{sum(call.db for call in route_calls) / count:>7.1f} "
+            f"{sum(call.s3 for call in route_calls) / count:>7.1f}"
+        )
+
+
+def replay_mix(path: str) -> list[tuple[float, Callable]]:
+    with open(path) as file:
+        recorded = [json.loads(line) for line in file if line.strip()]
+
+    def make(entry):
+        return lambda: (
+            entry["method"],
+            entry["path"],
+            entry.get("query", ""),
+            entry.get("headers"),
+            entry.get("body", "").encode(),
+        )
+
+    return [(1.0, make(entry)) for entry in recorded]
+
+
+def _start_moto() -> str:
+    try:
+        from moto.server import ThreadedMotoServer
+    except ImportError:
+        raise SystemExit("moto[server] is required, or pass --s3-endpoint")
+    server = ThreadedMotoServer(port=0)
+    server.start()
+    host, port = server.get_host_and_port()
+    return f"http://{host}:{port}"
+
+
+async def main(args) -> None:
+    from app.main import app, make_s3_connector
+    from app.metrics import metrics
+
+    _instrument()
+    if args.create_bucket:
+        async with make_s3_connector() as connector:
+            await connector.create_bucket(os.environ["S3_BUCKET_NAME"])
+
+    workload = None
+    if args.replay:
+        mix = replay_mix(args.replay)
+    else:
+        workload = await seed(app, args.folders, args.files)
+        mix = synthetic_mix(workload)
+
+    for concurrency in args.stages:
+        calls, elapsed = await run_stage(app, mix, concurrency, args.duration)
+        report(concurrency, calls, elapsed)
+
+    if workload is not None:
+        await _checked(app, "DELETE", "/file/" + quote(workload.prefix))
+    print("\ncounters:", metrics.snapshot()["counters"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="LoadTest")
+    parser.add_argument(
+        "--stages",
+        type=lambda value: [int(stage) for stage in value.split(",")],
+        default=[1, 4, 16, 64],
+        help="comma separated concurrency levels, run in order",
+    )
+    parser.add_argument("--duration", type=float, default=10, help="seconds per stage")
+    parser.add_argument("--folders", type=int, default=SEED_FOLDERS)
+    parser.add_argument("--files", type=int, default=SEED_FILES_PER_FOLDER)
+    parser.add_argument("--replay", help="JSON lines file of recorded requests")
+    parser.add_argument("--s3-endpoint", help="use this S3 endpoint instead of moto")
+    args = parser.parse_args()
+
+    # settings are read when the app is imported, after the endpoint is known
+    args.create_bucket = args.s3_endpoint is None
+    os.environ["S3_ENDPOINT"] = args.s3_endpoint or _start_moto()
+    if args.create_bucket:
+        for name, value in (
+            ("S3_ACCESS_KEY", "loadtest"),
+            ("S3_SECRET_KEY", "loadtest"),
+            ("S3_BUCKET_NAME", "loadtest"),
+        ):
+            os.environ.setdefault(name, value)
+        os.environ["DEBUG"] = "false"
+    asyncio.run(main(args))
@@ -0,0 +1,42 @@
+"""add upload session
+
+Revision ID: 5c1e7a0d9b42
+Revises: bdb762b4f19b
+Create Date: 2026-10-19 10:12:31.208114
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "5c1e7a0d9b42"
+down_revision = "bdb762b4f19b"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "upload_session",
+        sa.Column("upload_id", sa.UUID(), nullable=False),
+        sa.Column("file_id", sa.UUID(), nullable=False),
+        sa.Column("file_path", sa.String(), nullable=False),
+        sa.Column("s3_upload_id", sa.String(), nullable=False),
+        sa.Column(
+            "created_at",
+            sa.DateTime(timezone=True),
+            server_default=sa.text("now()"),
+            nullable=False,
+        ),
+        sa.Column("expires_at", sa.DateTime(timezone=True), nullable=False),
+        sa.PrimaryKeyConstraint("upload_id"),
+    )
+    op.create_index(
+        "ix_upload_session_expires_at", "upload_session", ["expires_at"], unique=False
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_upload_session_expires_at", table_name="upload_session")
+    op.drop_table("upload_session")
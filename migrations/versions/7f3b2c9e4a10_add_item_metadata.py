@@ -0,0 +1,32 @@
+"""add item metadata
+
+Revision ID: 7f3b2c9e4a10
+Revises: 5c1e7a0d9b42
+Create Date: 2026-10-19 14:02:47.615920
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "7f3b2c9e4a10"
+down_revision = "5c1e7a0d9b42"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column("item", sa.Column("size", sa.BigInteger(), nullable=True))
+    op.add_column("item", sa.Column("content_type", sa.String(), nullable=True))
+    op.add_column("item", sa.Column("checksum", sa.String(), nullable=True))
+    op.add_column(
+        "item", sa.Column("modified_at", sa.DateTime(timezone=True), nullable=True)
+    )
+
+
+def downgrade() -> None:
+    op.drop_column("item", "modified_at")
+    op.drop_column("item", "checksum")
+    op.drop_column("item", "content_type")
+    op.drop_column("item", "size")
@@ -0,0 +1,44 @@
+"""add listing order indexes
+
+Revision ID: 9a4d6e1f2b73
+Revises: 7f3b2c9e4a10
+Create Date: 2026-10-19 15:21:08.340112
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "9a4d6e1f2b73"
+down_revision = "7f3b2c9e4a10"
+branch_labels = None
+depends_on = None
+
+ORDER_KEYS = {
+    "name": "name",
+    "size": "coalesce(size, -1)",
+    "modified": "coalesce(modified_at, 'epoch'::timestamptz)",
+    "type": "coalesce(content_type, '')",
+}
+
+
+def upgrade() -> None:
+    # built concurrently so listings keep working on a large item table
+    with op.get_context().autocommit_block():
+        for order, key in ORDER_KEYS.items():
+            op.create_index(
+                f"ix_item_order_{order}",
+                "item",
+                ["parent_id", sa.text("(type <> 'd')"), sa.text(key), "item_id"],
+                unique=False,
+                postgresql_concurrently=True,
+            )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for order in ORDER_KEYS:
+            op.drop_index(
+                f"ix_item_order_{order}", table_name="item", postgresql_concurrently=True
+            )
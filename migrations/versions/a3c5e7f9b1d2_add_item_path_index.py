@@ -0,0 +1,37 @@
+"""add item path index
+
+Revision ID: a3c5e7f9b1d2
+Revises: f1a6d8b3c2e5
+Create Date: 2026-10-19 20:12:40.517903
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "a3c5e7f9b1d2"
+down_revision = "f1a6d8b3c2e5"
+branch_labels = None
+depends_on = None
+
+PARTITIONS = 16
+PARTITION_NAMES = [f"item_part_{remainder:02}" for remainder in range(PARTITIONS)]
+INDEX = "ix_item_path"
+INDEX_DEFINITION = "(path)"
+
+
+def upgrade() -> None:
+    # downloads and WebDAV resolve items by path, which used to scan every
+    # partition; built the same way as ix_item_object_key
+    op.execute(f"CREATE INDEX {INDEX} ON ONLY item {INDEX_DEFINITION}")
+    with op.get_context().autocommit_block():
+        for partition in PARTITION_NAMES:
+            op.execute(
+                f"CREATE INDEX CONCURRENTLY {INDEX}_{partition} "
+                f"ON {partition} {INDEX_DEFINITION}"
+            )
+            op.execute(f"ALTER INDEX {INDEX} ATTACH PARTITION {INDEX}_{partition}")
+
+
+def downgrade() -> None:
+    op.drop_index(INDEX, table_name="item")
@@ -0,0 +1,111 @@
+"""add partitioned item shadow table
+
+Revision ID: b2e8f4c1d6a9
+Revises: 9a4d6e1f2b73
+Create Date: 2026-10-19 16:40:12.771305
+
+First half of the move to a hash-partitioned `item` table. Creates `item_p`,
+partitioned on parent_id so every folder listing reads one partition, and
+keeps it in sync with `item` through a row trigger. Existing rows are copied
+by `python partition_items.py`, after which the next revision swaps the
+tables. Nothing here blocks reads or writes on `item`.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "b2e8f4c1d6a9"
+down_revision = "9a4d6e1f2b73"
+branch_labels = None
+depends_on = None
+
+PARTITIONS = 16
+ZERO_UUID = "00000000-0000-0000-0000-000000000000"
+COLUMNS = "item_id, name, parent_id, type, path, size, content_type, checksum, modified_at"
+
+ORDER_KEYS = {
+    "name": "name",
+    "size": "coalesce(size, -1)",
+    "modified": "coalesce(modified_at, 'epoch'::timestamptz)",
+    "type": "coalesce(content_type, '')",
+}
+
+
+def upgrade() -> None:
+    op.execute(
+        """CREATE TABLE item_p (
+    item_id uuid NOT NULL,
+    name varchar NOT NULL,
+    parent_id uuid,
+    type varchar(1) NOT NULL,
+    path varchar,
+    size bigint,
+    content_type varchar,
+    checksum varchar,
+    modified_at timestamptz
+) PARTITION BY HASH (parent_id)"""
+    )
+    for remainder in range(PARTITIONS):
+        partition = f"item_part_{remainder:02}"
+        op.execute(
+            f"CREATE TABLE {partition} PARTITION OF item_p "
+            f"FOR VALUES WITH (MODULUS {PARTITIONS}, REMAINDER {remainder})"
+        )
+        # unique indexes on a partitioned table must contain the partition
+        # key, so these live on every partition. Siblings share parent_id and
+        # therefore a partition, which keeps the name index globally unique;
+        # roots (NULL parent) all hash to the same partition as well. item_id
+        # is only unique per partition, it is a random uuid4 everywhere.
+        # (uix_item_id_name is not carried over, item_id alone is unique.)
+        op.execute(f"CREATE UNIQUE INDEX uix_{partition}_item_id ON {partition} (item_id)")
+        op.execute(
+            f"CREATE UNIQUE INDEX uix_{partition}_folder_name_parent_id "
+            f"ON {partition} (name, coalesce(parent_id, '{ZERO_UUID}'))"
+        )
+    for order, key in ORDER_KEYS.items():
+        op.execute(
+            f"CREATE INDEX ix_item_order_{order}_p "
+            f"ON item_p (parent_id, (type <> 'd'), {key}, item_id)"
+        )
+
+    # resume point of partition_items.py
+    op.create_table(
+        "item_p_backfill",
+        sa.Column("last_item_id", sa.UUID(), nullable=True),
+        sa.Column("completed_at", sa.DateTime(timezone=True), nullable=True),
+    )
+    op.execute("INSERT INTO item_p_backfill VALUES (NULL, NULL)")
+
+    op.execute(
+        f"""CREATE OR REPLACE FUNCTION public._sync_item_p()
+ RETURNS trigger
+ LANGUAGE plpgsql
+AS $function$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        DELETE FROM item_p WHERE item_id = OLD.item_id;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO item_p ({COLUMNS}) VALUES (
+            NEW.item_id, NEW.name, NEW.parent_id, NEW.type, NEW.path,
+            NEW.size, NEW.content_type, NEW.checksum, NEW.modified_at
+        );
+    END IF;
+    RETURN NULL;
+END;
+$function$
+;"""
+    )
+    op.execute(
+        """CREATE TRIGGER sync_item_p AFTER INSERT OR UPDATE OR DELETE ON item
+FOR EACH ROW EXECUTE PROCEDURE _sync_item_p();"""
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER sync_item_p ON item;")
+    op.execute("DROP FUNCTION _sync_item_p;")
+    op.drop_table("item_p_backfill")
+    op.execute("DROP TABLE item_p;")
@@ -0,0 +1,204 @@
+"""swap in partitioned item table
+
+Revision ID: c7d1a5e3f8b0
+Revises: b2e8f4c1d6a9
+Create Date: 2026-10-19 17:22:48.104519
+
+Replaces `item` with the partitioned shadow table. Run `python
+partition_items.py` first: rows it has not copied yet are copied here while
+`item` is locked. Postgres 12 cannot declare the primary key, the
+self-referencing foreign key or BEFORE row triggers on a table partitioned by
+parent_id, so the foreign key (ON DELETE / ON UPDATE CASCADE) is emulated with
+row triggers, and these and the path trigger are created on every partition.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "c7d1a5e3f8b0"
+down_revision = "b2e8f4c1d6a9"
+branch_labels = None
+depends_on = None
+
+PARTITIONS = 16
+PARTITION_NAMES = [f"item_part_{remainder:02}" for remainder in range(PARTITIONS)]
+ORDER_KEYS = {
+    "name": "name",
+    "size": "coalesce(size, -1)",
+    "modified": "coalesce(modified_at, 'epoch'::timestamptz)",
+    "type": "coalesce(content_type, '')",
+}
+ZERO_UUID = "00000000-0000-0000-0000-000000000000"
+COLUMNS = "item_id, name, parent_id, type, path, size, content_type, checksum, modified_at"
+
+
+def upgrade() -> None:
+    op.execute("LOCK TABLE item IN ACCESS EXCLUSIVE MODE")
+    # rows past the backfill position that the sync trigger has not copied
+    op.execute(
+        f"""DO $$
+DECLARE last uuid;
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM item_p_backfill WHERE completed_at IS NOT NULL) THEN
+        SELECT last_item_id INTO last FROM item_p_backfill;
+        INSERT INTO item_p ({COLUMNS})
+        SELECT {COLUMNS} FROM item i
+        WHERE (last IS NULL OR i.item_id > last)
+        AND NOT EXISTS (SELECT 1 FROM item_p p WHERE p.item_id = i.item_id);
+    END IF;
+END $$;"""
+    )
+    op.execute("DROP TABLE item")  # takes sync_item_p with it
+    op.execute("DROP FUNCTION _sync_item_p;")
+    op.drop_table("item_p_backfill")
+    op.execute("ALTER TABLE item_p RENAME TO item")
+    for order in ORDER_KEYS:
+        op.execute(f"ALTER INDEX ix_item_order_{order}_p RENAME TO ix_item_order_{order}")
+
+    op.execute(
+        """CREATE OR REPLACE FUNCTION public._check_item_parent()
+ RETURNS trigger
+ LANGUAGE plpgsql
+AS $function$
+BEGIN
+    -- moving a row to another partition runs no AFTER UPDATE trigger, which
+    -- _cascade_item_update needs
+    IF TG_OP = 'UPDATE' AND NEW.item_id <> OLD.item_id
+        AND NEW.parent_id IS DISTINCT FROM OLD.parent_id THEN
+        RAISE EXCEPTION 'item_id and parent_id of item % cannot change together', OLD.item_id
+            USING ERRCODE = 'feature_not_supported';
+    END IF;
+    IF NEW.parent_id IS NOT NULL
+        AND (TG_OP = 'INSERT' OR NEW.parent_id IS DISTINCT FROM OLD.parent_id) THEN
+        -- the same lock a foreign key takes, a concurrent delete of the parent waits
+        PERFORM 1 FROM item WHERE item_id = NEW.parent_id FOR KEY SHARE;
+        IF NOT FOUND THEN
+            RAISE EXCEPTION 'parent % of item % does not exist', NEW.parent_id, NEW.item_id
+                USING ERRCODE = 'foreign_key_violation';
+        END IF;
+    END IF;
+    RETURN NEW;
+END;
+$function$
+;"""
+    )
+    op.execute(
+        """CREATE OR REPLACE FUNCTION public._cascade_item_delete()
+ RETURNS trigger
+ LANGUAGE plpgsql
+AS $function$
+BEGIN
+    -- a row moved to another partition is deleted from the old one too
+    IF EXISTS (SELECT 1 FROM item WHERE item_id = OLD.item_id) THEN
+        RETURN NULL;
+    END IF;
+    DELETE FROM item WHERE parent_id = OLD.item_id;
+    RETURN NULL;
+END;
+$function$
+;"""
+    )
+    op.execute(
+        """CREATE OR REPLACE FUNCTION public._cascade_item_update()
+ RETURNS trigger
+ LANGUAGE plpgsql
+AS $function$
+BEGIN
+    UPDATE item SET parent_id = NEW.item_id WHERE parent_id = OLD.item_id;
+    RETURN NULL;
+END;
+$function$
+;"""
+    )
+    for partition in PARTITION_NAMES:
+        op.execute(
+            f"""CREATE TRIGGER check_item_parent BEFORE INSERT OR UPDATE ON {partition}
+FOR EACH ROW EXECUTE PROCEDURE _check_item_parent();"""
+        )
+        op.execute(
+            f"""CREATE TRIGGER update_item_path BEFORE INSERT OR UPDATE ON {partition}
+FOR EACH ROW EXECUTE PROCEDURE _update_item_path();"""
+        )
+        op.execute(
+            f"""CREATE TRIGGER cascade_item_delete AFTER DELETE ON {partition}
+FOR EACH ROW EXECUTE PROCEDURE _cascade_item_delete();"""
+        )
+        op.execute(
+            f"""CREATE TRIGGER cascade_item_update AFTER UPDATE OF item_id ON {partition}
+FOR EACH ROW WHEN (NEW.item_id <> OLD.item_id)
+EXECUTE PROCEDURE _cascade_item_update();"""
+        )
+        op.execute(f"ANALYZE {partition}")
+
+
+def downgrade() -> None:
+    # back to the state after b2e8f4c1d6a9 with the backfill completed
+    for partition in PARTITION_NAMES:
+        for trigger in (
+            "check_item_parent",
+            "update_item_path",
+            "cascade_item_delete",
+            "cascade_item_update",
+        ):
+            op.execute(f"DROP TRIGGER {trigger} ON {partition};")
+    op.execute("DROP FUNCTION _check_item_parent;")
+    op.execute("DROP FUNCTION _cascade_item_delete;")
+    op.execute("DROP FUNCTION _cascade_item_update;")
+    op.execute("ALTER TABLE item RENAME TO item_p")
+    for order in ORDER_KEYS:
+        op.execute(f"ALTER INDEX ix_item_order_{order} RENAME TO ix_item_order_{order}_p")
+
+    op.execute("CREATE TABLE item (LIKE item_p INCLUDING DEFAULTS)")
+    op.execute(f"INSERT INTO item ({COLUMNS}) SELECT {COLUMNS} FROM item_p")
+    op.execute("ALTER TABLE item ADD CONSTRAINT item_pkey PRIMARY KEY (item_id)")
+    op.execute(
+        "ALTER TABLE item ADD CONSTRAINT item_parent_id_fkey FOREIGN KEY (parent_id) "
+        "REFERENCES item (item_id) ON UPDATE CASCADE ON DELETE CASCADE"
+    )
+    op.execute("CREATE UNIQUE INDEX uix_item_id_name ON item (item_id, name)")
+    op.execute(
+        "CREATE UNIQUE INDEX uix_folder_name_parent_id_1 "
+        f"ON item (name, coalesce(parent_id, '{ZERO_UUID}'))"
+    )
+    for order, key in ORDER_KEYS.items():
+        op.execute(
+            f"CREATE INDEX ix_item_order_{order} "
+            f"ON item (parent_id, (type <> 'd'), {key}, item_id)"
+        )
+    op.execute(
+        """CREATE TRIGGER update_item_path BEFORE INSERT OR UPDATE ON item
+FOR EACH ROW EXECUTE PROCEDURE _update_item_path();"""
+    )
+
+    op.create_table(
+        "item_p_backfill",
+        sa.Column("last_item_id", sa.UUID(), nullable=True),
+        sa.Column("completed_at", sa.DateTime(timezone=True), nullable=True),
+    )
+    op.execute("INSERT INTO item_p_backfill VALUES (NULL, now())")
+    op.execute(
+        f"""CREATE OR REPLACE FUNCTION public._sync_item_p()
+ RETURNS trigger
+ LANGUAGE plpgsql
+AS $function$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        DELETE FROM item_p WHERE item_id = OLD.item_id;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO item_p ({COLUMNS}) VALUES (
+            NEW.item_id, NEW.name, NEW.parent_id, NEW.type, NEW.path,
+            NEW.size, NEW.content_type, NEW.checksum, NEW.modified_at
+        );
+    END IF;
+    RETURN NULL;
+END;
+$function$
+;"""
+    )
+    op.execute(
+        """CREATE TRIGGER sync_item_p AFTER INSERT OR UPDATE OR DELETE ON item
+FOR EACH ROW EXECUTE PROCEDURE _sync_item_p();"""
+    )
@@ -0,0 +1,73 @@
+"""add item_id registry
+
+Revision ID: d5f7a9c1e3b4
+Revises: a3c5e7f9b1d2
+Create Date: 2026-10-19 21:40:12.305816
+
+item_id is only unique within a partition, and _cascade_item_delete skips
+the cascade while another row with the deleted item_id exists. Every item_id
+is now also a row of item_id_registry, kept by triggers on every partition,
+so its primary key rejects a duplicate in any partition. A row moved to
+another partition is deleted and inserted, which runs the DELETE trigger
+before the INSERT one.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "d5f7a9c1e3b4"
+down_revision = "a3c5e7f9b1d2"
+branch_labels = None
+depends_on = None
+
+PARTITIONS = 16
+PARTITION_NAMES = [f"item_part_{remainder:02}" for remainder in range(PARTITIONS)]
+
+
+def upgrade() -> None:
+    op.create_table(
+        "item_id_registry",
+        sa.Column("item_id", sa.UUID(), nullable=False),
+        sa.PrimaryKeyConstraint("item_id"),
+    )
+    # fails on ids that are already duplicated
+    op.execute("LOCK TABLE item IN SHARE MODE")
+    op.execute("INSERT INTO item_id_registry SELECT item_id FROM item")
+
+    op.execute(
+        """CREATE OR REPLACE FUNCTION public._register_item_id()
+ RETURNS trigger
+ LANGUAGE plpgsql
+AS $function$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        DELETE FROM item_id_registry WHERE item_id = OLD.item_id;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO item_id_registry VALUES (NEW.item_id);
+    END IF;
+    RETURN NULL;
+END;
+$function$
+;"""
+    )
+    for partition in PARTITION_NAMES:
+        op.execute(
+            f"""CREATE TRIGGER register_item_id AFTER INSERT OR DELETE ON {partition}
+FOR EACH ROW EXECUTE PROCEDURE _register_item_id();"""
+        )
+        op.execute(
+            f"""CREATE TRIGGER reregister_item_id AFTER UPDATE OF item_id ON {partition}
+FOR EACH ROW WHEN (NEW.item_id <> OLD.item_id)
+EXECUTE PROCEDURE _register_item_id();"""
+        )
+
+
+def downgrade() -> None:
+    for partition in PARTITION_NAMES:
+        op.execute(f"DROP TRIGGER register_item_id ON {partition};")
+        op.execute(f"DROP TRIGGER reregister_item_id ON {partition};")
+    op.execute("DROP FUNCTION _register_item_id;")
+    op.drop_table("item_id_registry")
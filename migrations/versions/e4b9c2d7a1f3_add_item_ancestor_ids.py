@@ -0,0 +1,203 @@
+"""add item ancestor_ids
+
+Revision ID: e4b9c2d7a1f3
+Revises: c7d1a5e3f8b0
+Create Date: 2026-10-19 18:05:31.642097
+
+Stores the ids from the root down to the parent on every row. The path
+trigger now derives both path and ancestor_ids from the parent row instead
+of walking the tree from the roots, and only fires when parent_id or name
+change; descendants are rewritten by the repository in one statement.
+Existing rows are backfilled and the GIN index is built without holding a
+lock on item for the duration.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = "e4b9c2d7a1f3"
+down_revision = "c7d1a5e3f8b0"
+branch_labels = None
+depends_on = None
+
+PARTITIONS = 16
+PARTITION_NAMES = [f"item_part_{remainder:02}" for remainder in range(PARTITIONS)]
+INDEX = "ix_item_ancestor_ids"
+INDEX_DEFINITION = "USING gin (ancestor_ids)"
+# rows whose ancestor_ids disagree with their parent's; updating ancestor_ids
+# alone does not fire the path trigger
+BACKFILL_QUERY = """UPDATE {partition} c SET ancestor_ids = p.ancestor_ids || p.item_id
+FROM item p
+WHERE c.parent_id = p.item_id AND c.ancestor_ids <> p.ancestor_ids || p.item_id"""
+
+
+def upgrade() -> None:
+    op.add_column(
+        "item",
+        sa.Column(
+            "ancestor_ids",
+            postgresql.ARRAY(sa.UUID()),
+            nullable=False,
+            server_default="{}",
+        ),
+    )
+    op.execute(
+        """CREATE OR REPLACE FUNCTION public._update_item_path()
+ RETURNS trigger
+ LANGUAGE plpgsql
+AS $function$
+DECLARE
+    parent_path VARCHAR;
+    parent_ancestor_ids uuid[];
+BEGIN
+    IF NEW.parent_id IS NULL THEN
+        NEW.path = NEW.name;
+        NEW.ancestor_ids = '{}';
+    ELSE
+        SELECT path, ancestor_ids INTO parent_path, parent_ancestor_ids
+        FROM item WHERE item_id = NEW.parent_id;
+        NEW.path = parent_path || '/' || NEW.name;
+        NEW.ancestor_ids = parent_ancestor_ids || NEW.parent_id;
+    END IF;
+    RETURN NEW;
+END;
+$function$
+;"""
+    )
+    for partition in PARTITION_NAMES:
+        op.execute(f"DROP TRIGGER update_item_path ON {partition};")
+        op.execute(
+            f"""CREATE TRIGGER update_item_path BEFORE INSERT OR UPDATE OF parent_id, name
+ON {partition} FOR EACH ROW EXECUTE PROCEDURE _update_item_path();"""
+        )
+
+    # The backfill and the index run outside the migration transaction, so
+    # writes to item are never blocked for long. The trigger above keeps new
+    # and moved rows right; the backfill fixes the rest with one statement
+    # per partition. Every pass settles at least one more level of the tree,
+    # and it stops when a pass changes nothing.
+    with op.get_context().autocommit_block():
+        connection = op.get_bind()
+        changed = True
+        while changed:
+            changed = False
+            for partition in PARTITION_NAMES:
+                result = connection.execute(
+                    sa.text(BACKFILL_QUERY.format(partition=partition))
+                )
+                changed = changed or result.rowcount > 0
+
+        # a partitioned index cannot be built concurrently; it is created
+        # invalid on the parent and becomes valid once every partition's
+        # index, built concurrently, is attached
+        op.execute(f"CREATE INDEX {INDEX} ON ONLY item {INDEX_DEFINITION}")
+        for partition in PARTITION_NAMES:
+            op.execute(
+                f"CREATE INDEX CONCURRENTLY {INDEX}_{partition} "
+                f"ON {partition} {INDEX_DEFINITION}"
+            )
+            op.execute(f"ALTER INDEX {INDEX} ATTACH PARTITION {INDEX}_{partition}")
+
+    # the cascades rely on ancestor_ids, so they switch over only once every
+    # row has them. The descendants of a deleted row go in one statement;
+    # their own triggers then find nothing left to delete
+    op.execute(
+        """CREATE OR REPLACE FUNCTION public._cascade_item_delete()
+ RETURNS trigger
+ LANGUAGE plpgsql
+AS $function$
+BEGIN
+    -- a row moved to another partition is deleted from the old one too
+    IF EXISTS (SELECT 1 FROM item WHERE item_id = OLD.item_id) THEN
+        RETURN NULL;
+    END IF;
+    DELETE FROM item WHERE ancestor_ids @> ARRAY[OLD.item_id];
+    RETURN NULL;
+END;
+$function$
+;"""
+    )
+    op.execute(
+        """CREATE OR REPLACE FUNCTION public._cascade_item_update()
+ RETURNS trigger
+ LANGUAGE plpgsql
+AS $function$
+BEGIN
+    UPDATE item SET parent_id = NEW.item_id WHERE parent_id = OLD.item_id;
+    UPDATE item SET ancestor_ids = array_replace(ancestor_ids, OLD.item_id, NEW.item_id)
+    WHERE ancestor_ids @> ARRAY[OLD.item_id];
+    RETURN NULL;
+END;
+$function$
+;"""
+    )
+
+
+def downgrade() -> None:
+    op.drop_index(INDEX, table_name="item")
+    op.execute(
+        """CREATE OR REPLACE FUNCTION public._cascade_item_update()
+ RETURNS trigger
+ LANGUAGE plpgsql
+AS $function$
+BEGIN
+    UPDATE item SET parent_id = NEW.item_id WHERE parent_id = OLD.item_id;
+    RETURN NULL;
+END;
+$function$
+;"""
+    )
+    op.execute(
+        """CREATE OR REPLACE FUNCTION public._cascade_item_delete()
+ RETURNS trigger
+ LANGUAGE plpgsql
+AS $function$
+BEGIN
+    -- a row moved to another partition is deleted from the old one too
+    IF EXISTS (SELECT 1 FROM item WHERE item_id = OLD.item_id) THEN
+        RETURN NULL;
+    END IF;
+    DELETE FROM item WHERE parent_id = OLD.item_id;
+    RETURN NULL;
+END;
+$function$
+;"""
+    )
+    op.execute(
+        """CREATE OR REPLACE FUNCTION public._update_item_path()
+ RETURNS trigger
+ LANGUAGE plpgsql
+AS $function$
+DECLARE pth VARCHAR;
+BEGIN
+    WITH RECURSIVE items_cte(item_id, name, type, parent_id, path) AS (
+        SELECT i.item_id, i."name", i.type, i.parent_id, array[i."name"] AS path
+        FROM item i
+        WHERE i.parent_id IS NULL
+        UNION ALL
+        SELECT c.item_id, c."name", c.type, c.parent_id, array_append(p.path, c.name)
+        FROM items_cte p
+        JOIN item c ON c.parent_id = p.item_id
+    )
+    SELECT array_to_string(path || array[NEW.name], '/')
+    FROM items_cte
+    INTO pth
+    WHERE items_cte.item_id = NEW.parent_id;
+
+    IF pth IS NULL THEN NEW.path = NEW.name; ELSE NEW.path = pth; END IF;
+
+    RETURN NEW;
+END;
+$function$
+;"""
+    )
+    for partition in PARTITION_NAMES:
+        op.execute(f"DROP TRIGGER update_item_path ON {partition};")
+        op.execute(
+            f"""CREATE TRIGGER update_item_path BEFORE INSERT OR UPDATE ON {partition}
+FOR EACH ROW EXECUTE PROCEDURE _update_item_path();"""
+        )
+    op.drop_column("item", "ancestor_ids")
@@ -0,0 +1,43 @@
+"""add item object_key
+
+Revision ID: f1a6d8b3c2e5
+Revises: e4b9c2d7a1f3
+Create Date: 2026-10-19 18:47:55.208316
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "f1a6d8b3c2e5"
+down_revision = "e4b9c2d7a1f3"
+branch_labels = None
+depends_on = None
+
+PARTITIONS = 16
+PARTITION_NAMES = [f"item_part_{remainder:02}" for remainder in range(PARTITIONS)]
+INDEX = "ix_item_object_key"
+INDEX_DEFINITION = "(coalesce(object_key, item_id)) WHERE type = '-'"
+
+
+def upgrade() -> None:
+    # NULL means the object is stored under item_id, so no rows are rewritten
+    op.add_column("item", sa.Column("object_key", sa.UUID(), nullable=True))
+
+    # a partitioned index cannot be built concurrently; it is created invalid
+    # on the parent and becomes valid once every partition's index, built
+    # concurrently, is attached
+    op.execute(f"CREATE INDEX {INDEX} ON ONLY item {INDEX_DEFINITION}")
+    with op.get_context().autocommit_block():
+        for partition in PARTITION_NAMES:
+            op.execute(
+                f"CREATE INDEX CONCURRENTLY {INDEX}_{partition} "
+                f"ON {partition} {INDEX_DEFINITION}"
+            )
+            op.execute(f"ALTER INDEX {INDEX} ATTACH PARTITION {INDEX}_{partition}")
+
+
+def downgrade() -> None:
+    op.drop_index(INDEX, table_name="item")
+    op.drop_column("item", "object_key")
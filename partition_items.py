@@ -0,0 +1,100 @@
+import argparse
+import asyncio
+import time
+from dataclasses import dataclass
+from uuid import UUID
+
+from sqlalchemy import text
+
+from app.db.core import engine
+
+ZERO_UUID = UUID(int=0)
+COLUMNS = "item_id, name, parent_id, type, path, size, content_type, checksum, modified_at"
+
+POSITION_QUERY = text("SELECT last_item_id, completed_at FROM item_p_backfill")
+# FOR SHARE keeps the batch from changing until it is copied; changes made
+# after the commit reach item_p through the sync trigger
+LOCK_BATCH_QUERY = text(
+    """SELECT item_id FROM item WHERE item_id > :after
+ORDER BY item_id LIMIT :limit FOR SHARE"""
+)
+# the sync trigger may have copied some of the rows already
+DELETE_BATCH_QUERY = text("DELETE FROM item_p WHERE item_id = ANY(:ids)")
+COPY_BATCH_QUERY = text(
+    f"INSERT INTO item_p ({COLUMNS}) SELECT {COLUMNS} FROM item WHERE item_id = ANY(:ids)"
+)
+ADVANCE_QUERY = text("UPDATE item_p_backfill SET last_item_id = :last")
+COMPLETE_QUERY = text("UPDATE item_p_backfill SET completed_at = now()")
+
+
+@dataclass
+class BackfillReport:
+    batches: int = 0
+    copied: int = 0
+
+
+async def backfill(
+    *, batch_size: int = 5000, pause: float = 0.0, restart: bool = False
+) -> BackfillReport:
+    # Copies `item` into the partitioned shadow table in item_id order, one
+    # short transaction per batch, while the service keeps writing. The
+    # position is stored with every batch, an interrupted run resumes there.
+    report = BackfillReport()
+    async with engine.connect() as conn:
+        async with conn.begin():
+            if restart:
+                await conn.execute(
+                    text("UPDATE item_p_backfill SET last_item_id = NULL, completed_at = NULL")
+                )
+            after, completed_at = (await conn.execute(POSITION_QUERY)).one()
+        if completed_at is not None:
+            print(f"already completed at {completed_at.isoformat()}")
+            return report
+
+        while True:
+            started = time.perf_counter()
+            async with conn.begin():
+                result = await conn.execute(
+                    LOCK_BATCH_QUERY, {"after": after or ZERO_UUID, "limit": batch_size}
+                )
+                ids = result.scalars().all()
+                if not ids:
+                    await conn.execute(COMPLETE_QUERY)
+                    break
+                await conn.execute(DELETE_BATCH_QUERY, {"ids": ids})
+                await conn.execute(COPY_BATCH_QUERY, {"ids": ids})
+                after = ids[-1]
+                await conn.execute(ADVANCE_QUERY, {"last": after})
+            report.batches += 1
+            report.copied += len(ids)
+            print(
+                f"batch={report.batches} copied={report.copied} last={after} "
+                f"took={time.perf_counter() - started:.2f}s"
+            )
+            if pause:
+                await asyncio.sleep(pause)
+    return report
+
+
+async def run(batch_size: int, pause: float, restart: bool):
+    report = await backfill(batch_size=batch_size, pause=pause, restart=restart)
+    print(f"batches={report.batches} copied={report.copied}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="PartitionItems",
+        description=(
+            "Copy item rows into the partitioned item_p table in batches. "
+            "Run after `alembic upgrade b2e8f4c1d6a9`, then `alembic upgrade head` swaps the tables."
+        ),
+    )
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument(
+        "--pause", type=float, default=0.0, help="seconds to sleep between batches"
+    )
+    parser.add_argument(
+        "--restart", action="store_true", help="start over instead of resuming"
+    )
+    args = parser.parse_args()
+    asyncio.run(run(args.batch_size, args.pause, args.restart))
@@ -0,0 +1,123 @@
+import argparse
+import asyncio
+from dataclasses import dataclass
+
+from botocore.exceptions import ClientError
+
+from app.db.repositories.storage import StorageRepository
+from app.db.core import session_factory
+from app.s3.connector import S3Connector
+from app.s3.sharding import COPY_CHUNK_SIZE, ShardedS3Connector, is_missing_key
+
+from app.settings import get_settings
+
+
+@dataclass
+class RebalanceReport:
+    files: int = 0
+    moved: int = 0
+    missing: int = 0
+
+
+async def _move(
+    report: RebalanceReport,
+    connector: ShardedS3Connector,
+    key: str,
+    source: str,
+    target: str,
+    dry_run: bool,
+) -> None:
+    print("move", key, source, "->", target)
+    if dry_run:
+        report.moved += 1
+        return
+    source_connector = await connector.shard(source)
+    try:
+        response = await source_connector.download_object(key)
+    except ClientError as ex:
+        if not is_missing_key(ex):
+            raise
+        # already moved by an earlier run, or never uploaded
+        report.missing += 1
+        return
+    chunks = response["Body"].iter_chunks(COPY_CHUNK_SIZE)
+    await (await connector.shard(target)).upload_stream(key, chunks)
+    await source_connector.remove_items([key])
+    report.moved += 1
+
+
+async def rebalance(
+    repo: StorageRepository,
+    connector: ShardedS3Connector,
+    *,
+    concurrency: int = 8,
+    dry_run: bool = False,
+) -> RebalanceReport:
+    # Walks file rows in batches and moves every object whose shard differs
+    # between the previous and the current ring. The service keeps serving
+    # during the run: reads fall back to the previous shard until the object
+    # has been moved, deletes are sent to both.
+    report = RebalanceReport()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def move(key: str, source: str, target: str) -> None:
+        async with semaphore:
+            await _move(report, connector, key, source, target, dry_run)
+
+    async for batch in repo.iter_file_rows():
+        moves = []
+        for object_key, _ in batch:
+            key = str(object_key)
+            report.files += 1
+            source = connector.previous_ring.shard_for(key)
+            target = connector.ring.shard_for(key)
+            if source != target:
+                moves.append(move(key, source, target))
+        await asyncio.gather(*moves)
+    return report
+
+
+async def run(previous: list[str], concurrency: int, dry_run: bool):
+    settings = get_settings()
+    shards = {
+        shard.name: S3Connector(
+            shard.bucket_name,
+            shard.access_key,
+            shard.secret_key,
+            shard.endpoint,
+            multipart_chunk_size=settings.S3_MULTIPART_CHUNK_SIZE,
+            multipart_concurrency=settings.S3_MULTIPART_CONCURRENCY,
+        )
+        for shard in settings.S3_SHARDS
+    }
+    unknown = set(previous) - set(shards)
+    if unknown:
+        raise SystemExit(f"Unknown shards: {', '.join(sorted(unknown))}")
+
+    async with session_factory() as session:
+        repo = StorageRepository(session)
+        async with ShardedS3Connector(shards, previous) as connector:
+            report = await rebalance(
+                repo, connector, concurrency=concurrency, dry_run=dry_run
+            )
+    print(f"files={report.files} moved={report.moved} missing={report.missing}")
+
+
+if __name__ == "__main__":
+    settings = get_settings()
+    parser = argparse.ArgumentParser(
+        prog="RebalanceShards",
+        description="Move objects to the shard the current S3_SHARDS ring places them on",
+    )
+    parser.add_argument(
+        "--previous",
+        default=",".join(settings.S3_PREVIOUS_SHARDS),
+        help="comma separated shard names before the change, defaults to S3_PREVIOUS_SHARDS",
+    )
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+    previous = [name for name in args.previous.split(",") if name]
+    if not previous:
+        parser.error("--previous or S3_PREVIOUS_SHARDS is required")
+    asyncio.run(run(previous, args.concurrency, args.dry_run))
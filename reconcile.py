@@ -0,0 +1,157 @@
+import argparse
+import asyncio
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator
+
+from app.db.repositories.storage import StorageRepository
+from app.db.core import session_factory
+from app.main import make_s3_connector
+from app.s3.backend import StorageBackend
+
+DELETE_BATCH_SIZE = 1000  # DeleteObjects accepts at most 1000 keys
+
+
+@dataclass
+class ReconcileReport:
+    objects: int = 0
+    files: int = 0
+    orphans: int = 0
+    dangling: int = 0
+    deleted: int = 0
+    skipped_recent: int = 0
+    pending_delete: list[str] = field(default_factory=list)
+
+
+async def _iter_s3_objects(connector: StorageBackend) -> AsyncIterator[dict]:
+    async for page in connector.iter_objects():
+        for obj in page:
+            yield obj
+
+
+async def _iter_db_files(repo: StorageRepository) -> AsyncIterator[tuple[str, str]]:
+    async for batch in repo.iter_file_rows():
+        for object_key, path in batch:
+            yield str(object_key), path
+
+
+async def _next(iterator: AsyncIterator):
+    try:
+        return await iterator.__anext__()
+    except StopAsyncIteration:
+        return None
+
+
+class _RateLimiter:
+    def __init__(self, per_second: float) -> None:
+        self.interval = 1 / per_second if per_second > 0 else 0
+        self._last = 0.0
+
+    async def wait(self) -> None:
+        delay = self._last + self.interval - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        self._last = time.monotonic()
+
+
+async def _flush_deletes(
+    report: ReconcileReport, connector: StorageBackend, limiter: _RateLimiter
+) -> None:
+    if not report.pending_delete:
+        return
+    await limiter.wait()
+    await connector.remove_items(report.pending_delete, batch_count=DELETE_BATCH_SIZE)
+    report.deleted += len(report.pending_delete)
+    report.pending_delete = []
+
+
+async def reconcile(
+    repo: StorageRepository,
+    connector: StorageBackend,
+    *,
+    delete_orphans: bool = False,
+    min_age: timedelta = timedelta(hours=1),
+    batches_per_second: float = 1.0,
+) -> ReconcileReport:
+    # both sides arrive sorted by key, so a single merge pass finds every
+    # mismatch while holding at most one page of each side in memory
+    report = ReconcileReport()
+    limiter = _RateLimiter(batches_per_second)
+    # uploads write the object before their row commits; younger objects
+    # may belong to an upload that is still in flight
+    cutoff = datetime.now(timezone.utc) - min_age
+
+    objects = _iter_s3_objects(connector)
+    files = _iter_db_files(repo)
+    obj = await _next(objects)
+    file = await _next(files)
+
+    while obj is not None or file is not None:
+        if file is None or (obj is not None and obj["Key"] < file[0]):
+            report.objects += 1
+            report.orphans += 1
+            print("orphan", obj["Key"], obj["LastModified"].isoformat())
+            if delete_orphans:
+                if obj["LastModified"] > cutoff:
+                    report.skipped_recent += 1
+                else:
+                    report.pending_delete.append(obj["Key"])
+                    if len(report.pending_delete) >= DELETE_BATCH_SIZE:
+                        await _flush_deletes(report, connector, limiter)
+            obj = await _next(objects)
+        elif obj is None or file[0] < obj["Key"]:
+            report.files += 1
+            report.dangling += 1
+            print("dangling", file[0], file[1])
+            file = await _next(files)
+        else:
+            report.objects += 1
+            report.files += 1
+            obj = await _next(objects)
+            file = await _next(files)
+
+    if delete_orphans:
+        await _flush_deletes(report, connector, limiter)
+    return report
+
+
+async def run(delete_orphans: bool, min_age_seconds: float, batches_per_second: float):
+    async with session_factory() as session:
+        repo = StorageRepository(session)
+        # the same backend the app writes to, every shard of it included
+        async with make_s3_connector() as connector:
+            report = await reconcile(
+                repo,
+                connector,
+                delete_orphans=delete_orphans,
+                min_age=timedelta(seconds=min_age_seconds),
+                batches_per_second=batches_per_second,
+            )
+    print(
+        f"objects={report.objects} files={report.files} orphans={report.orphans} "
+        f"dangling={report.dangling} deleted={report.deleted} "
+        f"skipped_recent={report.skipped_recent}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="ReconcileS3",
+        description="Compare S3 objects with file rows, report orphan objects and dangling rows",
+    )
+    parser.add_argument("--delete-orphans", action="store_true")
+    parser.add_argument(
+        "--min-age",
+        type=float,
+        default=3600,
+        help="only delete orphans older than this many seconds",
+    )
+    parser.add_argument(
+        "--batches-per-second",
+        type=float,
+        default=1.0,
+        help="rate limit for 1000-key delete batches, 0 disables it",
+    )
+    args = parser.parse_args()
+    asyncio.run(run(args.delete_orphans, args.min_age, args.batches_per_second))
@@ -0,0 +1,262 @@
+import argparse
+import asyncio
+import gzip
+import re
+from uuid import UUID
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from app.db.core import engine
+from app.db.models.item import Item
+
+FORMATS = ("csv", "binary")  # csv snapshots are gzip compressed
+DERIVED_COLUMNS = {"path", "ancestor_ids"}  # recomputed on import
+READ_CHUNK_SIZE = 1024 * 1024
+
+LOAD_TABLE = "item_load"
+NEW_TABLE = "item_new"
+SUFFIX = "_new"
+
+SUBTREE_QUERY = """WITH RECURSIVE subtree AS (
+    SELECT * FROM item WHERE item_id = $1
+    UNION ALL
+    SELECT i.* FROM item i JOIN subtree s ON i.parent_id = s.item_id
+)
+SELECT {columns} FROM subtree"""
+
+BUILD_QUERY = """WITH RECURSIVE tree(item_id, path, ancestor_ids) AS (
+    SELECT item_id, name::varchar, '{{}}'::uuid[] FROM {load} WHERE parent_id IS NULL
+    UNION ALL
+    SELECT c.item_id, (t.path || '/' || c.name)::varchar, t.ancestor_ids || t.item_id
+    FROM {load} c JOIN tree t ON c.parent_id = t.item_id
+)
+INSERT INTO {new} ({columns}, path, ancestor_ids)
+SELECT {load_columns}, tree.path, tree.ancestor_ids FROM {load} l JOIN tree USING (item_id)"""
+
+CONSTRAINTS_QUERY = """SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint
+WHERE conrelid = 'item'::regclass AND contype IN ('p', 'u', 'c', 'x', 'f')
+ORDER BY contype = 'f'"""
+
+INDEXES_QUERY = """SELECT c.relname, pg_get_indexdef(i.indexrelid)
+FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+WHERE i.indrelid = 'item'::regclass
+AND NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conindid = i.indexrelid)"""
+
+TRIGGERS_QUERY = """SELECT pg_get_triggerdef(oid) FROM pg_trigger
+WHERE tgrelid = 'item'::regclass AND NOT tgisinternal"""
+
+PARTITIONED_QUERY = "SELECT relkind = 'p' FROM pg_class WHERE oid = 'item'::regclass"
+PARTITIONS_QUERY = """SELECT inhrelid::regclass::text FROM pg_inherits
+WHERE inhparent = 'item'::regclass"""
+
+REGISTRY_QUERY = "SELECT to_regclass('item_id_registry') IS NOT NULL"
+DUPLICATE_IDS_QUERY = f"""SELECT item_id FROM {LOAD_TABLE}
+GROUP BY item_id HAVING count(*) > 1 LIMIT 10"""
+
+FOREIGN_REFERENCES_QUERY = """SELECT conrelid::regclass::text FROM pg_constraint
+WHERE confrelid = 'item'::regclass AND conrelid <> 'item'::regclass"""
+
+
+def _snapshot_columns() -> list[str]:
+    return [
+        column.name
+        for column in Item.__table__.columns
+        if column.name not in DERIVED_COLUMNS
+    ]
+
+
+def _quoted(columns: list[str], alias: str | None = None) -> str:
+    prefix = f"{alias}." if alias else ""
+    return ", ".join(f'{prefix}"{column}"' for column in columns)
+
+
+def _on_table(definition: str, table: str) -> str:
+    return re.sub(r" ON (\w+\.)?item ", rf" ON \g<1>{table} ", definition, count=1)
+
+
+async def _driver_connection(conn: AsyncConnection):
+    raw = await conn.get_raw_connection()
+    return raw.driver_connection
+
+
+async def export_snapshot(path: str, format_: str = "csv", root_id: UUID | None = None) -> str:
+    columns = _snapshot_columns()
+    if root_id is None:
+        query, args = f"SELECT {_quoted(columns)} FROM item", ()
+    else:
+        # the subtree root is exported as a root of the snapshot
+        selected = [
+            "CASE WHEN item_id = $1 THEN NULL ELSE parent_id END AS parent_id"
+            if column == "parent_id"
+            else f'"{column}"'
+            for column in columns
+        ]
+        query, args = SUBTREE_QUERY.format(columns=", ".join(selected)), (root_id,)
+
+    async with engine.connect() as conn:
+        pg = await _driver_connection(conn)
+        if format_ == "binary":
+            return await pg.copy_from_query(query, *args, output=path, format="binary")
+
+        with gzip.open(path, "wb") as file:
+
+            async def write(chunk: bytes) -> None:
+                file.write(chunk)
+
+            return await pg.copy_from_query(
+                query, *args, output=write, format="csv", header=True
+            )
+
+
+def _read_csv_columns(path: str) -> list[str]:
+    with gzip.open(path, "rt") as file:
+        return file.readline().strip().split(",")
+
+
+async def _iter_gzip(path: str):
+    with gzip.open(path, "rb") as file:
+        while chunk := file.read(READ_CHUNK_SIZE):
+            yield chunk
+
+
+async def _replay_schema(conn: AsyncConnection) -> list[tuple[str, str]]:
+    # recreates constraints, indexes and triggers of `item` on the new table
+    # after it has been filled; index-backed names get a suffix until the swap
+    renames = []
+    for name, definition in (await conn.execute(text(CONSTRAINTS_QUERY))).all():
+        definition = re.sub(r"REFERENCES (\w+\.)?item\(", rf"REFERENCES {NEW_TABLE}(", definition)
+        await conn.execute(
+            text(f'ALTER TABLE {NEW_TABLE} ADD CONSTRAINT "{name}{SUFFIX}" {definition}')
+        )
+        renames.append((f'ALTER TABLE item RENAME CONSTRAINT "{name}{SUFFIX}"', name))
+
+    for name, definition in (await conn.execute(text(INDEXES_QUERY))).all():
+        definition = _on_table(definition.replace(name, name + SUFFIX, 1), NEW_TABLE)
+        await conn.execute(text(definition))
+        renames.append((f'ALTER INDEX "{name}{SUFFIX}"', name))
+
+    for (definition,) in (await conn.execute(text(TRIGGERS_QUERY))).all():
+        await conn.execute(text(_on_table(definition, NEW_TABLE)))
+    return renames
+
+
+async def _rebuild_partitioned(conn: AsyncConnection, columns: list[str]) -> int:
+    # a partitioned item keeps its partitions, indexes and triggers: it is
+    # emptied and refilled with the per-partition triggers switched off, so
+    # neither paths nor parents are checked row by row. Readers wait for the
+    # commit instead of seeing the old tree meanwhile.
+    partitions = (await conn.execute(text(PARTITIONS_QUERY))).scalars().all()
+    for partition in partitions:
+        await conn.execute(text(f"ALTER TABLE {partition} DISABLE TRIGGER USER"))
+    await conn.execute(text("TRUNCATE item"))
+    result = await conn.execute(
+        text(
+            BUILD_QUERY.format(
+                load=LOAD_TABLE,
+                new="item",
+                columns=_quoted(columns),
+                load_columns=_quoted(columns, "l"),
+            )
+        )
+    )
+    for partition in partitions:
+        await conn.execute(text(f"ALTER TABLE {partition} ENABLE TRIGGER USER"))
+    # filled by triggers that were off during the load
+    if await conn.scalar(text(REGISTRY_QUERY)):
+        await conn.execute(text("TRUNCATE item_id_registry"))
+        await conn.execute(text("INSERT INTO item_id_registry SELECT item_id FROM item"))
+    await conn.execute(text("ANALYZE item"))
+    return result.rowcount
+
+
+async def import_snapshot(path: str, format_: str = "csv") -> tuple[int, int]:
+    # Loads into a temporary table with COPY, builds the new table with paths
+    # computed in one recursive query, and swaps it in. The path trigger is
+    # only created once the rows are in, so it never fires during the load.
+    # Everything runs in one transaction: readers keep seeing the old tree
+    # until the swap commits, and a failed import leaves it untouched.
+    columns = _read_csv_columns(path) if format_ == "csv" else _snapshot_columns()
+
+    async with engine.begin() as conn:
+        referencing = (await conn.execute(text(FOREIGN_REFERENCES_QUERY))).scalars().all()
+        if referencing:
+            raise RuntimeError(f"Tables reference item: {', '.join(referencing)}")
+        partitioned = await conn.scalar(text(PARTITIONED_QUERY))
+
+        await conn.execute(
+            text(
+                f"CREATE TEMP TABLE {LOAD_TABLE} (LIKE item INCLUDING DEFAULTS) ON COMMIT DROP"
+            )
+        )
+        pg = await _driver_connection(conn)
+        if format_ == "binary":
+            status = await pg.copy_to_table(
+                LOAD_TABLE, source=path, columns=columns, format="binary"
+            )
+        else:
+            status = await pg.copy_to_table(
+                LOAD_TABLE,
+                source=_iter_gzip(path),
+                columns=columns,
+                format="csv",
+                header=True,
+            )
+        loaded = int(status.split()[-1])
+
+        # the partitioned table has no primary key to catch these
+        duplicates = (await conn.execute(text(DUPLICATE_IDS_QUERY))).scalars().all()
+        if duplicates:
+            raise RuntimeError(
+                f"Duplicate item_id in snapshot: {', '.join(map(str, duplicates))}"
+            )
+
+        await conn.execute(text(f"CREATE INDEX ON {LOAD_TABLE} (parent_id)"))
+        await conn.execute(text(f"ANALYZE {LOAD_TABLE}"))
+        if partitioned:
+            return loaded, await _rebuild_partitioned(conn, columns)
+
+        await conn.execute(text(f"CREATE TABLE {NEW_TABLE} (LIKE item INCLUDING DEFAULTS)"))
+        result = await conn.execute(
+            text(
+                BUILD_QUERY.format(
+                    load=LOAD_TABLE,
+                    new=NEW_TABLE,
+                    columns=_quoted(columns),
+                    load_columns=_quoted(columns, "l"),
+                )
+            )
+        )
+        imported = result.rowcount
+
+        renames = await _replay_schema(conn)
+        await conn.execute(text(f"ANALYZE {NEW_TABLE}"))
+
+        await conn.execute(text("DROP TABLE item"))
+        await conn.execute(text(f"ALTER TABLE {NEW_TABLE} RENAME TO item"))
+        for statement, name in renames:
+            await conn.execute(text(f'{statement} TO "{name}"'))
+
+    return loaded, imported
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="ItemSnapshot",
+        description="Export the item tree with COPY, or restore it from a snapshot",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    export_parser = commands.add_parser("export")
+    export_parser.add_argument("path")
+    export_parser.add_argument("--format", choices=FORMATS, default="csv")
+    export_parser.add_argument("--root", type=UUID, help="export only this subtree")
+    import_parser = commands.add_parser("import", help="replace the item table")
+    import_parser.add_argument("path")
+    import_parser.add_argument("--format", choices=FORMATS, default="csv")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        print(asyncio.run(export_snapshot(args.path, args.format, args.root)))
+    else:
+        loaded, imported = asyncio.run(import_snapshot(args.path, args.format))
+        print(f"loaded={loaded} imported={imported} unreachable={loaded - imported}")
@@ -0,0 +1,56 @@
+import asyncio
+
+import pytest
+
+from app.s3.admission import AdmissionController, AdmittedBody, Lane, S3Overloaded
+
+pytestmark = pytest.mark.asyncio
+
+
+async def test_rejects_when_queue_is_full():
+    controller = AdmissionController({Lane.UPLOAD: (1, 1), Lane.DOWNLOAD: (1, 1)})
+    lane = controller.lane(Lane.UPLOAD)
+    await lane.acquire()
+
+    queued = asyncio.create_task(lane.acquire())
+    await asyncio.sleep(0)
+    assert lane.waiting == 1
+
+    with pytest.raises(S3Overloaded) as error:
+        await lane.acquire()
+    assert error.value.lane == Lane.UPLOAD
+
+    # other lanes are unaffected by a saturated one
+    async with controller.lane(Lane.DOWNLOAD).admit():
+        pass
+
+    lane.release()
+    await queued
+    assert lane.active == 1
+    lane.release()
+
+
+class FakeBody:
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    async def iter_chunks(self, chunk_size):
+        for chunk in self.chunks:
+            yield chunk
+
+    async def read(self, amt=None):
+        return b"".join(self.chunks)
+
+
+async def test_admitted_body_releases_slot():
+    lane = AdmissionController({Lane.DOWNLOAD: (1, 0)}).lane(Lane.DOWNLOAD)
+
+    await lane.acquire()
+    body = AdmittedBody(FakeBody([b"a", b"b"]), lane)
+    assert [chunk async for chunk in body] == [b"a", b"b"]
+    assert lane.active == 0
+
+    await lane.acquire()
+    body = AdmittedBody(FakeBody([b"a", b"b"]), lane)
+    assert await body.read() == b"ab"
+    assert lane.active == 0
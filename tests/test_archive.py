@@ -0,0 +1,94 @@
+import io
+import tarfile
+import zipfile
+
+import pytest
+
+from app.services.archive import ArchiveError, iter_archive_members
+
+pytestmark = pytest.mark.asyncio
+
+FILES = {
+    "docs/readme.txt": b"hello",
+    "docs/nested/big.bin": bytes(range(256)) * 1000,
+    "top.txt": b"",
+    "very/" + "long" * 40 + "/name.txt": b"long path",
+}
+
+
+async def _chunks(raw: bytes, size: int = 1000):
+    for i in range(0, len(raw), size):
+        yield raw[i : i + size]
+
+
+async def _read_members(raw: bytes) -> dict[str, bytes | None]:
+    result = {}
+    async for member in iter_archive_members(_chunks(raw)):
+        if member.is_dir:
+            result[member.path.rstrip("/")] = None
+        else:
+            result[member.path] = b"".join([chunk async for chunk in member.chunks])
+    return result
+
+
+def _make_tar(mode: str, fmt=tarfile.GNU_FORMAT) -> bytes:
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode=mode, format=fmt) as archive:
+        info = tarfile.TarInfo("docs")
+        info.type = tarfile.DIRTYPE
+        archive.addfile(info)
+        for name, content in FILES.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            archive.addfile(info, io.BytesIO(content))
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize("mode", ["w", "w:gz", "w:bz2", "w:xz"])
+async def test_tar_members(mode: str):
+    members = await _read_members(_make_tar(mode))
+    assert members.pop("docs") is None
+    assert members == FILES
+
+
+async def test_pax_tar_members():
+    members = await _read_members(_make_tar("w", tarfile.PAX_FORMAT))
+    members.pop("docs")
+    assert members == FILES
+
+
+@pytest.mark.parametrize("compression", [zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED])
+async def test_zip_members(compression: int):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", compression) as archive:
+        archive.writestr("docs/", b"")
+        for name, content in FILES.items():
+            archive.writestr(name, content)
+    members = await _read_members(buffer.getvalue())
+    assert members.pop("docs") is None
+    assert members == FILES
+
+
+async def test_zip_members_with_data_descriptor():
+    class Unseekable(io.RawIOBase):
+        def __init__(self):
+            self.data = bytearray()
+
+        def writable(self):
+            return True
+
+        def write(self, b):
+            self.data.extend(b)
+            return len(b)
+
+    out = Unseekable()
+    with zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, content in FILES.items():
+            with archive.open(name, "w") as member:
+                member.write(content)
+    assert await _read_members(bytes(out.data)) == FILES
+
+
+async def test_truncated_archive():
+    with pytest.raises(ArchiveError):
+        await _read_members(_make_tar("w")[:1500])
@@ -0,0 +1,119 @@
+import asyncio
+from types import SimpleNamespace
+from uuid import uuid4
+
+import pytest
+
+from app.db.repositories.bindings import BindingsRepositoryMock
+from app.s3.admission import AdmissionLane, Lane, S3Overloaded
+from app.services.storage import FileStorageService
+
+pytestmark = pytest.mark.asyncio
+
+
+class FakePool:
+    # a single pooled connection, held from the first statement of a
+    # transaction until it ends
+    def __init__(self) -> None:
+        self.connection = asyncio.Lock()
+
+
+class FakeStorage:
+    def __init__(self, pool: FakePool) -> None:
+        self.pool = pool
+        self.in_transaction = False
+
+    async def _begin(self) -> None:
+        if not self.in_transaction:
+            await self.pool.connection.acquire()
+            self.in_transaction = True
+
+    async def rollback(self) -> None:
+        if self.in_transaction:
+            self.in_transaction = False
+            self.pool.connection.release()
+
+    async def get_item_id_by_path(self, path):
+        await self._begin()
+        return uuid4()
+
+    async def get_file_by_path(self, path):
+        await self._begin()
+        return SimpleNamespace(
+            object_key=uuid4(), size=10, content_type=None, checksum=None, modified_at=None
+        )
+
+    async def list_item_rows(self, *args, **kwargs):
+        await self._begin()
+        return []
+
+    async def list_items(self, *args, **kwargs):
+        await self._begin()
+        return 0
+
+
+class SaturatedConnector:
+    # every transfer waits for a slot of a lane that is already in use
+    def __init__(self) -> None:
+        self.lane = AdmissionLane(Lane.UPLOAD, 1, 10, retry_after=1)
+
+    def file_path(self, key):
+        return None
+
+    async def upload_stream(self, key, chunks):
+        async with self.lane.admit():
+            return len(b"".join([chunk async for chunk in chunks]))
+
+    async def download_file(self, key):
+        async with self.lane.admit():
+            return []
+
+
+@pytest.mark.parametrize("transfer", ["upload", "download"])
+async def test_waiting_transfer_does_not_block_listings(transfer):
+    # an upload body is not read before the upload is admitted either
+    read = []
+
+    async def _body():
+        read.append(True)
+        yield b"content"
+
+    pool = FakePool()
+    connector = SaturatedConnector()
+    await connector.lane.acquire()
+
+    service = FileStorageService(FakeStorage(pool), connector)
+    if transfer == "upload":
+        waiting = asyncio.create_task(service.upload_file(_body(), "docs/file.txt"))
+    else:
+        waiting = asyncio.create_task(service.get_file_by_path("docs/file.txt"))
+    await asyncio.sleep(0.01)
+    assert connector.lane.waiting == 1
+
+    listing = FileStorageService(
+        FakeStorage(pool), connector, binding_repo=BindingsRepositoryMock()
+    )
+    page = await asyncio.wait_for(listing.list_folder_page(), timeout=1)
+    assert page["total"] == 0
+    assert not read
+
+    waiting.cancel()
+    await asyncio.gather(waiting, return_exceptions=True)
+    connector.lane.release()
+
+
+async def test_full_upload_lane_rejects_before_reading_the_body():
+    read = []
+
+    async def body():
+        read.append(True)
+        yield b"content"
+
+    connector = SaturatedConnector()
+    connector.lane = AdmissionLane(Lane.UPLOAD, 1, 0, retry_after=1)
+    await connector.lane.acquire()
+    service = FileStorageService(FakeStorage(FakePool()), connector)
+    with pytest.raises(S3Overloaded):
+        await service.upload_file(body(), "docs/file.txt")
+    assert not read
+    connector.lane.release()
@@ -0,0 +1,76 @@
+import hashlib
+import os
+
+import pytest
+import pytest_asyncio
+
+from app.s3.local import LocalStorageBackend, ZeroCopyFileResponse
+from app.services.metadata import multipart_checksum
+
+pytestmark = pytest.mark.asyncio
+
+
+@pytest_asyncio.fixture(scope="function")
+async def backend(tmp_path):
+    async with LocalStorageBackend(str(tmp_path)) as backend:
+        yield backend
+
+
+async def _chunks(*chunks: bytes):
+    for chunk in chunks:
+        yield chunk
+
+
+async def test_objects_are_sharded_and_listed_in_order(backend: LocalStorageBackend):
+    keys = ["f3a1", "0b2c", "f3a0", "aa00"]
+    for key in keys:
+        await backend.upload_file(key, key.encode())
+    assert await backend.upload_stream("77aa", _chunks(b"ab", b"cd")) == 4
+    await backend.copy_object("aa00", "aa01")
+
+    assert backend.file_path("f3a1") == os.path.join(backend.root, "f3", "a1", "f3a1")
+    listed = [obj async for page in backend.iter_objects(page_size=2) for obj in page]
+    assert [obj["Key"] for obj in listed] == sorted(keys + ["77aa", "aa01"])
+    assert await (await backend.download_file("aa01")).read() == b"aa00"
+    assert await backend.download_range("77aa", 1, 2) == b"bc"
+
+    await backend.remove_items(["f3a1", "0b2c", "missing"])
+    listed = [obj async for page in backend.iter_objects() for obj in page]
+    assert [obj["Key"] for obj in listed] == ["77aa", "aa00", "aa01", "f3a0"]
+
+
+async def test_multipart_upload(backend: LocalStorageBackend):
+    upload_id = await backend.create_multipart_upload("abcd")
+    second = await backend.upload_part("abcd", upload_id, 2, b"world")
+    first = await backend.upload_part("abcd", upload_id, 1, b"hello ")
+    assert first == f'"{hashlib.md5(b"hello ").hexdigest()}"'
+
+    parts = await backend.list_parts("abcd", upload_id)
+    assert [(part["PartNumber"], part["ETag"]) for part in parts] == [(1, first), (2, second)]
+    assert multipart_checksum(parts).endswith("-2")
+
+    await backend.complete_multipart_upload("abcd", upload_id, parts)
+    body = (await backend.download_object("abcd"))["Body"]
+    assert b"".join([chunk async for chunk in body]) == b"hello world"
+    listed = [obj async for page in backend.iter_objects() for obj in page]
+    assert [obj["Key"] for obj in listed] == ["abcd"]
+
+
+async def test_zero_copy_response(tmp_path):
+    path = tmp_path / "object"
+    path.write_bytes(b"content")
+    messages = []
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {"type": "http", "method": "GET", "headers": []}
+    await ZeroCopyFileResponse(str(path))(scope, None, send)
+    assert b"".join(m.get("body", b"") for m in messages) == b"content"
+
+    messages.clear()
+    scope["extensions"] = {"http.response.zerocopy": {}}
+    await ZeroCopyFileResponse(str(path))(scope, None, send)
+    assert messages[1]["type"] == "http.response.zerocopy"
+    assert messages[1]["count"] == 7
+    assert messages[1]["file"].closed
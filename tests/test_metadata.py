@@ -0,0 +1,68 @@
+import hashlib
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from app.services.metadata import (
+    ObjectDigest,
+    file_headers,
+    guess_content_type,
+    is_not_modified,
+    multipart_checksum,
+)
+
+pytestmark = pytest.mark.asyncio
+
+FileRow = namedtuple("FileRow", ("size", "content_type", "checksum", "modified_at"))
+
+MODIFIED = datetime(2023, 7, 11, 21, 5, 39, 493575, tzinfo=timezone.utc)
+
+
+async def _chunks(*chunks):
+    for chunk in chunks:
+        yield chunk
+
+
+async def test_digest_while_streaming():
+    digest = ObjectDigest()
+    streamed = [chunk async for chunk in digest.wrap(_chunks(b"hello ", b"world"))]
+    assert streamed == [b"hello ", b"world"]
+    assert digest.size == 11
+    assert digest.checksum == hashlib.md5(b"hello world").hexdigest()
+    assert ObjectDigest(b"hello world").checksum == digest.checksum
+
+
+async def test_multipart_checksum_matches_s3_etag():
+    parts = [b"a" * 10, b"b" * 5]
+    expected = hashlib.md5(b"".join(hashlib.md5(part).digest() for part in parts))
+    etags = [{"ETag": f'"{hashlib.md5(part).hexdigest()}"'} for part in parts]
+    assert multipart_checksum(etags) == f"{expected.hexdigest()}-2"
+
+
+async def test_content_type():
+    assert guess_content_type("notes.txt") == "text/plain"
+    assert guess_content_type("notes.txt", "text/markdown") == "text/markdown"
+    assert guess_content_type("blob", "application/octet-stream") == "application/octet-stream"
+
+
+async def test_conditional_requests():
+    row = FileRow(11, "text/plain", "abc", MODIFIED)
+    headers = file_headers(row)
+    assert headers["ETag"] == '"abc"'
+    assert headers["Content-Length"] == "11"
+    assert headers["Last-Modified"] == "Tue, 11 Jul 2023 21:05:39 GMT"
+
+    assert is_not_modified(row, '"abc"', None)
+    assert is_not_modified(row, 'W/"xyz", "abc"', None)
+    assert is_not_modified(row, "*", None)
+    assert not is_not_modified(row, '"xyz"', headers["Last-Modified"])
+
+    assert is_not_modified(row, None, headers["Last-Modified"])
+    earlier = MODIFIED - timedelta(seconds=1)
+    assert not is_not_modified(row, None, earlier.strftime("%a, %d %b %Y %H:%M:%S GMT"))
+    assert not is_not_modified(row, None, "garbage")
+    assert not is_not_modified(FileRow(None, None, None, None), "*", None)
+    # "-0000" parses to a naive datetime, which is read as UTC
+    assert is_not_modified(row, None, "Tue, 11 Jul 2023 21:05:39 -0000")
+    assert not is_not_modified(row, None, "Tue, 11 Jul 2023 21:05:38 -0000")
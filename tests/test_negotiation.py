@@ -0,0 +1,105 @@
+import gzip
+from datetime import datetime, timezone
+from uuid import uuid4
+
+import brotli
+import msgpack
+import orjson
+
+from app.services import negotiation
+from app.services.negotiation import (
+    COLUMNAR_JSON,
+    JSON,
+    MSGPACK,
+    negotiate_encoding,
+    negotiate_media_type,
+    page_response,
+)
+
+SRC_PREFIX = "/fm2/a/"
+
+
+def _page(count: int) -> dict:
+    items = [
+        {
+            "title": f"file{i}.txt",
+            "id": uuid4(),
+            "type": "file",
+            "src": f"{SRC_PREFIX}docs/file{i}.txt",
+            "path": f"docs/file{i}.txt",
+            "bind_count": 0,
+            "size": i,
+            "content_type": "text/plain",
+            "checksum": None,
+            "modified_at": datetime(2023, 7, 1, tzinfo=timezone.utc),
+        }
+        for i in range(count)
+    ]
+    return {
+        "current_page": 1,
+        "items": items,
+        "path": [{"id": uuid4(), "path": "docs"}],
+        "all_page": 1,
+        "total": count,
+        "next_cursor": None,
+    }
+
+
+def test_media_type_preference():
+    assert negotiate_media_type(None) == JSON
+    assert negotiate_media_type("text/html") == JSON
+    assert negotiate_media_type(f"{JSON};q=0.5, {COLUMNAR_JSON}") == COLUMNAR_JSON
+    assert negotiate_media_type(f"{COLUMNAR_JSON};q=0.5, */*") == JSON
+    assert negotiate_media_type(f"{COLUMNAR_JSON};q=0, {JSON}") == JSON
+
+
+def test_encoding_preference(monkeypatch):
+    monkeypatch.setattr(negotiation, "brotli", None)
+    assert negotiate_encoding(None) is None
+    assert negotiate_encoding("br, gzip;q=0.8") == "gzip"
+    assert negotiate_encoding("identity, gzip;q=0.5") is None
+    assert negotiate_encoding("*") == "gzip"
+
+
+def test_columnar_page_keeps_every_item():
+    page = _page(3)
+    response = page_response(page, SRC_PREFIX, accept=COLUMNAR_JSON)
+    body = orjson.loads(response.body)
+
+    assert response.media_type == COLUMNAR_JSON
+    assert body["src_prefix"] == SRC_PREFIX
+    assert body["items"]["title"] == [item["title"] for item in page["items"]]
+    assert [SRC_PREFIX + path for path in body["items"]["path"]] == [
+        item["src"] for item in page["items"]
+    ]
+
+
+def test_large_pages_are_compressed(monkeypatch):
+    monkeypatch.setattr(negotiation, "brotli", None)
+    page = _page(200)
+    response = page_response(page, SRC_PREFIX, None, "gzip", compress_min_size=1024)
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert orjson.loads(gzip.decompress(response.body)) == orjson.loads(orjson.dumps(page))
+
+    response = page_response(_page(1), SRC_PREFIX, None, "gzip", compress_min_size=1024)
+    assert "Content-Encoding" not in response.headers
+    assert response.headers["Vary"] == "Accept, Accept-Encoding"
+
+
+def test_msgpack_page():
+    page = _page(2)
+    response = page_response(page, SRC_PREFIX, accept="application/x-msgpack")
+    body = msgpack.unpackb(response.body, timestamp=3)
+
+    assert response.media_type == MSGPACK
+    assert body["items"]["id"] == [str(item["id"]) for item in page["items"]]
+    assert body["items"]["modified_at"] == [item["modified_at"] for item in page["items"]]
+
+
+def test_brotli_is_preferred():
+    assert negotiate_encoding("gzip;q=0.9, br") == "br"
+    assert negotiate_encoding("*") == "br"
+    page = _page(200)
+    response = page_response(page, SRC_PREFIX, None, "br", compress_min_size=1024)
+    assert response.headers["Content-Encoding"] == "br"
+    assert orjson.loads(brotli.decompress(response.body)) == orjson.loads(orjson.dumps(page))
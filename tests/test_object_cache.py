@@ -0,0 +1,78 @@
+import os
+
+from app.metrics import metrics
+from app.s3.cache import ObjectCache
+
+
+def test_memory_lru_budget():
+    cache = ObjectCache(max_object_size=10, memory_budget=20)
+    cache.put("a", b"a" * 10)
+    cache.put("b", b"b" * 10)
+    assert cache.get("a") == b"a" * 10  # "b" becomes least recently used
+    cache.put("c", b"c" * 10)
+    assert cache.get("b") is None
+    assert cache.get("a") == b"a" * 10
+    assert cache.get("c") == b"c" * 10
+
+
+def test_large_objects_are_not_cached():
+    cache = ObjectCache(max_object_size=10, memory_budget=100)
+    cache.put("big", b"x" * 11)
+    assert not cache.accepts(11)
+    assert cache.get("big") is None
+
+
+def test_disk_tier(tmp_path):
+    cache = ObjectCache(
+        max_object_size=10, memory_budget=10, disk_dir=str(tmp_path), disk_budget=15
+    )
+    cache.put("a", b"a" * 10)
+    cache.put("b", b"b" * 10)  # "a" spills to disk
+
+    hits = metrics.snapshot()["counters"].get("s3.cache.hits.disk", 0)
+    mapped = cache.get("a")
+    assert mapped[:] == b"a" * 10
+    mapped.close()
+    assert metrics.snapshot()["counters"]["s3.cache.hits.disk"] == hits + 1
+
+    cache.put("c", b"c" * 10)  # "b" spills, "a" is evicted from disk
+    assert cache.get("a") is None
+    assert not (tmp_path / str(os.getpid()) / "a").exists()
+
+
+def test_invalidate(tmp_path):
+    cache = ObjectCache(
+        max_object_size=10, memory_budget=10, disk_dir=str(tmp_path), disk_budget=100
+    )
+    cache.put("a", b"a" * 10)
+    cache.put("b", b"b" * 10)
+    cache.invalidate("a")
+    cache.invalidate("b")
+    assert cache.get("a") is None
+    assert cache.get("b") is None
+    assert list((tmp_path / str(os.getpid())).iterdir()) == []
+
+
+def test_workers_keep_separate_directories(tmp_path):
+    other_worker = tmp_path / "1"
+    other_worker.mkdir()
+    (other_worker / "a").write_bytes(b"x" * 10)
+
+    cache = ObjectCache(
+        max_object_size=10, memory_budget=10, disk_dir=str(tmp_path), disk_budget=100
+    )
+    cache.put("a", b"a" * 10)
+    cache.put("b", b"b" * 10)  # "a" spills to disk
+    assert cache.disk_dir == str(tmp_path / str(os.getpid()))
+    assert (other_worker / "a").read_bytes() == b"x" * 10
+
+
+def test_missing_disk_file_is_a_miss(tmp_path):
+    cache = ObjectCache(
+        max_object_size=10, memory_budget=10, disk_dir=str(tmp_path), disk_budget=100
+    )
+    cache.put("a", b"a" * 10)
+    cache.put("b", b"b" * 10)  # "a" spills to disk
+    os.remove(os.path.join(cache.disk_dir, "a"))
+    assert cache.get("a") is None
+    assert cache._disk_bytes == 0
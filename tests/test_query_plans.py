@@ -0,0 +1,226 @@
+import json
+
+import pytest
+import pytest_asyncio
+
+from sqlalchemy import text
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ClauseElement, Executable
+
+from app.db.core import engine, session_factory
+from app.db.repositories.storage import (
+    FILE_BY_PATH_QUERY,
+    IN_SUBTREE_QUERY,
+    ITEM_EXISTS_QUERY,
+    ITEM_ID_BY_PATH_QUERY,
+    ITEM_PATH_QUERY,
+    ParentFilter,
+    SortDirection,
+    SortKey,
+    StorageRepository,
+    _listing_statement,
+    _page_number_statement,
+)
+
+pytestmark = pytest.mark.asyncio
+
+# 20 root folders, 50 folders in each, 50 files in every one of those
+ROOTS = 20
+FOLDERS = 50
+FILES = 50
+
+SEED_QUERIES = (
+    """INSERT INTO item (item_id, name, type)
+SELECT md5('root' || i)::uuid, 'root' || i, 'd' FROM generate_series(1, :roots) i""",
+    """INSERT INTO item (item_id, name, type, parent_id)
+SELECT md5(p.name || '/folder' || i)::uuid, 'folder' || i, 'd', p.item_id
+FROM item p, generate_series(1, :folders) i WHERE p.parent_id IS NULL""",
+    """INSERT INTO item (item_id, name, type, parent_id, size, content_type, checksum, modified_at)
+SELECT md5(p.path || '/file' || i)::uuid, 'file' || i || '.txt', '-', p.item_id,
+    i * 1024, 'text/plain', md5(p.path || i), now() - i * interval '1 hour'
+FROM item p, generate_series(1, :files) i WHERE p.type = 'd' AND p.parent_id IS NOT NULL""",
+)
+
+
+class Explain(Executable, ClauseElement):
+    inherit_cache = False
+
+    def __init__(self, statement) -> None:
+        self.statement = statement
+
+
+@compiles(Explain, "postgresql")
+def _compile_explain(element, compiler, **kw):
+    return "EXPLAIN (FORMAT JSON) " + compiler.process(element.statement, **kw)
+
+
+def _nodes(plan: dict):
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from _nodes(child)
+
+
+@pytest_asyncio.fixture(scope="module")
+async def seeded():
+    async with engine.begin() as conn:
+        for query in SEED_QUERIES:
+            await conn.execute(
+                text(query), {"roots": ROOTS, "folders": FOLDERS, "files": FILES}
+            )
+    async with engine.connect() as conn:
+        await conn.execution_options(isolation_level="AUTOCOMMIT")
+        await conn.execute(text("VACUUM ANALYZE item"))
+    try:
+        yield
+    finally:
+        async with engine.begin() as conn:
+            await conn.execute(text("TRUNCATE item, item_id_registry"))
+
+
+@pytest_asyncio.fixture(scope="function")
+async def repo(seeded):
+    async with session_factory() as session:
+        yield StorageRepository(session)
+
+
+@pytest_asyncio.fixture(scope="function")
+async def sample(repo: StorageRepository):
+    # a folder in the middle of the tree and one of its files
+    row = (
+        await repo.session.execute(
+            text(
+                "SELECT f.item_id, f.parent_id, f.path, p.parent_id AS root_id "
+                "FROM item f JOIN item p ON p.item_id = f.parent_id "
+                "WHERE f.path = 'root7/folder25/file25.txt'"
+            )
+        )
+    ).one()
+    return row
+
+
+@pytest_asyncio.fixture(scope="function")
+async def full_scan_cost(repo: StorageRepository) -> float:
+    # budgets are shares of reading the whole table, so they hold for any
+    # size of the seed
+    result = await repo.session.execute(text("EXPLAIN (FORMAT JSON) SELECT * FROM item"))
+    return _top_plan(result.scalar())["Total Cost"]
+
+
+def _top_plan(explained) -> dict:
+    if isinstance(explained, str):
+        explained = json.loads(explained)
+    return explained[0]["Plan"]
+
+
+async def _explain(repo: StorageRepository, statement, params: dict) -> dict:
+    result = await repo.session.execute(Explain(statement), params)
+    return _top_plan(result.scalar())
+
+
+def _assert_plan(
+    plan: dict,
+    full_scan_cost: float,
+    cost_share: float,
+    max_rows: int,
+    allow_seq_scan: bool = False,
+) -> None:
+    if not allow_seq_scan:
+        scanned = [
+            node.get("Relation Name")
+            for node in _nodes(plan)
+            if node["Node Type"].endswith("Seq Scan")
+        ]
+        assert not scanned, f"sequential scan of {scanned}"
+    assert plan["Total Cost"] <= full_scan_cost * cost_share, (
+        f"cost {plan['Total Cost']} over {cost_share:.0%} of a full scan "
+        f"({full_scan_cost})"
+    )
+    assert plan["Plan Rows"] <= max_rows, f"{plan['Plan Rows']} rows estimated"
+
+
+# A listing reads one partition, a lookup by item_id or path probes an index
+# in each of the 16; budgets leave room for that but not for reading a
+# partition or the whole table
+@pytest.mark.parametrize("order", list(SortKey))
+@pytest.mark.parametrize("direction", list(SortDirection))
+async def test_folder_page(repo, sample, full_scan_cost, order, direction):
+    statement = _listing_statement("rows", ParentFilter.FOLDER, False, order, direction)
+    params = {"parent_id": sample.parent_id, "limit": 50, "offset": 0}
+    plan = await _explain(repo, statement, params)
+    _assert_plan(plan, full_scan_cost, 0.1, 50)
+
+
+async def test_folder_keyset_page(repo, sample, full_scan_cost):
+    statement = _listing_statement(
+        "rows", ParentFilter.FOLDER, False, SortKey.NAME, SortDirection.ASC, True
+    )
+    params = {
+        "parent_id": sample.parent_id,
+        "limit": 50,
+        "after_rank": True,
+        "after_key": "file25.txt",
+        "after_id": sample.item_id,
+    }
+    plan = await _explain(repo, statement, params)
+    _assert_plan(plan, full_scan_cost, 0.1, 50)
+
+
+async def test_root_page(repo, full_scan_cost):
+    statement = _listing_statement("rows", ParentFilter.ROOT, False)
+    plan = await _explain(repo, statement, {"limit": 50, "offset": 0})
+    _assert_plan(plan, full_scan_cost, 0.1, 50)
+
+
+async def test_folder_count(repo, sample, full_scan_cost):
+    statement = _listing_statement("count", ParentFilter.FOLDER, False)
+    plan = await _explain(repo, statement, {"parent_id": sample.parent_id})
+    _assert_plan(plan, full_scan_cost, 0.1, 1)
+
+
+async def test_search(repo, full_scan_cost):
+    # LIKE '%text%' cannot use a b-tree, a search reads every partition; the
+    # budget still catches sorting or joining on top of that
+    statement = _listing_statement("rows", ParentFilter.ANY, True)
+    params = {"pattern": "%file25%", "limit": 50, "offset": 0}
+    plan = await _explain(repo, statement, params)
+    _assert_plan(plan, full_scan_cost, 1.5, 50, allow_seq_scan=True)
+
+    statement = _listing_statement("count", ParentFilter.ANY, True)
+    plan = await _explain(repo, statement, {"pattern": "%file25%"})
+    _assert_plan(plan, full_scan_cost, 1.5, 1, allow_seq_scan=True)
+
+
+async def test_page_number(repo, sample, full_scan_cost):
+    statement = _page_number_statement(False)
+    params = {"parent_id": sample.parent_id, "item_id": sample.item_id, "limit": 50}
+    plan = await _explain(repo, statement, params)
+    _assert_plan(plan, full_scan_cost, 0.1, 10)
+
+
+@pytest.mark.parametrize(
+    "statement", [FILE_BY_PATH_QUERY, ITEM_ID_BY_PATH_QUERY], ids=["file", "item_id"]
+)
+async def test_path_lookup(repo, sample, full_scan_cost, statement):
+    plan = await _explain(repo, statement, {"path": sample.path})
+    _assert_plan(plan, full_scan_cost, 0.2, 20)
+
+
+async def test_item_lookups(repo, sample, full_scan_cost):
+    # the index on item_id is per partition, so every partition is probed
+    for statement, params in (
+        (ITEM_EXISTS_QUERY, {"item_id": sample.item_id}),
+        (IN_SUBTREE_QUERY, {"item_id": sample.item_id, "root_id": sample.root_id}),
+    ):
+        plan = await _explain(repo, statement, params)
+        _assert_plan(plan, full_scan_cost, 0.2, 20)
+
+
+async def test_breadcrumbs(repo, sample, full_scan_cost):
+    plan = await _explain(repo, ITEM_PATH_QUERY, {"item_id": sample.item_id})
+    _assert_plan(plan, full_scan_cost, 0.5, 100)
+
+
+async def test_subtree(repo, sample, full_scan_cost):
+    statement = repo._subtree_rows_query(sample.parent_id, True, None)
+    plan = await _explain(repo, statement, {})
+    _assert_plan(plan, full_scan_cost, 0.5, FILES * 10)
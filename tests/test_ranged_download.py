@@ -0,0 +1,104 @@
+import asyncio
+import random
+from types import SimpleNamespace
+
+import pytest
+
+from app.s3.admission import AdmissionLane, Lane, S3Overloaded
+from app.s3.connector import iter_ranges
+from app.services.storage import FileStorageService
+
+pytestmark = pytest.mark.asyncio
+
+
+class FakeObject:
+    def __init__(self, content: bytes) -> None:
+        self.content = content
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.requested = []
+
+    async def fetch(self, start: int, end: int) -> bytes:
+        self.requested.append((start, end))
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            # later ranges often finish first
+            await asyncio.sleep(random.random() / 100)
+            return self.content[start : end + 1]
+        finally:
+            self.in_flight -= 1
+
+
+async def test_ranges_arrive_in_order():
+    obj = FakeObject(bytes(range(256)) * 40 + b"tail")
+    chunks = [chunk async for chunk in iter_ranges(obj.fetch, len(obj.content), 1000, 3)]
+    assert b"".join(chunks) == obj.content
+    assert [len(chunk) for chunk in chunks[:-1]] == [1000] * 10
+    assert obj.requested[-1] == (10000, len(obj.content) - 1)
+    assert obj.max_in_flight <= 3
+
+
+async def test_read_ahead_is_bounded():
+    obj = FakeObject(b"x" * 10000)
+    ranges = iter_ranges(obj.fetch, len(obj.content), 100, 4)
+    await anext(ranges)
+    await asyncio.sleep(0.05)
+    # one part handed out, at most four fetched or fetching ahead of it
+    assert len(obj.requested) == 4
+    await ranges.aclose()
+
+
+class FakeStorage:
+    def __init__(self, size: int) -> None:
+        self.row = SimpleNamespace(
+            object_key="key", size=size, content_type=None, checksum=None, modified_at=None
+        )
+
+    async def get_file_by_path(self, path):
+        return self.row
+
+    async def rollback(self):
+        pass
+
+
+class AdmittedObject(FakeObject):
+    def __init__(self, content: bytes, lane: AdmissionLane) -> None:
+        super().__init__(content)
+        self.lane = lane
+
+    def file_path(self, key):
+        return None
+
+    async def download_range(self, key, start, end, queue=False):
+        async with self.lane.admit(queue):
+            return await self.fetch(start, end)
+
+
+def _ranged_service(content: bytes, lane: AdmissionLane):
+    return FileStorageService(
+        FakeStorage(len(content)),
+        AdmittedObject(content, lane),
+        ranged_download_threshold=1,
+        ranged_download_part_size=100,
+        ranged_download_concurrency=4,
+    )
+
+
+async def test_full_lane_rejects_before_the_response():
+    lane = AdmissionLane(Lane.DOWNLOAD, 1, 0, retry_after=1)
+    await lane.acquire()
+    service = _ranged_service(b"x" * 1000, lane)
+    with pytest.raises(S3Overloaded):
+        await service.get_file_by_path("file")
+    lane.release()
+
+
+async def test_admitted_download_queues_its_ranges():
+    # one slot and no queue: every range after the first has to wait for it
+    lane = AdmissionLane(Lane.DOWNLOAD, 1, 0, retry_after=1)
+    content = bytes(range(256)) * 4
+    response = await _ranged_service(content, lane).get_file_by_path("file")
+    body = b"".join([chunk async for chunk in response.body_iterator])
+    assert body == content
+    assert lane.active == 0
@@ -0,0 +1,103 @@
+from contextlib import nullcontext
+from datetime import datetime, timedelta, timezone
+from uuid import uuid4
+
+import pytest
+
+import reconcile as reconcile_module
+from app.s3.sharding import HashRing, ShardedS3Connector
+from reconcile import reconcile
+
+pytestmark = pytest.mark.asyncio
+
+OLD = datetime.now(timezone.utc) - timedelta(days=1)
+NEW = datetime.now(timezone.utc)
+
+
+class FakeRepo:
+    def __init__(self, ids):
+        self.ids = sorted(ids)
+
+    async def iter_file_rows(self, *, batch_size=2):
+        for i in range(0, len(self.ids), batch_size):
+            yield [(item_id, f"path/{item_id}") for item_id in self.ids[i : i + batch_size]]
+
+
+class FakeConnector:
+    def __init__(self, objects):
+        self.objects = sorted(objects, key=lambda obj: obj["Key"])
+        self.removed = []
+
+    async def iter_objects(self, page_size=2):
+        for i in range(0, len(self.objects), page_size):
+            yield self.objects[i : i + page_size]
+
+    async def remove_items(self, keys, batch_count=50):
+        self.removed.extend(keys)
+
+
+class FakeShard(FakeConnector):
+    multipart_chunk_size = 1024
+    debug = False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+
+async def test_merge_join():
+    shared = [uuid4() for _ in range(5)]
+    dangling = [uuid4() for _ in range(3)]
+    orphan_old = [str(uuid4()) for _ in range(4)]
+    orphan_new = str(uuid4())
+
+    repo = FakeRepo(shared + dangling)
+    connector = FakeConnector(
+        [{"Key": str(item_id), "LastModified": OLD} for item_id in shared]
+        + [{"Key": key, "LastModified": OLD} for key in orphan_old]
+        + [{"Key": orphan_new, "LastModified": NEW}]
+    )
+
+    report = await reconcile(repo, connector, delete_orphans=True, batches_per_second=0)
+
+    assert report.orphans == 5
+    assert report.dangling == 3
+    assert report.skipped_recent == 1
+    assert sorted(connector.removed) == sorted(orphan_old)
+
+
+async def test_report_only():
+    connector = FakeConnector([{"Key": "stray", "LastModified": OLD}])
+    report = await reconcile(FakeRepo([]), connector)
+    assert report.orphans == 1
+    assert connector.removed == []
+
+
+async def test_run_reconciles_every_shard(monkeypatch):
+    ring = HashRing(["a", "b"])
+    orphans = [str(uuid4()) for _ in range(20)]
+    shards = {
+        name: FakeShard(
+            [
+                {"Key": key, "LastModified": OLD}
+                for key in orphans
+                if ring.shard_for(key) == name
+            ]
+        )
+        for name in ring.shard_names
+    }
+    assert all(shard.objects for shard in shards.values())
+
+    monkeypatch.setattr(
+        reconcile_module, "make_s3_connector", lambda: ShardedS3Connector(shards)
+    )
+    monkeypatch.setattr(reconcile_module, "session_factory", nullcontext)
+    monkeypatch.setattr(reconcile_module, "StorageRepository", lambda session: FakeRepo([]))
+    await reconcile_module.run(
+        delete_orphans=True, min_age_seconds=3600, batches_per_second=0
+    )
+
+    for shard in shards.values():
+        assert sorted(shard.removed) == [obj["Key"] for obj in shard.objects]
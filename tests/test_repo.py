@@ -1,4 +1,3 @@
-import asyncio
 import logging
 import os
 
@@ -20,14 +19,6 @@ print(os.getcwd())
 pytestmark = pytest.mark.asyncio
 
 
-@pytest.fixture(scope="session")
-def event_loop():
-    policy = asyncio.get_event_loop_policy()
-    loop = policy.new_event_loop()
-    yield loop
-    loop.close()
-
-
 @pytest_asyncio.fixture(scope="function")
 async def repo():
     async with session_factory() as session:
@@ -98,3 +89,165 @@ async def test_getting_by_path(repo: StorageRepository):
     await repo.commit()
     found_folder_id = await repo.get_item_id_by_path("/".join([root_folder_name, folder_name]))
     assert found_folder_id == folder_id
+
+
+async def test_subtree_streaming(repo: StorageRepository):
+    root_folder_id = uuid4()
+    repo.create_item(root_folder_id, "root", ItemType.FOLDER)
+    inner_folder_id = uuid4()
+    repo.create_item(inner_folder_id, "inner", ItemType.FOLDER, parent_id=root_folder_id)
+    for i in range(5):
+        repo.create_item(uuid4(), f"file{i}", ItemType.FILE, parent_id=inner_folder_id)
+    await repo.commit()
+
+    batches = [
+        batch async for batch in repo.iter_subtree(root_folder_id, batch_size=2)
+    ]
+    assert all(len(batch) <= 2 for batch in batches)
+    rows = [row for batch in batches for row in batch]
+    assert len(rows) == 7
+    assert {row.path for row in rows if row.type == ItemType.FILE.value} == {
+        f"root/inner/file{i}" for i in range(5)
+    }
+
+    children = [
+        row
+        async for batch in repo.iter_subtree(root_folder_id, include_root=False)
+        for row in batch
+    ]
+    assert root_folder_id not in {row.item_id for row in children}
+
+
+async def test_moving_rewrites_descendant_paths(repo: StorageRepository):
+    source_id, target_id, inner_id = uuid4(), uuid4(), uuid4()
+    repo.create_item(source_id, "source", ItemType.FOLDER)
+    repo.create_item(target_id, "target", ItemType.FOLDER)
+    repo.create_item(inner_id, "inner", ItemType.FOLDER, parent_id=source_id)
+    repo.create_item(uuid4(), "file", ItemType.FILE, parent_id=inner_id)
+    await repo.commit()
+
+    await repo.change_item_parent(source_id, target_id, "renamed")
+    await repo.commit()
+
+    assert await repo.get_item_id_by_path("target/renamed/inner") == inner_id
+    assert await repo.get_item_id_by_path("target/renamed/inner/file") is not None
+    assert await repo.get_item_id_by_path("source/inner/file") is None
+
+    file_id = await repo.get_item_id_by_path("target/renamed/inner/file")
+    breadcrumbs = [item.item_id for item in await repo.get_item_path(file_id)]
+    assert breadcrumbs == [target_id, source_id, inner_id, file_id]
+    assert await repo.is_in_subtree(file_id, source_id)
+    assert await repo.is_in_subtree(source_id, source_id)
+    assert not await repo.is_in_subtree(target_id, source_id)
+
+
+async def test_snapshot_round_trip(repo: StorageRepository, tmp_path):
+    from snapshot import export_snapshot, import_snapshot
+
+    root_folder_id = uuid4()
+    repo.create_item(root_folder_id, "root", ItemType.FOLDER)
+    inner_folder_id = uuid4()
+    repo.create_item(inner_folder_id, "inner", ItemType.FOLDER, parent_id=root_folder_id)
+    repo.create_item(uuid4(), "file", ItemType.FILE, parent_id=inner_folder_id)
+    await repo.commit()
+
+    for format_ in ("csv", "binary"):
+        path = str(tmp_path / f"items.{format_}")
+        await export_snapshot(path, format_, inner_folder_id)
+        assert await import_snapshot(path, format_) == (2, 2)
+        assert await repo.get_item_id_by_path("inner/file") is not None
+        assert await repo.get_item_id_by_path("root/inner") is None
+
+    # constraints and the path trigger survive the swap
+    repo.create_item(uuid4(), "other", ItemType.FILE, parent_id=inner_folder_id)
+    await repo.commit()
+    assert await repo.get_item_id_by_path("inner/other") is not None
+
+
+async def test_keyset_listing_by_size(repo: StorageRepository):
+    from app.db.repositories.storage import SortDirection, SortKey
+
+    folder_id = uuid4()
+    repo.create_item(folder_id, "folder", ItemType.FOLDER)
+    repo.create_item(uuid4(), "sub", ItemType.FOLDER, parent_id=folder_id)
+    for i in range(5):
+        repo.create_item(
+            uuid4(), f"file{i}", ItemType.FILE, parent_id=folder_id, size=(i * 7) % 5
+        )
+    await repo.commit()
+
+    for direction in SortDirection:
+        names, after = [], None
+        while True:
+            rows = await repo.list_item_rows(
+                folder_id, None, 2, order=SortKey.SIZE, direction=direction, after=after
+            )
+            names.extend(row.name for row in rows)
+            if len(rows) < 2:
+                break
+            after = (rows[-1].sort_rank, rows[-1].sort_key, rows[-1].item_id)
+
+        expected = ["sub", "file0", "file3", "file1", "file4", "file2"]
+        if direction == SortDirection.DESC:
+            expected.reverse()
+        assert names == expected
+
+
+async def test_parent_constraint_across_partitions(repo: StorageRepository):
+    # the item table is partitioned on parent_id, the foreign key is emulated
+    root_id, other_id, folder_id, file_id = uuid4(), uuid4(), uuid4(), uuid4()
+    repo.create_item(root_id, "root", ItemType.FOLDER)
+    repo.create_item(other_id, "other", ItemType.FOLDER)
+    repo.create_item(folder_id, "folder", ItemType.FOLDER, parent_id=root_id)
+    repo.create_item(file_id, "file", ItemType.FILE, parent_id=folder_id)
+    await repo.commit()
+
+    # moving changes parent_id and usually the partition
+    await repo.change_item_parent(folder_id, other_id)
+    await repo.commit()
+    assert await repo.get_item_id_by_path("other/folder/file") == file_id
+
+    await repo.remove_item(other_id)
+    await repo.commit()
+    assert not await repo.is_item_exists(folder_id)
+    assert not await repo.is_item_exists(file_id)
+    assert await repo.is_item_exists(root_id)
+
+    with pytest.raises(IntegrityError):
+        repo.create_item(uuid4(), "orphan", ItemType.FILE, parent_id=uuid4())
+        await repo.commit()
+    await repo.rollback()
+
+
+async def test_item_id_unique_across_partitions(repo: StorageRepository):
+    # the per-partition unique index alone misses a copy under another parent
+    first_id, second_id, file_id = uuid4(), uuid4(), uuid4()
+    repo.create_item(first_id, "first", ItemType.FOLDER)
+    repo.create_item(second_id, "second", ItemType.FOLDER)
+    repo.create_item(file_id, "file", ItemType.FILE, parent_id=first_id)
+    await repo.commit()
+
+    with pytest.raises(IntegrityError):
+        repo.create_item(file_id, "file", ItemType.FILE, parent_id=second_id)
+        await repo.commit()
+    await repo.rollback()
+
+    # a move goes through the registry as a delete and an insert
+    await repo.change_item_parent(file_id, second_id)
+    await repo.commit()
+    assert await repo.get_item_id_by_path("second/file") == file_id
+
+
+async def test_replacing_file_object(repo: StorageRepository):
+    file_id, new_key = uuid4(), uuid4()
+    repo.create_item(file_id, "file", ItemType.FILE, size=1)
+    await repo.commit()
+    assert (await repo.get_file_by_path("file")).object_key == file_id
+
+    old_key = await repo.replace_file_object(file_id, new_key, size=2)
+    await repo.commit()
+    assert old_key == file_id
+    row = await repo.get_file_by_path("file")
+    assert (row.item_id, row.object_key, row.size) == (file_id, new_key, 2)
+    batches = [batch async for batch in repo.iter_file_rows()]
+    assert [tuple(row) for batch in batches for row in batch] == [(new_key, "file")]
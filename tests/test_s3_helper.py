@@ -1,5 +1,3 @@
-import asyncio
-
 import pytest
 import pytest_asyncio
 
@@ -9,14 +7,6 @@ from app.settings import get_settings
 pytestmark = pytest.mark.asyncio
 
 
-@pytest.fixture(scope="session")
-def event_loop():
-    policy = asyncio.get_event_loop_policy()
-    loop = policy.new_event_loop()
-    yield loop
-    loop.close()
-
-
 @pytest_asyncio.fixture(scope="function")
 async def connector():
     settings = get_settings()
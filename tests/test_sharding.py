@@ -0,0 +1,126 @@
+from uuid import uuid4
+
+import pytest
+from botocore.exceptions import ClientError
+
+from app.s3.sharding import HashRing, ShardedS3Connector
+from rebalance_shards import rebalance
+
+pytestmark = pytest.mark.asyncio
+
+KEYS = [str(uuid4()) for _ in range(2000)]
+
+
+class FakeBody:
+    def __init__(self, content):
+        self.content = content
+
+    async def iter_chunks(self, chunk_size):
+        yield self.content
+
+
+class FakeShard:
+    multipart_chunk_size = 1024
+    debug = False
+
+    def __init__(self):
+        self.objects = {}
+        self.entered = 0
+
+    async def __aenter__(self):
+        self.entered += 1
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    async def upload_file(self, key, raw_content):
+        self.objects[key] = raw_content
+
+    async def upload_stream(self, key, chunks):
+        self.objects[key] = b"".join([chunk async for chunk in chunks])
+        return len(self.objects[key])
+
+    async def download_object(self, key):
+        if key not in self.objects:
+            raise ClientError({"Error": {"Code": "NoSuchKey"}}, "GetObject")
+        return {"Body": FakeBody(self.objects[key])}
+
+    async def remove_items(self, keys, batch_count=50):
+        for key in keys:
+            self.objects.pop(key, None)
+
+    async def iter_objects(self, page_size=1000):
+        keys = sorted(self.objects)
+        for i in range(0, len(keys), page_size):
+            yield [{"Key": key} for key in keys[i : i + page_size]]
+
+
+class FakeRepo:
+    def __init__(self, ids):
+        self.ids = sorted(ids)
+
+    async def iter_file_rows(self, *, batch_size=100):
+        for i in range(0, len(self.ids), batch_size):
+            yield [(item_id, "") for item_id in self.ids[i : i + batch_size]]
+
+
+async def test_adding_a_shard_only_moves_keys_onto_it():
+    before = HashRing(["a", "b", "c"])
+    after = HashRing(["a", "b", "c", "d"])
+
+    moved = [key for key in KEYS if before.shard_for(key) != after.shard_for(key)]
+    assert all(after.shard_for(key) == "d" for key in moved)
+    assert 0.15 < len(moved) / len(KEYS) < 0.35
+
+    counts = {name: 0 for name in after.shard_names}
+    for key in KEYS:
+        counts[after.shard_for(key)] += 1
+    assert min(counts.values()) > len(KEYS) / 4 * 0.7
+
+
+async def test_routing_and_merged_listing():
+    shards = {name: FakeShard() for name in "abc"}
+    keys = KEYS[:200]
+    async with ShardedS3Connector(shards) as connector:
+        for key in keys:
+            await connector.upload_file(key, key.encode())
+        assert all(shards[connector.ring.shard_for(key)].objects[key] for key in keys)
+        assert all(shard.entered == 1 for shard in shards.values())
+
+        listed = [
+            obj["Key"]
+            async for page in connector.iter_objects(page_size=30)
+            for obj in page
+        ]
+        assert listed == sorted(keys)
+
+        await connector.remove_items(keys[:100])
+        assert sum(len(shard.objects) for shard in shards.values()) == 100
+
+
+async def test_rebalance_moves_objects_and_reads_fall_back():
+    shards = {name: FakeShard() for name in "ab"}
+    keys = KEYS[:300]
+    async with ShardedS3Connector(dict(shards)) as connector:
+        for key in keys:
+            await connector.upload_file(key, key.encode())
+
+    shards["c"] = FakeShard()
+    async with ShardedS3Connector(shards, ["a", "b"]) as connector:
+        misplaced = [key for key in keys if connector.ring.shard_for(key) == "c"]
+        assert misplaced and not shards["c"].objects
+
+        # not moved yet, served from the previous shard
+        response = await connector.download_object(misplaced[0])
+        assert [chunk async for chunk in response["Body"].iter_chunks(1024)] == [
+            misplaced[0].encode()
+        ]
+
+        report = await rebalance(FakeRepo(keys), connector)
+        assert report.moved == len(misplaced)
+        assert sorted(shards["c"].objects) == sorted(misplaced)
+        assert sum(len(shard.objects) for shard in shards.values()) == len(keys)
+
+        report = await rebalance(FakeRepo(keys), connector)
+        assert report.missing == len(misplaced)
@@ -0,0 +1,141 @@
+import asyncio
+
+import pytest
+
+from app.metrics import metrics
+from app.services.singleflight import SingleFlight, SubscriberDropped
+
+pytestmark = pytest.mark.asyncio
+
+
+class FakeSource:
+    def __init__(self, chunks: list[bytes]) -> None:
+        self.chunks = chunks
+        self.opened = 0
+        self.release = asyncio.Event()
+
+    async def open(self):
+        self.opened += 1
+        return self.iter_chunks()
+
+    async def iter_chunks(self):
+        for chunk in self.chunks:
+            await self.release.wait()
+            yield chunk
+
+
+async def _read(chunks) -> bytes:
+    return b"".join([chunk async for chunk in chunks])
+
+
+async def test_identical_calls_share_one_call():
+    flight = SingleFlight()
+    calls = []
+    release = asyncio.Event()
+
+    async def fetch():
+        calls.append(1)
+        await release.wait()
+        return {"items": []}
+
+    coalesced = metrics.snapshot()["counters"].get("singleflight.test.coalesced", 0)
+    tasks = [asyncio.create_task(flight.do("test", "a", fetch)) for _ in range(5)]
+    other = asyncio.create_task(flight.do("test", "b", fetch))
+    await asyncio.sleep(0)
+    release.set()
+    results = await asyncio.gather(*tasks, other)
+
+    assert len(calls) == 2
+    assert all(result is results[0] for result in results[:5])
+    counters = metrics.snapshot()["counters"]
+    assert counters["singleflight.test.coalesced"] - coalesced == 4
+
+
+async def test_waiter_takes_over_from_cancelled_leader():
+    flight = SingleFlight()
+    started = asyncio.Event()
+
+    async def hang():
+        started.set()
+        await asyncio.Event().wait()
+
+    async def fetch():
+        return "done"
+
+    leader = asyncio.create_task(flight.do("test", "a", hang))
+    await started.wait()
+    waiter = asyncio.create_task(flight.do("test", "a", fetch))
+    await asyncio.sleep(0)
+    leader.cancel()
+    assert await waiter == "done"
+
+
+async def test_errors_reach_every_waiter():
+    flight = SingleFlight()
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise KeyError("missing")
+
+    results = await asyncio.gather(
+        *[flight.do("test", "a", fail) for _ in range(3)], return_exceptions=True
+    )
+    assert all(isinstance(result, KeyError) for result in results)
+
+
+async def test_stream_is_read_once_for_all_readers():
+    # the pump reads up to two chunks ahead of the first reader
+    flight = SingleFlight(replay_limit=4, queue_size=2)
+    source = FakeSource([b"ab", b"cd", b"ef"])
+    source.release.set()
+
+    first, pump = await flight.stream("test", "a", source.open)
+    assert await anext(first) == b"ab"
+    # joins late and replays what was buffered
+    second, no_pump = await flight.stream("test", "a", source.open)
+    assert pump is not None and no_pump is None
+
+    first_rest, second_all = await asyncio.gather(_read(first), _read(second))
+    assert (first_rest, second_all) == (b"cdef", b"abcdef")
+    await pump
+    assert source.opened == 1
+
+    third, pump = await flight.stream("test", "a", source.open)
+    assert await _read(third) == b"abcdef"
+    assert source.opened == 2
+
+
+async def test_stream_stops_when_readers_leave():
+    flight = SingleFlight()
+    source = FakeSource([b"x"] * 100)
+    source.release.set()
+
+    chunks, pump = await flight.stream("test", "a", source.open)
+    async for _ in chunks:
+        break
+    await chunks.aclose()
+    await asyncio.wait_for(pump, 1)
+
+
+async def test_reader_that_falls_behind_is_dropped():
+    flight = SingleFlight(queue_size=2, stall_timeout=10)
+    source = FakeSource([b"x"] * 10)
+    source.release.set()
+
+    fast, pump = await flight.stream("test", "a", source.open)
+    slow, _ = await flight.stream("test", "a", source.open)
+    # the slow reader takes nothing, the fast one is not held back by it
+    assert await asyncio.wait_for(_read(fast), 1) == b"x" * 10
+    await asyncio.wait_for(pump, 1)
+    with pytest.raises(SubscriberDropped, match="fell behind"):
+        await _read(slow)
+
+
+async def test_stream_open_error_reaches_reader():
+    flight = SingleFlight()
+
+    async def fail():
+        raise KeyError("missing")
+
+    with pytest.raises(KeyError):
+        await flight.stream("test", "a", fail)
@@ -0,0 +1,18 @@
+from app.services import stale
+from app.services.stale import StaleObjects
+
+
+def test_keys_are_due_after_the_grace_period(monkeypatch):
+    now = 1000.0
+    monkeypatch.setattr(stale.time, "monotonic", lambda: now)
+    objects = StaleObjects(grace=60)
+    objects.defer(["a", "b"])
+    now += 30
+    objects.defer(["c"])
+
+    assert objects.due() == []
+    now += 30
+    assert objects.due() == ["a", "b"]
+    now += 30
+    assert objects.due() == ["c"]
+    assert objects.due() == []
@@ -0,0 +1,136 @@
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from uuid import uuid4
+
+import pytest
+from fastapi import HTTPException
+
+from app.services.storage import MIN_PART_SIZE, FileStorageService
+
+pytestmark = pytest.mark.asyncio
+
+
+class FakeUploads:
+    def __init__(self, upload) -> None:
+        self.uploads = {upload.upload_id: upload}
+        self.pending_removals = []
+
+    async def get_upload(self, upload_id, now):
+        return self.uploads.get(upload_id)
+
+    async def remove_upload(self, upload_id):
+        self.pending_removals.append(upload_id)
+
+    async def commit(self):
+        for upload_id in self.pending_removals:
+            self.uploads.pop(upload_id, None)
+        self.pending_removals = []
+
+    async def rollback(self):
+        self.pending_removals = []
+
+
+class FakeStorage:
+    async def get_item_id_by_path(self, path):
+        return uuid4()
+
+    async def get_file_by_path(self, path):
+        raise RuntimeError("database went away")
+
+    async def rollback(self):
+        pass
+
+
+class FakeConnector:
+    def __init__(self, sizes: list[int]) -> None:
+        self.parts = [
+            {"PartNumber": number, "Size": size, "ETag": '"00"'}
+            for number, size in enumerate(sizes, 1)
+        ]
+        self.completed = False
+        self.removed = []
+
+    async def list_parts(self, key, upload_id):
+        return self.parts
+
+    async def complete_multipart_upload(self, key, upload_id, parts):
+        self.completed = True
+
+    async def upload_stream(self, key, chunks):
+        return len(b"".join([chunk async for chunk in chunks]))
+
+    async def remove_items(self, keys):
+        self.removed.extend(keys)
+
+
+class VanishingFileStorage:
+    # the file is found, then deleted before its object is replaced
+    def __init__(self) -> None:
+        self.created = []
+        self.committed = False
+
+    async def get_item_id_by_path(self, path):
+        return None
+
+    async def get_file_by_path(self, path):
+        return SimpleNamespace(item_id=uuid4())
+
+    async def replace_file_object(self, item_id, object_key, **metadata):
+        return None
+
+    def create_item(self, item_id, name, type_, parent_id=None, **metadata):
+        self.created.append(item_id)
+
+    async def commit(self):
+        self.committed = True
+
+    async def rollback(self):
+        pass
+
+
+def _service(sizes: list[int]):
+    upload = SimpleNamespace(
+        upload_id=uuid4(),
+        file_id=uuid4(),
+        file_path="docs/big.bin",
+        s3_upload_id="s3-upload",
+        expires_at=datetime.now(timezone.utc) + timedelta(hours=1),
+    )
+    connector = FakeConnector(sizes)
+    uploads = FakeUploads(upload)
+    service = FileStorageService(FakeStorage(), connector, upload_repo=uploads)
+    return service, upload, connector, uploads
+
+
+async def test_small_parts_are_rejected_before_s3():
+    service, upload, connector, uploads = _service([MIN_PART_SIZE - 1, 10])
+    with pytest.raises(HTTPException) as raised:
+        await service.complete_upload(upload.upload_id)
+    assert raised.value.status_code == 400
+    assert not connector.completed
+    assert upload.upload_id in uploads.uploads
+
+
+async def test_failed_store_removes_the_session():
+    service, upload, connector, uploads = _service([MIN_PART_SIZE, 10])
+    with pytest.raises(RuntimeError):
+        await service.complete_upload(upload.upload_id)
+    assert connector.completed
+    assert connector.removed == [str(upload.file_id)]
+    assert uploads.uploads == {}
+
+
+async def test_vanished_file_is_stored_as_new():
+    storage = VanishingFileStorage()
+    service = FileStorageService(
+        storage, FakeConnector([]), unique_id_factory=lambda: "new"
+    )
+    await service.upload_file(_chunks(b"content"), "file.txt")
+    assert storage.created == ["new"]
+    assert storage.committed
+    assert service.stale_keys == []
+
+
+async def _chunks(*chunks):
+    for chunk in chunks:
+        yield chunk
@@ -0,0 +1,121 @@
+from collections import namedtuple
+from uuid import uuid4
+from xml.etree import ElementTree
+
+import pytest
+
+from app.db.repositories.storage import ItemType
+from fastapi import HTTPException
+
+from app.services import webdav
+from app.services.storage import FileStorageService
+from app.services.webdav import iter_multistatus, parse_destination
+
+SubtreeRow = namedtuple(
+    "SubtreeRow",
+    (
+        "item_id",
+        "parent_id",
+        "name",
+        "type",
+        "path",
+        "size",
+        "content_type",
+        "checksum",
+        "modified_at",
+    ),
+    defaults=(None, None, None, None),
+)
+
+
+async def _batches(rows, size=2):
+    for i in range(0, len(rows), size):
+        yield rows[i : i + size]
+
+
+@pytest.mark.asyncio
+async def test_multistatus(monkeypatch):
+    monkeypatch.setattr(webdav, "MULTISTATUS_BUFFER_SIZE", 100)
+    folder_id = uuid4()
+    rows = [
+        SubtreeRow(folder_id, None, "docs & co", ItemType.FOLDER.value, "docs & co"),
+        SubtreeRow(uuid4(), folder_id, "a b.txt", ItemType.FILE.value, "docs & co/a b.txt"),
+        SubtreeRow(
+            uuid4(),
+            folder_id,
+            "c.txt",
+            ItemType.FILE.value,
+            "docs & co/c.txt",
+            size=3,
+            checksum="abc",
+        ),
+    ]
+    chunks = [
+        chunk async for chunk in iter_multistatus(_batches(rows), "/file/", include_root_collection=True)
+    ]
+    assert len(chunks) > 1
+
+    tree = ElementTree.fromstring(b"".join(chunks))
+    ns = {"D": "DAV:"}
+    hrefs = [href.text for href in tree.findall("D:response/D:href", ns)]
+    assert hrefs == [
+        "/file/",
+        "/file/docs%20%26%20co/",
+        "/file/docs%20%26%20co/a%20b.txt",
+        "/file/docs%20%26%20co/c.txt",
+    ]
+    collections = tree.findall("D:response/D:propstat/D:prop/D:resourcetype/D:collection", ns)
+    assert len(collections) == 2
+    lengths = tree.findall("D:response/D:propstat/D:prop/D:getcontentlength", ns)
+    assert [length.text for length in lengths] == ["3"]
+
+
+def test_parse_destination():
+    assert parse_destination("http://host/file/a/b%20c/", "/file/") == "a/b c"
+    assert parse_destination("http://other/elsewhere/a", "/file/") is None
+
+
+class FakeTree:
+    # folders "a" and "a/b", the file "a/b/f"
+    def __init__(self) -> None:
+        self.rows = {
+            path: SubtreeRow(uuid4(), None, path.rsplit("/")[-1], type_, path)
+            for path, type_ in (
+                ("a", ItemType.FOLDER),
+                ("a/b", ItemType.FOLDER),
+                ("a/b/f", ItemType.FILE),
+            )
+        }
+        self.removed = []
+
+    def _path(self, item_id):
+        return next(path for path, row in self.rows.items() if row.item_id == item_id)
+
+    async def get_items_by_paths(self, paths):
+        return [self.rows[path] for path in paths if path in self.rows]
+
+    async def get_item_id_by_path(self, path):
+        row = self.rows.get(path)
+        return row.item_id if row else None
+
+    async def is_in_subtree(self, item_id, root_id):
+        path, root = self._path(item_id), self._path(root_id)
+        return path == root or path.startswith(root + "/")
+
+    async def remove_item(self, item_id):
+        self.removed.append(item_id)
+
+    async def rollback(self):
+        pass
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("method", ["move_item_to_path", "copy_item_to_path"])
+async def test_overwriting_an_ancestor_of_the_source(method):
+    tree = FakeTree()
+    service = FileStorageService(tree)
+    with pytest.raises(HTTPException) as raised:
+        await getattr(service, method)("a/b", "a", overwrite=True)
+    assert raised.value.status_code == 409
+    assert tree.removed == []
+    assert service.stale_keys == []